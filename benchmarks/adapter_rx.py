@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# adapter_rx.py
+#
+# MAPS6Adapter receive buffer throughput, run from the repository root:
+#   python3 -m benchmarks.adapter_rx
+
+import os
+import timeit
+
+from libs.SIM7000E.sim_access.adapter import ByteFIFO
+
+MAPS_NBIOT_UART_PORT = 0x00
+FRAME_DATA_LEN = 64
+RESPONSES = 20
+BACKLOG_LINE_LEN = 256 * 1024
+
+
+def hex_read_stream():
+    ''' RESPONSES x +CIPRXGET: 3 responses, one 2920 char hex line each (1460 byte read)
+    '''
+    stream = bytearray()
+    for _ in range(RESPONSES):
+        stream.extend(b'\r\n+CIPRXGET: 3,1460,0\r\n')
+        stream.extend(os.urandom(1460).hex().upper().encode())
+        stream.extend(b'\r\nOK\r\n')
+    return stream, RESPONSES * 4
+
+
+def long_line_stream():
+    ''' One BACKLOG_LINE_LEN byte line, shows the cost of rescanning for a newline
+    '''
+    stream = bytearray(b'A' * BACKLOG_LINE_LEN)
+    stream.extend(b'\r\n')
+    return stream, 1
+
+
+def make_echo_bodies(stream):
+    ''' Split the module output into 0xD0 frame bodies (port, len_L, len_H, data)
+    '''
+    bodies = []
+    for idx in range(0, len(stream), FRAME_DATA_LEN):
+        data = bytes(stream[idx:idx + FRAME_DATA_LEN])
+        bodies.append(bytes((MAPS_NBIOT_UART_PORT, len(data) & 0xFF, len(data) >> 8)) + data)
+    return bodies
+
+
+def run(fifo, bodies):
+    ''' Same pattern as MAPS6Adapter.readline(): put each echo, check for a
+        complete line, read every complete line
+    '''
+    lines = 0
+    for body in bodies:
+        fifo.put(body[3:])
+        while(fifo.has_line()):
+            fifo.readline()
+            lines += 1
+    return lines
+
+
+if __name__ == '__main__':
+    for title, make_stream in (('CIPRXGET=3 responses', hex_read_stream),
+                               ('single long line', long_line_stream)):
+        stream, lines = make_stream()
+        bodies = make_echo_bodies(stream)
+        print(f'{title}: {len(stream)} byte in {len(bodies)} echo frames')
+        capacity = max(ByteFIFO().capacity, len(stream))
+        assert run(ByteFIFO(capacity), bodies) == lines
+        best = min(timeit.repeat(lambda: run(ByteFIFO(capacity), bodies),
+                                 number=5, repeat=5)) / 5
+        print(f'    ByteFIFO: {len(stream) / best / 1e6:6.2f} MB/s ({best * 1e3:.2f} ms)')
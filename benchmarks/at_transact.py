@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# at_transact.py
+#
+# AT query round trip, TX_RX + active RX vs one TXRX_EX exchange.
+# Run from the repository root:
+#   python3 -m benchmarks.at_transact
+
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+QUERIES = 10
+
+
+def measure(func, cache):
+    ''' Median and max of func, every call reaches the module
+    '''
+    samples = []
+    for _ in range(QUERIES):
+        cache.invalidate()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+if __name__ == '__main__':
+    sim = Mega2560Simulator(uart=SIM7000ESimulator()).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    try:
+        tcp = SIM7000E_TPC(MAPS6Adapter(demux))
+        for transact in (False, True):
+            tcp.transact_enabled = transact
+            # no TXRX_EX re-probe while TX_RX is measured
+            tcp.transact_retry_time = 0 if transact else float('inf')
+            print('TXRX_EX' if transact else 'TX_RX + active RX')
+            for name, func in (('CSQ', tcp.network_getCsq),
+                               ('CGATT?', tcp.network_chkAttach),
+                               ('CIPSTATUS', tcp.connected)):
+                median, worst = measure(func, tcp.state_cache)
+                print(f'{name:>12}: median {median * 1e3:6.1f} ms, max {worst * 1e3:6.1f} ms')
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# conn_probe.py
+#
+# libs.uplink.prober.ConnectivityProber against the former
+# os.system('ping ...') of check_connection(). Run from the repository root:
+#   python3 -m benchmarks.conn_probe
+
+import os
+import resource
+import socket
+import time
+
+from libs.uplink.prober import ConnectivityProber
+
+RUNS = 100
+
+
+def cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(func):
+    cpu, start = cpu_time(), time.perf_counter()
+    for _ in range(RUNS):
+        func()
+    return (time.perf_counter() - start) / RUNS, (cpu_time() - cpu) / RUNS
+
+
+def probes_per_hour(prober, stable_s=3600):
+    ''' Probes of a link that stays up for stable_s, from the adaptive interval
+    '''
+    elapsed, interval, count = 0, prober.min_interval, 0
+    while(elapsed < stable_s):
+        elapsed += interval
+        interval = min(interval * 2, prober.max_interval)
+        count += 1
+    return count
+
+
+if __name__ == '__main__':
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(128)
+    port = server.getsockname()[1]
+    try:
+        # ping is not always installed, a shell running 'true' is the floor of its cost
+        wall, cpu = measure(lambda: os.system('true > /dev/null'))
+        print(f'os.system fork/exec only: {wall * 1e3:7.3f} ms wall, {cpu * 1e3:7.3f} ms CPU per check')
+        prober = ConnectivityProber('localhost', port)
+        wall, cpu = measure(prober.probe)
+        print(f'prober TCP connect:       {wall * 1e3:7.3f} ms wall, {cpu * 1e3:7.3f} ms CPU per probe, '
+              f'{prober.dns_lookups} DNS lookup in {RUNS}')
+        wall, _ = measure(prober.is_online)
+        print(f'main loop is_online():    {wall * 1e6:7.3f} us')
+
+        # endpoint down: the probe thread waits, the main loop does not
+        prober = ConnectivityProber('localhost', port, min_interval=0.05, timeout=0.5)
+        changes = []
+        prober.add_listener(changes.append)
+        prober.start()
+        assert prober.wait_online(2)
+        server.close()
+        start = time.perf_counter()
+        while(prober.is_online()):
+            time.sleep(0.005)
+        print(f'link down noticed after {(time.perf_counter() - start) * 1e3:6.1f} ms '
+              f'({prober.down_after} failed probes at the fast interval)')
+        prober.stop()
+        assert changes == [True, False]
+
+        prober = ConnectivityProber('localhost', port)
+        print(f'checks per stable hour: ping every 10 s {3600 // 10}, '
+              f'adaptive prober {probes_per_hour(prober)}')
+    finally:
+        server.close()
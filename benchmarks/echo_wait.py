@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# echo_wait.py
+#
+# CPU cost of waiting for a Mega2560 echo, run from the repository root:
+#   python3 -m benchmarks.echo_wait
+
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.MEGA2560.mega2560 import Mega2560
+
+MAPS_LEADING_CMD = 0xAA
+MAPS_GET_SENSOR_ALL_CMD = 0xB5
+REQUEST = bytes((0xAA, 0x55, 0xB5, 0x4A))
+CALLS = 10
+REPLY_DELAY = 0.2  # second
+
+
+def legacy_wait_echo_command(port, echo_cmd, timeout=1000):
+    ''' Busy-spin wait used before blocking reads
+    '''
+    timeout = time.time() + (timeout / 1000)
+    while(time.time() < timeout):
+        while(port.inWaiting() >= 2):
+            bytes_data = port.read(2)
+            if(bytes_data[0] == MAPS_LEADING_CMD and bytes_data[1] == echo_cmd):
+                return True
+    port.read_all()
+    return False
+
+
+def legacy_get_sensor_all(port):
+    port.write(REQUEST)
+    if(legacy_wait_echo_command(port, MAPS_GET_SENSOR_ALL_CMD)):
+        port.read(46)
+
+
+def measure(func):
+    cpu = time.thread_time()
+    wall = time.perf_counter()
+    for _ in range(CALLS):
+        func()
+    return time.thread_time() - cpu, time.perf_counter() - wall
+
+
+if __name__ == '__main__':
+    sim = Mega2560Simulator(reply_delay=REPLY_DELAY).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = None
+    try:
+        cpu, wall = measure(lambda: legacy_get_sensor_all(port))
+        print(f'busy-spin: {CALLS} reads in {wall:.2f} s wall, '
+              f'{cpu:.3f} s CPU ({cpu / wall * 100:.1f}% of a core)')
+        # the MapsDemux reader owns the port from here on
+        demux = MapsDemux(port)
+        mega2560 = Mega2560(demux)
+        cpu, wall = measure(mega2560.get_sensor_all)
+        print(f' blocking: {CALLS} reads in {wall:.2f} s wall, '
+              f'{cpu:.3f} s CPU ({cpu / wall * 100:.1f}% of a core)')
+    finally:
+        if(demux):
+            demux.close()
+        port.close()
+        sim.stop()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# frame_decode.py
+#
+# GET_SENSOR_ALL decode micro-benchmark, run from the repository root:
+#   python3 -m benchmarks.frame_decode
+
+import random
+import timeit
+import tracemalloc
+
+from libs.MEGA2560.frame import (MAPS_GET_SENSOR_ALL_CMD, MAPS_LEADING_CMD, SENSOR_KEYS,
+                                 decode_sensor_all, sensor_all_checksum, verify_sensor_all)
+
+LOOPS = 20000
+
+
+def legacy_checksum(datas):
+    return (sum([(data) ^ ((idx + 1) % 0x100) for idx, data in enumerate(datas)]) & 0xFF)
+
+
+def legacy_2byte_to_int16(_2byte):
+    return ((_2byte[1] << 8) | _2byte[0])
+
+
+def legacy_decode(payload, rcv_checksums, sensor_data):
+    ''' Decode path of Mega2560.get_sensor_all() before frame.py
+    '''
+    data = bytearray(payload)
+    data.insert(0, MAPS_GET_SENSOR_ALL_CMD)
+    data.insert(0, MAPS_LEADING_CMD)
+    checksum = legacy_checksum(data)
+    if (rcv_checksums[0] != checksum or rcv_checksums[1] != (~checksum & 0xFF)):
+        return None
+    sensor_data['TEMP'] = (legacy_2byte_to_int16(data[2:4])/100)
+    sensor_data['HUMI'] = (legacy_2byte_to_int16(data[4:6])/100)
+    for idx, key in enumerate(SENSOR_KEYS[2:]):
+        sensor_data[key] = legacy_2byte_to_int16(data[6 + idx * 2:8 + idx * 2])
+    return sensor_data
+
+
+def codec_decode(payload, rcv_checksums):
+    if(not verify_sensor_all(payload, rcv_checksums)):
+        return None
+    return decode_sensor_all(payload)
+
+
+def peak_alloc(func):
+    tracemalloc.start()
+    for _ in range(1000):
+        func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    payload = bytes(random.randrange(0x100) for _ in range(44))
+    checksum = sensor_all_checksum(payload)
+    rcv_checksums = bytes((checksum, ~checksum & 0xFF))
+    sensor_data = dict.fromkeys(SENSOR_KEYS, 0)
+
+    assert legacy_decode(payload, rcv_checksums, sensor_data) == \
+        codec_decode(payload, rcv_checksums).as_dict()
+
+    def legacy():
+        return legacy_decode(payload, rcv_checksums, sensor_data)
+
+    def codec():
+        return codec_decode(payload, rcv_checksums)
+
+    for name, func in (('legacy', legacy), ('codec', codec)):
+        best = min(timeit.repeat(func, number=LOOPS, repeat=5))
+        print(f'{name:>8}: {best / LOOPS * 1e6:7.2f} us/frame, '
+              f'peak alloc over 1000 frames {peak_alloc(func)} byte')
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# https_uplink.py
+#
+# libs.uplink.https.HTTPSUplink against the former requests.get() per upload,
+# on the local LASS stand-in. Run from the repository root:
+#   python3 -m benchmarks.https_uplink
+
+import time
+import warnings
+
+import requests
+
+from benchmarks.lass_sim import LassServer
+from libs.uplink.https import HTTPSUplink
+
+PARAMS = {'topic': 'MAPS6', 'device_id': 'B827EB5EE4A1', 'key': 'NoKey'}
+MESSAGE = '|s_g8=612|s_t0=25.31|app=MAPS6|date=2026-10-18|s_d0=7|s_h0=61.2|device_id=B827EB5EE4A1|s_gg=130|ver_app=7.0.0|time=12:00:00'
+UPLOADS = 50
+
+
+def old_upload(url, msg):
+    ''' wifi_upload_to_lass() before the uplink: new connection, raw query string, no timeout
+    '''
+    get_api = f'{url}?topic=MAPS6&device_id=B827EB5EE4A1&key=NoKey&msg={msg}'
+    return requests.get(get_api, verify=False).status_code == 200
+
+
+def run(server, upload):
+    server.messages.clear()
+    connections = server.connections
+    start = time.perf_counter()
+    upload()
+    elapsed = time.perf_counter() - start
+    assert len(server.messages) == UPLOADS
+    return elapsed / UPLOADS, server.connections - connections
+
+
+if __name__ == '__main__':
+    warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+    messages = [f'{MESSAGE}|seq={idx}' for idx in range(UPLOADS)]
+    server = LassServer().start()
+    try:
+        # characters the raw query string got wrong
+        uplink = HTTPSUplink(server.url, PARAMS, verify=False)
+        special = '|s_t0=25.31|note=a&b #1 +2 溫度'
+        assert uplink.upload(special) and server.messages[-1] == special
+        old_upload(server.url, special)
+        print(f'raw query string delivered: {server.messages[-1]!r}')
+
+        per_upload, connections = run(server, lambda: [old_upload(server.url, msg) for msg in messages])
+        print(f'requests.get per upload: {per_upload * 1e3:6.2f} ms/upload, {connections} new connections')
+        per_upload, connections = run(server, lambda: uplink.upload_many(messages))
+        print(f'session, batch  1:       {per_upload * 1e3:6.2f} ms/upload, {connections} new connections')
+        batch = HTTPSUplink(server.url, PARAMS, batch_size=16, verify=False)
+        per_upload, connections = run(server, lambda: batch.upload_many(messages))
+        print(f'session, batch 16:       {per_upload * 1e3:6.2f} ms/upload, {connections} new connections')
+        uplink.close()
+        batch.close()
+    finally:
+        server.stop()
+
+    server = LassServer(stall=True).start()
+    try:
+        uplink = HTTPSUplink(server.url, PARAMS, timeout=(1, 2), verify=False)
+        start = time.perf_counter()
+        assert uplink.upload_many(messages[:3]) == [False] * 3
+        print(f'stalled server: upload gave up after {time.perf_counter() - start:.2f} s '
+              f'(requests.get without timeout never returns)')
+        uplink.close()
+    finally:
+        server.stop()
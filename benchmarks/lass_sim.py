@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# lass_sim.py
+#
+# Local stand-in of the LASS upload endpoint: HTTP/1.1 keep-alive, TLS with
+# a throw-away self-signed certificate (openssl), msg from GET or POST.
+
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class LassServer(object):
+    ''' messages: every msg received, connections: TCP connections accepted
+        delay: second before each reply, stall: never reply
+    '''
+
+    def __init__(self, tls=True, delay=0, stall=False):
+        self.messages = []
+        self.connections = 0
+        self.delay = delay
+        self.stall = stall
+        self.stopped = threading.Event()
+        self.__tmp = tempfile.mkdtemp()
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), self.__handler())
+        self.__server.daemon_threads = True
+        if(tls):
+            cert, key = os.path.join(self.__tmp, 'cert.pem'), os.path.join(self.__tmp, 'key.pem')
+            subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                            '-subj', '/CN=127.0.0.1', '-keyout', key, '-out', cert],
+                           check=True, capture_output=True)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            self.__server.socket = context.wrap_socket(self.__server.socket, server_side=True)
+        scheme = 'https' if tls else 'http'
+        self.url = f'{scheme}://127.0.0.1:{self.__server.server_address[1]}/Upload/MAPS-secure.php'
+
+    def start(self):
+        threading.Thread(target=self.__server.serve_forever, name='lass_sim_t', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.__server.shutdown()
+        self.__server.server_close()
+        shutil.rmtree(self.__tmp)
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.__reply(parse_qs(urlsplit(self.path).query))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.__reply(parse_qs(body.decode('utf-8')))
+
+            def __reply(self, fields):
+                if(server.stall):
+                    server.stopped.wait()
+                    return
+                time.sleep(server.delay)
+                server.messages.extend(fields.get('msg', []))
+                body = b'OK'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
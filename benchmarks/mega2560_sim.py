@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mega2560_sim.py
+#
+# pty stand-in for the MAPS6 Mega2560, speaks the 0xAA command protocol.
+
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from libs.MEGA2560.frame import SENSOR_ALL_PAYLOAD_LEN, calc_checksum
+
+MAPS_LEADING_CMD = 0xAA
+MAPS_GET_SENSOR_ALL_CMD = 0xB5
+MAPS_SET_POLLING_SENSOR_CMD = 0xC6
+MAPS_UART_BEGIN_CMD = 0xCC
+MAPS_UART_TX_RX_CMD = 0xCD
+MAPS_UART_TXRX_EX_CMD = 0xCE
+MAPS_UART_ENABLE_ACTIVE_RX_CMD = 0xCF
+MAPS_ECHO_UART_ACTIVE_RX_CMD = 0xD0
+
+# request body length after the 4 byte header, None = variable
+_BODY_LEN = {
+    MAPS_GET_SENSOR_ALL_CMD: 0,
+    MAPS_SET_POLLING_SENSOR_CMD: 6 + 2,
+    MAPS_UART_BEGIN_CMD: 3 + 2,
+    MAPS_UART_ENABLE_ACTIVE_RX_CMD: 6 + 2,
+}
+
+
+def _frame(cmd, body):
+    data = bytearray((MAPS_LEADING_CMD, cmd))
+    data.extend(body)
+    checksum = calc_checksum(data)
+    data.append(checksum)
+    data.append(~checksum & 0xFF)
+    return bytes(data)
+
+
+def _uart_frame(cmd, port, data):
+    return _frame(cmd, bytes((port, len(data) & 0xFF, len(data) >> 8)) + data)
+
+
+class Mega2560Simulator(object):
+    ''' Answer MAPS commands on a pty, port_name is the serial device to open.
+        uart: the NB-IoT module behind the bridge, with on_tx(data, sim) for
+        TX_RX (0xCD) and on_transact(data, sim) -> reply for TXRX_EX (0xCE).
+    '''
+
+    def __init__(self, reply_delay=0.0, uart=None):
+        self.reply_delay = reply_delay
+        self.uart = uart
+        self.sensor_payload = bytes(random.randrange(0x100)
+                                    for _ in range(SENSOR_ALL_PAYLOAD_LEN))
+        self.__master, self.__slave = os.openpty()
+        tty.setraw(self.__slave)
+        self.port_name = os.ttyname(self.__slave)
+        self.__lock = threading.Lock()
+        # bytes on the serial line, host to Mega2560 and back
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.__running = False
+        self.__thread = None
+
+    def start(self):
+        self.__running = True
+        self.__thread = threading.Thread(
+            target=self.__run, name='mega2560_sim_t', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__running = False
+        self.__thread.join()
+        os.close(self.__master)
+        os.close(self.__slave)
+
+    def write(self, data):
+        with self.__lock:
+            self.tx_bytes += len(data)
+            view = memoryview(data)
+            while(view):
+                view = view[os.write(self.__master, view):]
+
+    def send_uart_rx(self, data, port=0x00, chunk=1024):
+        ''' Push module output to the host as active RX (0xD0) echo frames
+        '''
+        for idx in range(0, len(data), chunk):
+            self.write(_uart_frame(MAPS_ECHO_UART_ACTIVE_RX_CMD,
+                                   port, data[idx:idx + chunk]))
+
+    def __ack(self, cmd):
+        if(self.reply_delay):
+            time.sleep(self.reply_delay)
+        self.write(bytes((MAPS_LEADING_CMD, cmd, 0x00, 0xFF)))
+
+    def __handle(self, cmd, body):
+        if(cmd == MAPS_GET_SENSOR_ALL_CMD):
+            if(self.reply_delay):
+                time.sleep(self.reply_delay)
+            self.write(_frame(cmd, self.sensor_payload))
+        elif(cmd == MAPS_UART_TX_RX_CMD):
+            self.__ack(cmd)
+            if(self.uart):
+                self.uart.on_tx(bytes(body[9:-2]), self)
+        elif(cmd == MAPS_UART_TXRX_EX_CMD):
+            data = bytes(body[8:-2])
+            reply = self.uart.on_transact(data, self) if self.uart else b''
+            # the reply ends after byte_timeout(ms) without a new byte
+            time.sleep(body[3] / 1000)
+            self.write(_uart_frame(cmd, body[0], reply))
+        else:
+            self.__ack(cmd)
+
+    def __body_len(self, cmd, buf):
+        if(cmd in _BODY_LEN):
+            return _BODY_LEN[cmd]
+        if(cmd in (MAPS_UART_TX_RX_CMD, MAPS_UART_TXRX_EX_CMD)):
+            if(len(buf) < 7):
+                return None
+            data_len = buf[5] | (buf[6] << 8)
+            return 1 + 2 + 1 + 4 + data_len + 2 if cmd == MAPS_UART_TXRX_EX_CMD \
+                else 1 + 2 + 2 + 4 + data_len + 2
+        return 0
+
+    def __run(self):
+        buf = bytearray()
+        while(self.__running):
+            readable, _, _ = select.select([self.__master], [], [], 0.05)
+            if(not readable):
+                continue
+            chunk = os.read(self.__master, 4096)
+            self.rx_bytes += len(chunk)
+            buf.extend(chunk)
+            while(len(buf) >= 4):
+                if(buf[0] != MAPS_LEADING_CMD):
+                    del buf[0]
+                    continue
+                cmd = buf[2]
+                body_len = self.__body_len(cmd, buf)
+                if(body_len is None or len(buf) < 4 + body_len):
+                    break
+                body = bytes(buf[4:4 + body_len])
+                del buf[:4 + body_len]
+                self.__handle(cmd, body)
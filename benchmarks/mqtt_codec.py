@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mqtt_codec.py
+#
+# PUBLISH build time of libs.SIM7000E.mqtt.codec against the former hex
+# string builder, the codec checks are in tests/test_mqtt_codec.py.
+# Run from the repository root:
+#   python3 -m benchmarks.mqtt_codec
+
+import timeit
+
+from libs.SIM7000E.mqtt import codec
+
+TOPIC = 'MAPS/MAPS6/B827EB5EE4A1'
+MESSAGE = '|s_g8=612|s_t0=25.31|app=MAPS6|date=2026-10-18|s_d0=7|s_h0=61.2|device_id=B827EB5EE4A1|s_gg=130|time=12:00:00|MQ'
+
+
+def hex_publish(topic, msg, qos, identifier):
+    ''' MQTT.publish() packet building before the codec, valid for ASCII >= 0x10
+        and a Remaining Length below 16384
+    '''
+    def str_to_hex(string):
+        return (''.join([hex(ord(x))[2:] for x in string])).upper()
+
+    def remaining_len(length):
+        if(length > 0x7F):
+            return hex(length % 0x80 + 0x80)[2:].upper() + hex(length // 0x80)[2:].upper().zfill(2)
+        return hex(length)[2:].upper().zfill(2)
+
+    packet = '3' + hex(qos << 1)[2:].upper() + 'XX'
+    packet += hex(len(topic))[2:].upper().zfill(4)
+    packet += str_to_hex(topic)
+    if(qos == 1):
+        packet += hex(identifier)[2:].upper().zfill(4)
+    packet += str_to_hex(msg)
+    return packet.replace('XX', remaining_len(len(packet[4:]) // 2))
+
+
+if __name__ == '__main__':
+    for length in (len(MESSAGE), 4096, 16000):
+        msg = (MESSAGE * (length // len(MESSAGE) + 1))[:length]
+        number = 200
+        old = min(timeit.repeat(lambda: bytes.fromhex(hex_publish(TOPIC, msg, 1, 1)),
+                                number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: codec.publish(TOPIC, msg, 1, False, 1),
+                                number=number, repeat=5)) / number
+        print(f'{length:6d} byte PUBLISH: hex string {old * 1e6:8.1f} us, codec {new * 1e6:6.1f} us')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mqtt_inbound.py
+#
+# Broker-initiated PUBLISH delivered to the MQTT callback by the connection
+# manager thread, and uploads running while commands arrive.
+# Run from the repository root:
+#   python3 -m benchmarks.mqtt_inbound
+
+import threading
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.mqtt import codec
+from libs.SIM7000E.mqtt.manager import MQTTConnectionManager
+from libs.SIM7000E.mqtt.mqtt import MQTT
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+COMMANDS = 5
+IDLE = 10
+TOPIC = 'MAPS/MAPS6/B827EB5EE4A1'
+COMMAND_TOPIC = 'MAPS/MAPS6/B827EB5EE4A1/cmd'
+
+if __name__ == '__main__':
+    module = SIM7000ESimulator()
+    sim = Mega2560Simulator(uart=module).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    received = []
+    arrived = threading.Event()
+
+    def on_message(topic, msg):
+        received.append((time.perf_counter(), topic, msg))
+        arrived.set()
+
+    try:
+        tcp = SIM7000E_TPC(MAPS6Adapter(demux), hex_mode=False)
+        mqtt = MQTT(tcp, 'broker.example', 1883, keepAlive_s=270)
+        mqtt.setCallback(on_message)
+        manager = MQTTConnectionManager(mqtt, tick_s=0.5).start()
+        manager.subscribe(COMMAND_TOPIC, 1)
+        while(not manager.connected()):
+            time.sleep(0.1)
+        commands = module.command_count
+        time.sleep(IDLE)
+        print(f'idle session: {(module.command_count - commands) / IDLE:.2f} AT commands per second')
+        latencies = []
+        for idx in range(COMMANDS):
+            arrived.clear()
+            start = time.perf_counter()
+            module.push_socket_data(codec.publish(COMMAND_TOPIC, f'interval={idx}', 1, packet_id=idx + 1))
+            assert arrived.wait(5)
+            latencies.append(received[-1][0] - start)
+            # an upload right after the command
+            assert manager.publish(TOPIC, f'|s_g8={600 + idx}|MQ', 1)
+        latencies.sort()
+        print(f'command to callback: median {latencies[len(latencies) // 2] * 1e3:.0f} ms, '
+              f'max {latencies[-1] * 1e3:.0f} ms, {len(received)}/{COMMANDS} delivered')
+        manager.stop()
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mqtt_pipeline.py
+#
+# Backlog replay, one MQTT.publish() per message vs MQTT.publish_many()
+# with an in-flight window, against a broker 1 s away.
+# Run from the repository root:
+#   python3 -m benchmarks.mqtt_pipeline
+
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import FakeBroker, SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.mqtt.mqtt import MQTT
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+BACKLOG = 32
+RTT = 1.0
+TOPIC = 'MAPS/MAPS6/B827EB5EE4A1'
+
+
+def backlog():
+    return [(TOPIC, f'|s_g8={600 + idx}|s_t0=25.31|s_d0=7|s_h0=61.2|s_gg=130|time=12:{idx:02d}:00|MQ')
+            for idx in range(BACKLOG)]
+
+
+if __name__ == '__main__':
+    broker = FakeBroker()
+    module = SIM7000ESimulator(broker=broker, rtt=RTT)
+    sim = Mega2560Simulator(uart=module).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    try:
+        tcp = SIM7000E_TPC(MAPS6Adapter(demux), hex_mode=False)
+        mqtt = MQTT(tcp, 'broker.example', 1883, keepAlive_s=60)
+        assert mqtt.connect()
+        start = time.perf_counter()
+        assert all(mqtt.publish(topic, msg, qos=1) for topic, msg in backlog())
+        print(f'publish() loop: {time.perf_counter() - start:6.1f} s for {BACKLOG} messages')
+        for window in (1, 8, 16):
+            start = time.perf_counter()
+            assert all(mqtt.publish_many(backlog(), window=window))
+            print(f'window {window:2d}     : {time.perf_counter() - start:6.1f} s for {BACKLOG} messages')
+        # every 5th PUBACK is lost, the message is resent with DUP after ack_timeout
+        broker.drop_puback_every = 5
+        published = len(broker.published)
+        start = time.perf_counter()
+        results = mqtt.publish_many(backlog(), window=8, ack_timeout=3000)
+        dups = sum(dup for _, _, dup in broker.published[published:])
+        print(f'window  8, PUBACK loss: {time.perf_counter() - start:6.1f} s, '
+              f'{sum(results)}/{BACKLOG} acknowledged, {dups} DUP retransmissions')
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mqtt_publish.py
+#
+# End-to-end MQTT.publish time against the simulated Mega2560 + SIM7000E.
+# Run from the repository root:
+#   python3 -m benchmarks.mqtt_publish
+
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.mqtt.mqtt import MQTT
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+PUBLISHES = 10
+MESSAGE = '{"CO2":612,"TEMP":25.31,"HUMI":61.2,"PM2.5_AE":7,"TVOC":130}'
+
+
+def measure(mqtt, qos):
+    samples = []
+    for _ in range(PUBLISHES):
+        start = time.perf_counter()
+        assert mqtt.publish('MAPS/MAPS6/BENCH', MESSAGE, qos=qos)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+if __name__ == '__main__':
+    module = SIM7000ESimulator()
+    sim = Mega2560Simulator(uart=module).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    try:
+        tcp = SIM7000E_TPC(MAPS6Adapter(demux))
+        mqtt = MQTT(tcp, 'broker.example', 1883, keepAlive_s=60)
+        start = time.perf_counter()
+        assert mqtt.connect()
+        print(f'     connect: {(time.perf_counter() - start) * 1e3:7.1f} ms')
+        for qos in (0, 1):
+            median, worst = measure(mqtt, qos)
+            print(f'publish QoS{qos}: median {median * 1e3:7.1f} ms, max {worst * 1e3:7.1f} ms')
+        assert len(module.broker.published) == 2 * PUBLISHES
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mqtt_session.py
+#
+# Upload latency with main.py's former connect-per-upload pattern vs the
+# MQTTConnectionManager keeping the session warm. Keep alive and upload
+# interval are scaled down (4 s / 8 s instead of 270 s / 300 s).
+# Run from the repository root:
+#   python3 -m benchmarks.mqtt_session
+
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.mqtt.manager import MQTTConnectionManager
+from libs.SIM7000E.mqtt.mqtt import MQTT
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+KEEPALIVE = 4
+UPLOAD_INTERVAL = 8
+UPLOADS = 3
+TOPIC = 'MAPS/MAPS6/B827EB5EE4A1'
+MESSAGE = '|s_g8=612|s_t0=25.31|s_d0=7|s_h0=61.2|s_gg=130|MQ'
+
+
+def legacy_upload(mqtt):
+    if(not mqtt.connected()):
+        mqtt.disconnect()
+        mqtt.connect()
+    return mqtt.publish(TOPIC, MESSAGE, 1)
+
+
+def run(name, upload):
+    samples = []
+    for _ in range(UPLOADS):
+        time.sleep(UPLOAD_INTERVAL)
+        start = time.perf_counter()
+        assert upload()
+        samples.append(time.perf_counter() - start)
+    print(f'{name:>16}: ' + ', '.join(f'{sample * 1e3:6.0f} ms' for sample in samples))
+
+
+if __name__ == '__main__':
+    # the broker closes the session after 1.5 x keep alive without a packet
+    module = SIM7000ESimulator(idle_timeout=KEEPALIVE * 1.5)
+    sim = Mega2560Simulator(uart=module).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    try:
+        tcp = SIM7000E_TPC(MAPS6Adapter(demux), hex_mode=False)
+        mqtt = MQTT(tcp, 'broker.example', 1883, keepAlive_s=KEEPALIVE)
+        assert mqtt.connect()
+        run('connect per idle', lambda: legacy_upload(mqtt))
+        manager = MQTTConnectionManager(mqtt, tick_s=0.5).start()
+        run('managed session', lambda: manager.publish(TOPIC, MESSAGE, 1))
+        manager.stop()
+        print(manager.stats())
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# retry_policy.py
+#
+# Modem commands sent through an outage by the former retry-until-success
+# loop of SIM7000E_TPC against libs.retry.retry.RetryPolicy with a circuit
+# breaker. Times are scaled down from the modem ones. Run from the
+# repository root:
+#   python3 -m benchmarks.retry_policy
+
+import logging
+import time
+
+from libs.retry.retry import RetryPolicy, Backoff, RetryBudget, CircuitBreaker, CircuitOpen
+
+OUTAGE = 2.0  # second the module answers ERROR
+RUN = 3.0  # second of the whole run
+COMMAND_TIME = 0.01  # second per AT command round trip
+TICK = 0.1  # second between two calls of the caller, e.g. the MQTT manager
+
+
+class FakeModem(object):
+    def __init__(self, start):
+        self.start = start
+        self.commands = 0
+
+    def command(self):
+        self.commands += 1
+        time.sleep(COMMAND_TIME)
+        if(time.monotonic() - self.start < OUTAGE):
+            raise Exception('Failed')
+        return 'OK'
+
+
+def loop_call(modem):
+    # SIM7000E_TPC before: while(True) until the module stops answering ERROR
+    while(True):
+        try:
+            return modem.command()
+        except Exception as e:
+            if(str(e) != 'Failed'):
+                raise
+
+
+def run(call):
+    ''' Return (commands, calls, longest call, first success after the outage)
+    '''
+    start = time.monotonic()
+    modem = FakeModem(start)
+    calls = 0
+    longest = 0
+    recovered = None
+    while(time.monotonic() - start < RUN):
+        calls += 1
+        begin = time.monotonic()
+        try:
+            call(modem)
+            if(recovered is None):
+                recovered = time.monotonic() - start - OUTAGE
+        except Exception:
+            pass
+        longest = max(longest, time.monotonic() - begin)
+        time.sleep(TICK)
+    return modem.commands, calls, longest, recovered
+
+
+if __name__ == '__main__':
+    logging.getLogger('maps6').setLevel(logging.ERROR)
+
+    commands, calls, longest, recovered = run(loop_call)
+    print(f'retry loop:   {commands:4d} commands in {calls:2d} calls, '
+          f'caller blocked up to {longest * 1e3:6.0f} ms, recovered {recovered * 1e3:4.0f} ms after the outage')
+
+    breaker = CircuitBreaker('modem', failure_threshold=3, reset_timeout_s=0.5)
+    policy = RetryPolicy('modem', 4, Backoff(0.02, 0.2), breaker, RetryBudget(),
+                         retry_if=lambda e: str(e) == 'Failed')
+    commands, calls, longest, recovered = run(lambda modem: policy.call(modem.command))
+    print(f'retry policy: {commands:4d} commands in {calls:2d} calls, '
+          f'caller blocked up to {longest * 1e3:6.0f} ms, recovered {recovered * 1e3:4.0f} ms after the outage')
+    print(f'  {policy.stats()}')
+    assert breaker.open_count >= 1 and breaker.state == 'closed'
+
+    # Backoff alone: delays before retry 0..7 of the MQTT reconnect
+    backoff = Backoff(5, 300)
+    print('full jitter, mean of 1000 draws: ' +
+          ', '.join(f'{sum(backoff.delay(n) for _ in range(1000)) / 1000:.1f}' for n in range(8)))
+    try:
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_failure()
+        RetryPolicy('modem', breaker=breaker).call(lambda: None)
+    except CircuitOpen as e:
+        print(f'open circuit: {e} ({e.name}), no command sent')
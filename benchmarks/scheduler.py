@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# scheduler.py
+#
+# libs.scheduler.scheduler.Scheduler against the former 10 ms polling main
+# loop, time scaled down 10x. Run from the repository root:
+#   python3 -m benchmarks.scheduler
+
+import time
+
+from libs.scheduler.scheduler import Scheduler, EXECUTOR_THREAD
+
+DURATION = 6  # second
+FAST_INTERVAL = 0.5  # check_connection, 5 s scaled
+SLOW_INTERVAL = 1.0  # upload, 10 s scaled
+SLOW_BLOCK = 2.0  # an uplink stuck in a modem wait
+
+
+def cpu():
+    return time.process_time()
+
+
+def polling_loop(block_s):
+    ''' The former __main__ loop: perf_counter deadlines, every task inline
+    '''
+    fast_delays = []
+    wakeups = 0
+    fast_timer = slow_timer = time.perf_counter()
+    end = time.perf_counter() + DURATION
+    while(time.perf_counter() < end):
+        wakeups += 1
+        now = time.perf_counter()
+        if(now > slow_timer):
+            slow_timer = now + SLOW_INTERVAL
+            time.sleep(block_s)
+        now = time.perf_counter()
+        if(now > fast_timer):
+            fast_delays.append(now - fast_timer)
+            fast_timer = now + FAST_INTERVAL
+        time.sleep(0.01)
+    return wakeups, max(fast_delays)
+
+
+def scheduled(block_s):
+    scheduler = Scheduler()
+    scheduler.add('fast', lambda: None, FAST_INTERVAL)
+    scheduler.add('slow', lambda: time.sleep(block_s), SLOW_INTERVAL, EXECUTOR_THREAD)
+    scheduler.start()
+    time.sleep(DURATION)
+    scheduler.stop()
+    stats = scheduler.stats()
+    return scheduler.wakeups, stats['fast']['jitter_max_ms'] / 1e3, stats
+
+
+if __name__ == '__main__':
+    for block_s in (0, SLOW_BLOCK):
+        start = cpu()
+        wakeups, worst = polling_loop(block_s)
+        used = cpu() - start
+        print(f'polling loop, uplink {block_s:.0f} s: {wakeups:4d} wakeups, CPU {used * 1e3:6.1f} ms, '
+              f'fast task late by up to {worst * 1e3:7.1f} ms')
+        start = cpu()
+        wakeups, worst, stats = scheduled(block_s)
+        used = cpu() - start
+        print(f'scheduler,    uplink {block_s:.0f} s: {wakeups:4d} wakeups, CPU {used * 1e3:6.1f} ms, '
+              f'fast task late by up to {worst * 1e3:7.1f} ms '
+              f'(mean {stats["fast"]["jitter_mean_ms"]} ms), slow overruns {stats["slow"]["overruns"]}')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# sensor_snapshot.py
+#
+# Torn reads of the former shared sensor_data dict against
+# libs.MEGA2560.snapshot.SnapshotSlot. Run from the repository root:
+#   python3 -m benchmarks.sensor_snapshot
+
+import sys
+import threading
+import time
+import timeit
+
+from libs.MEGA2560.frame import SENSOR_KEYS, SensorReading
+from libs.MEGA2560.snapshot import SnapshotSlot
+
+DURATION = 2  # second
+
+
+def reading(value):
+    return SensorReading(*([value] * len(SENSOR_KEYS)))
+
+
+def run(write, read):
+    ''' One writer publishing readings whose fields are all equal, one reader
+        counting reads that mix two readings
+    '''
+    stop = threading.Event()
+    counts = [0, 0]  # reads, torn
+
+    def writer():
+        value = 0
+        while(not stop.is_set()):
+            value += 1
+            write(value)
+
+    def reader():
+        while(not stop.is_set()):
+            values = read()
+            counts[0] += 1
+            if(values is not None and len(set(values)) > 1):
+                counts[1] += 1
+
+    threads = [threading.Thread(target=writer), threading.Thread(target=reader)]
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+if __name__ == '__main__':
+    # switch threads often so a field by field update gets interrupted
+    sys.setswitchinterval(1e-6)
+
+    sensor_data = dict.fromkeys(SENSOR_KEYS, 0)
+
+    def dict_write(value):
+        # Mega2560.get_sensor_all() before: update the shared dict in place
+        for key in SENSOR_KEYS:
+            sensor_data[key] = value
+
+    reads, torn = run(dict_write, lambda: [sensor_data[key] for key in SENSOR_KEYS])
+    print(f'shared dict:   {torn:7d} torn of {reads:8d} reads')
+
+    slot = SnapshotSlot()
+    reads, torn = run(lambda value: slot.publish(time.time(), reading(value)),
+                      lambda: getattr(slot.latest(), 'reading', None))
+    print(f'snapshot slot: {torn:7d} torn of {reads:8d} reads')
+    assert torn == 0
+
+    sys.setswitchinterval(0.005)
+    slot.publish(time.time(), reading(1))
+    number = 200000
+    cost = min(timeit.repeat(lambda: slot.latest().value('PM2.5_AE'), number=number, repeat=5)) / number
+    print(f'latest().value(): {cost * 1e9:6.1f} ns')
+    seq = slot.latest().seq
+    cost = min(timeit.repeat(lambda: slot.newer(seq), number=number, repeat=5)) / number
+    print(f'newer(seq), unchanged: {cost * 1e9:6.1f} ns')
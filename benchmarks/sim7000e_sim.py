@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# sim7000e_sim.py
+#
+# SIM7000E stand-in behind Mega2560Simulator: AT command set used by
+# sim_access plus a TCP socket to a minimal MQTT 3.1.1 broker.
+
+import queue
+import re
+import threading
+import time
+
+
+class FakeBroker(object):
+    ''' Answer CONNECT/PUBLISH/SUBSCRIBE/UNSUBSCRIBE/PINGREQ with their ACK
+        drop_puback_every: lose every Nth PUBACK, 0 never
+    '''
+
+    def __init__(self, drop_puback_every=0):
+        self.__buf = bytearray()
+        self.published = []
+        self.drop_puback_every = drop_puback_every
+        self.__puback_count = 0
+
+    def feed(self, data):
+        ''' Return the bytes the broker sends back
+        '''
+        self.__buf.extend(data)
+        out = bytearray()
+        while(len(self.__buf) >= 2):
+            multiplier, value, idx = 1, 0, 1
+            while(True):
+                if(idx >= len(self.__buf)):
+                    return bytes(out)
+                byte = self.__buf[idx]
+                value += (byte & 0x7F) * multiplier
+                multiplier *= 0x80
+                idx += 1
+                if(not byte & 0x80):
+                    break
+            if(len(self.__buf) < idx + value):
+                break
+            header = self.__buf[0]
+            body = bytes(self.__buf[idx:idx + value])
+            del self.__buf[:idx + value]
+            out.extend(self.__reply(header, body))
+        return bytes(out)
+
+    def __reply(self, header, body):
+        packet_type = header >> 4
+        if(packet_type == 1):  # CONNECT
+            return b'\x20\x02\x00\x00'
+        if(packet_type == 3):  # PUBLISH
+            topic_len = (body[0] << 8) | body[1]
+            qos = (header >> 1) & 0x03
+            idx = 2 + topic_len
+            self.published.append((body[2:idx], body[idx + (2 if qos else 0):], bool(header & 0x08)))
+            if(qos == 1):
+                self.__puback_count += 1
+                if(self.drop_puback_every and self.__puback_count % self.drop_puback_every == 0):
+                    return b''
+                return b'\x40\x02' + body[idx:idx + 2]
+            return b''
+        if(packet_type == 8):  # SUBSCRIBE
+            return b'\x90\x03' + body[:2] + bytes((body[-1],))
+        if(packet_type == 10):  # UNSUBSCRIBE
+            return b'\xB0\x02' + body[:2]
+        if(packet_type == 12):  # PINGREQ
+            return b'\xD0\x00'
+        return b''
+
+
+class SIM7000ESimulator(object):
+    ''' reply_delay: module think time per AT command (second)
+        rx_latency: delay of the active RX (0xD0) path of the bridge (second)
+        command_delay: {AT command: extra think time (second)}, e.g. CIPSHUT
+        rtt: network round trip time to the broker (second)
+        idle_timeout: the broker closes the socket after this long without
+        a packet from the client (second), 0 never
+    '''
+
+    def __init__(self, reply_delay=0.02, rx_latency=0.1, broker=None, command_delay=None, rtt=0.0,
+                 idle_timeout=0):
+        self.rtt = rtt
+        self.idle_timeout = idle_timeout
+        self.__last_packet = time.monotonic()
+        self.reply_delay = reply_delay
+        self.rx_latency = rx_latency
+        self.command_delay = dict(command_delay or {})
+        self.broker = broker or FakeBroker()
+        self.hex_mode = False
+        self.rx_manual = False
+        self.tcp_state = 'IP INITIAL'
+        self.command_count = 0
+        self.__socket_rx = bytearray()
+        self.__line = bytearray()
+        self.__send_len = None  # bytes expected after '> '
+        self.__send_buf = bytearray()
+        self.__out = queue.Queue()
+        self.__sim = None
+        threading.Thread(target=self.__output, name='sim7000e_sim_t', daemon=True).start()
+
+    # Mega2560Simulator hooks
+    def on_tx(self, data, sim):
+        self.__sim = sim
+        due = time.monotonic() + self.reply_delay + self.rx_latency
+        for delay, reply in self.__feed(data):
+            due += delay
+            self.__out.put((due, reply))
+
+    def on_transact(self, data, sim):
+        self.__sim = sim
+        replies = self.__feed(data)
+        time.sleep(self.reply_delay + sum(delay for delay, _ in replies))
+        return b''.join(reply for _, reply in replies)
+
+    def drop_socket(self):
+        ''' The remote side closes the TCP connection
+        '''
+        self.tcp_state = 'TCP CLOSED'
+        self.__out.put((time.monotonic() + self.rx_latency, b'\r\nCLOSED\r\n'))
+
+    def push_socket_data(self, data):
+        ''' Data arriving from the network on the TCP socket
+        '''
+        notify = self.rx_manual and not self.__socket_rx
+        self.__socket_rx.extend(data)
+        if(notify):
+            self.__out.put((time.monotonic() + self.rx_latency, b'\r\n+CIPRXGET: 1\r\n'))
+
+    def __output(self):
+        while(True):
+            due, data = self.__out.get()
+            delay = due - time.monotonic()
+            if(delay > 0):
+                time.sleep(delay)
+            self.__sim.send_uart_rx(data)
+
+    def __feed(self, data):
+        replies = []
+        for byte in data:
+            if(self.__send_len is not None):
+                self.__send_buf.append(byte)
+                need = self.__send_len * (2 if self.hex_mode else 1)
+                if(len(self.__send_buf) >= need):
+                    replies.append((0, self.__finish_send()))
+                continue
+            self.__line.append(byte)
+            if(self.__line.endswith(b'\r\n')):
+                line = self.__line[:-2].decode()
+                self.__line.clear()
+                if(line):
+                    self.command_count += 1
+                    replies.append((self.command_delay.get(line, 0), self.__command(line)))
+        return [(delay, reply) for delay, reply in replies if reply]
+
+    def __finish_send(self):
+        payload = bytes(self.__send_buf)
+        if(self.hex_mode):
+            payload = bytes.fromhex(payload.decode())
+        self.__send_buf.clear()
+        self.__send_len = None
+        self.__last_packet = time.monotonic()
+        answer = self.broker.feed(payload)
+        if(answer and self.rtt):
+            threading.Timer(self.rtt, self.push_socket_data, (answer,)).start()
+        elif(answer):
+            self.push_socket_data(answer)
+        return b'\r\nSEND OK\r\n'
+
+    def __command(self, line):
+        ok = b'\r\nOK\r\n'
+        if(self.idle_timeout and self.tcp_state == 'CONNECT OK'
+                and time.monotonic() - self.__last_packet > self.idle_timeout):
+            self.drop_socket()
+        if(line in ('AT', 'ATE0', 'AT+CGNSPWR=1', 'AT+CGATT=1') or line.startswith('AT+CSTT=')):
+            return ok
+        if(line == 'AT+CIICR'):
+            self.tcp_state = 'IP GPRSACT'
+            return ok
+        if(line == 'AT+CPIN?'):
+            return b'\r\n+CPIN: READY\r\n' + ok
+        if(line == 'AT+CSQ'):
+            return b'\r\n+CSQ: 20,0\r\n' + ok
+        if(line == 'AT+CGATT?'):
+            return b'\r\n+CGATT: 1\r\n' + ok
+        if(line == 'AT+CGNAPN'):
+            return b'\r\n+CGNAPN: 1,"internet.iot"\r\n' + ok
+        if(line == 'AT+CIFSR'):
+            self.tcp_state = 'IP STATUS'
+            return b'\r\n10.0.0.2\r\n'
+        if(line == 'AT+CGNSINF'):
+            return b'\r\n+CGNSINF: 1,0,20261018120000.000,,,,,,,,,,,,,,,,,,\r\n' + ok
+        if(line == 'AT+CIPSTATUS'):
+            return ok + b'\r\nSTATE: ' + self.tcp_state.encode() + b'\r\n'
+        if(line == 'AT+CIPSHUT'):
+            self.tcp_state = 'IP INITIAL'
+            return b'\r\nSHUT OK\r\n'
+        if(line == 'AT+CIPCLOSE'):
+            if(self.tcp_state != 'CONNECT OK'):
+                return b'\r\nERROR\r\n'
+            self.tcp_state = 'TCP CLOSED'
+            return b'\r\nCLOSE OK\r\n'
+        if(line.startswith('AT+CIPSENDHEX=')):
+            self.hex_mode = line.endswith('1')
+            return ok
+        if(line == 'AT+CIPRXGET=1'):
+            self.rx_manual = True
+            return ok
+        if(line.startswith('AT+CIPSTART=')):
+            if(self.tcp_state == 'CONNECT OK'):
+                return ok + b'\r\nALREADY CONNECT\r\n'
+            if(self.tcp_state not in ('IP STATUS', 'TCP CLOSED')):
+                return b'\r\nERROR\r\n'
+            self.tcp_state = 'CONNECT OK'
+            self.__last_packet = time.monotonic()
+            return ok + b'\r\nCONNECT OK\r\n'
+        if(line.startswith('AT+CIPSEND=')):
+            self.__send_len = int(line.split('=')[1])
+            return b'\r\n> '
+        if(line == 'AT+CIPRXGET=4'):
+            return f'\r\n+CIPRXGET: 4,{len(self.__socket_rx)}\r\n'.encode() + ok
+        result = re.match(r'AT\+CIPRXGET=([23]),(\d+)', line)
+        if(result):
+            mode, size = int(result.group(1)), int(result.group(2))
+            data = bytes(self.__socket_rx[:size])
+            del self.__socket_rx[:size]
+            body = data.hex().upper().encode() if mode == 3 else data
+            return f'\r\n+CIPRXGET: {mode},{len(data)},{len(self.__socket_rx)}\r\n'.encode() + body + b'\r\n' + ok
+        return b'\r\nERROR\r\n'
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# state_cache.py
+#
+# AT commands and time of main.py's 10 second cycle (check_connection,
+# check_gps_csq, NB-IoT upload) with and without the modem state cache.
+# Run from the repository root:
+#   python3 -m benchmarks.state_cache
+
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.mqtt.mqtt import MQTT
+from libs.SIM7000E.sim_access import cache
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.cache import STATE_TTL
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+CYCLES = 6
+CYCLE_PERIOD = 10  # second, main.py CHECK_WIFI_INTERVAL
+
+
+class CycleClock(object):
+    ''' time for the state cache, CYCLE_PERIOD later after each cycle
+    '''
+
+    def __init__(self):
+        self.offset = 0
+
+    def monotonic(self):
+        return time.monotonic() + self.offset
+
+
+def cycle(tcp, mqtt, clock):
+    clock.offset += CYCLE_PERIOD
+    # check_connection()
+    tcp.network_chkAttach()
+    # check_gps_csq()
+    if(tcp.network_chkAttach()):
+        tcp.network_getCsq()
+    tcp.get_gps_info()
+    # NB-IoT upload
+    if(not mqtt.connected()):
+        mqtt.connect()
+    assert mqtt.publish('MAPS/MAPS6/BENCH', '|s_g8=612|s_t0=25.31|MQ', qos=1)
+
+
+if __name__ == '__main__':
+    module = SIM7000ESimulator()
+    sim = Mega2560Simulator(uart=module).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    try:
+        tcp = SIM7000E_TPC(MAPS6Adapter(demux))
+        mqtt = MQTT(tcp, 'broker.example', 1883, keepAlive_s=60)
+        clock = CycleClock()
+        cache.time = clock
+        assert mqtt.connect()
+        for name, ttl in (('no cache', 0), ('state cache', None)):
+            for key in tcp.state_cache.ttl:
+                tcp.state_cache.ttl[key] = STATE_TTL[key] if ttl is None else ttl
+            commands = module.command_count
+            start = time.perf_counter()
+            for _ in range(CYCLES):
+                cycle(tcp, mqtt, clock)
+            elapsed = (time.perf_counter() - start) / CYCLES
+            commands = (module.command_count - commands) / CYCLES
+            print(f'{name:>12}: {commands:4.1f} AT commands, {elapsed * 1e3:7.1f} ms per cycle')
+        print(f'(hits, misses): {tcp.state_cache.stats()}')
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# tcp_binary.py
+#
+# Serial line bytes and time of SIM7000E_TPC send/read, hex vs binary mode.
+# Run from the repository root:
+#   python3 -m benchmarks.tcp_binary
+
+import os
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.mqtt.mqtt import MQTT
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+PUBLISHES = 5
+MESSAGE = '|s_g8=612|s_t0=25.31|app=MAPS6|date=2026-10-18|s_d0=7|s_h0=61.2|device_id=B827EB5EE4A1|s_gg=130|ver_app=6.0.0|time=12:00:00|MQ'
+READ_LEN = 4096
+
+
+def measure(sim, func):
+    rx, tx = sim.rx_bytes, sim.tx_bytes
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start, sim.rx_bytes - rx, sim.tx_bytes - tx
+
+
+if __name__ == '__main__':
+    module = SIM7000ESimulator()
+    sim = Mega2560Simulator(uart=module).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    try:
+        for hex_mode in (True, False):
+            tcp = SIM7000E_TPC(MAPS6Adapter(demux), hex_mode=hex_mode)
+            tcp.disconnect(shut_bearer=True)
+            mqtt = MQTT(tcp, 'broker.example', 1883, keepAlive_s=60)
+            assert mqtt.connect()
+            print('hex mode' if hex_mode else 'binary mode')
+            elapsed, rx, tx = measure(sim, lambda: [mqtt.publish('MAPS/MAPS6/BENCH', MESSAGE, qos=1)
+                                                    for _ in range(PUBLISHES)])
+            print(f'  QoS1 publish: {elapsed / PUBLISHES * 1e3:6.1f} ms, '
+                  f'{rx / PUBLISHES:6.0f} byte to the bridge, {tx / PUBLISHES:5.0f} byte back')
+            payload = os.urandom(READ_LEN)
+            module.push_socket_data(payload)
+            time.sleep(0.3)
+            data = []
+            elapsed, rx, tx = measure(sim, lambda: data.append(tcp.readData(READ_LEN)))
+            assert data[0] == (payload.hex().upper() if hex_mode else payload)
+            print(f'  {READ_LEN} byte read: {elapsed * 1e3:6.1f} ms, {tx:6.0f} byte from the bridge')
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
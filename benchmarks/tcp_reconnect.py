@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# tcp_reconnect.py
+#
+# Reconnect time after the broker drops the TCP socket, full bring-up vs
+# the fast path on the active PDP context. Run from the repository root:
+#   python3 -m benchmarks.tcp_reconnect
+
+import time
+
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+DROPS = 3
+# think time of the slow bearer commands on a real module, well below the worst case
+COMMAND_DELAY = {'AT+CIPSHUT': 1.0, 'AT+CIICR': 1.5}
+
+
+def reconnect(tcp, module, shut_bearer):
+    module.drop_socket()
+    # CLOSED is dispatched by the URC reader as it arrives
+    time.sleep(0.3)
+    commands = module.command_count
+    start = time.perf_counter()
+    if(shut_bearer):
+        tcp.disconnect(shut_bearer=True)
+    tcp.connect('broker.example', 1883)
+    assert tcp.connected()
+    return time.perf_counter() - start, module.command_count - commands
+
+
+if __name__ == '__main__':
+    module = SIM7000ESimulator(command_delay=COMMAND_DELAY)
+    sim = Mega2560Simulator(uart=module).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    try:
+        tcp = SIM7000E_TPC(MAPS6Adapter(demux))
+        tcp.connect('broker.example', 1883)
+        for name, shut_bearer in (('full bring-up', True), ('fast path', False)):
+            samples = [reconnect(tcp, module, shut_bearer) for _ in range(DROPS)]
+            elapsed = sum(sample[0] for sample in samples) / DROPS
+            commands = sum(sample[1] for sample in samples) / DROPS
+            print(f'{name:>14}: {elapsed * 1e3:7.1f} ms, {commands:4.1f} AT commands')
+        for tier, (attempts, successes, seconds) in tcp.connect_stats.items():
+            print(f'{tier:>14}: {successes}/{attempts} connected, {seconds:.2f} s total')
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
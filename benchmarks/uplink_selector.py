@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# uplink_selector.py
+#
+# Upload latency on a flaky WiFi path alone against
+# libs.uplink.selector.UplinkSelector hedging on NB-IoT. Times are scaled
+# down, a stall stands for an HTTPS read timeout. Its checks are in
+# tests/test_uplink_selector.py. Run from the repository root:
+#   python3 -m benchmarks.uplink_selector
+
+import logging
+import random
+import threading
+import time
+
+from libs.uplink.selector import UplinkSelector, UplinkPath
+from libs.uplink.worker import UploadRecord
+
+BATCHES = 200
+BATCH = 4
+WIFI_LATENCY = 0.02  # second per batch
+WIFI_STALL = 1.0  # second before a stalled upload fails
+WIFI_STALL_RATE = 0.1
+NBIOT_LATENCY = 0.15
+HEDGE_AFTER = 0.075  # second per record
+
+
+class FakePath(object):
+    def __init__(self, latency, stall_rate=0, stall_s=0):
+        self.latency = latency
+        self.stall_rate = stall_rate
+        self.stall_s = stall_s
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def __call__(self, records):
+        if(random.random() < self.stall_rate):
+            time.sleep(self.stall_s)
+            return [False] * len(records)
+        time.sleep(self.latency)
+        with self.lock:
+            self.delivered.extend(record.timestamp for record in records)
+        return [True] * len(records)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(upload, paths):
+    ''' Return (batch latencies, records delivered, records delivered twice)
+    '''
+    random.seed(1)
+    latencies = []
+    ok = 0
+    for batch in range(BATCHES):
+        records = [UploadRecord(batch * BATCH + idx, {}) for idx in range(BATCH)]
+        start = time.perf_counter()
+        ok += sum(upload(records))
+        latencies.append(time.perf_counter() - start)
+    # let an abandoned upload finish before counting duplicates
+    time.sleep(WIFI_STALL)
+    sent = [timestamp for path in paths for timestamp in path.delivered]
+    return latencies, ok, len(sent) - len(set(sent))
+
+
+def report(name, latencies, ok, duplicates):
+    print(f'{name:14s} p50 {percentile(latencies, 50) * 1e3:6.0f} ms, p95 {percentile(latencies, 95) * 1e3:6.0f} ms, '
+          f'p99 {percentile(latencies, 99) * 1e3:6.0f} ms, max {max(latencies) * 1e3:6.0f} ms, '
+          f'{ok}/{BATCHES * BATCH} delivered, {duplicates} duplicates')
+
+
+if __name__ == '__main__':
+    logging.getLogger('maps6').setLevel(logging.WARNING)
+
+    wifi = FakePath(WIFI_LATENCY, WIFI_STALL_RATE, WIFI_STALL)
+    report('WiFi only:', *run(wifi, [wifi]))
+
+    wifi = FakePath(WIFI_LATENCY, WIFI_STALL_RATE, WIFI_STALL)
+    nbiot = FakePath(NBIOT_LATENCY)
+    selector = UplinkSelector([UplinkPath('wifi', wifi), UplinkPath('nbiot', nbiot)], HEDGE_AFTER)
+    latencies, ok, duplicates = run(selector.upload, [wifi, nbiot])
+    report('hedged:', latencies, ok, duplicates)
+    print(f'  {selector.stats()}')
+
+    # WiFi that answers TCP but times out every upload: EWMA marks it
+    # degraded, both paths race from the next batch on
+    wifi = FakePath(WIFI_LATENCY, 1.0, WIFI_STALL)
+    nbiot = FakePath(NBIOT_LATENCY)
+    selector = UplinkSelector([UplinkPath('wifi', wifi), UplinkPath('nbiot', nbiot)], HEDGE_AFTER)
+    latencies, ok, duplicates = run(selector.upload, [wifi, nbiot])
+    report('WiFi down:', latencies, ok, duplicates)
+    print(f'  {selector.stats()}')
+    selector.close()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# upload_store.py
+#
+# Append and drain rate of libs.uplink.store, its checks are in
+# tests/test_upload_store.py.
+# Run from the repository root:
+#   python3 -m benchmarks.upload_store
+
+import os
+import shutil
+import tempfile
+import time
+
+from libs.uplink.store import UploadStore
+
+RECORD = {'values': {'CO2': 612, 'TEMP': 25.31, 'PM2.5_AE': 7, 'HUMI': 61.2, 'TVOC': 130},
+          'gps_lon': '121.5654', 'gps_lat': '25.0330'}
+BATCH = 16
+
+
+def append_rate(directory, count, sync):
+    store = UploadStore(directory, sync=sync)
+    start = time.perf_counter()
+    for ts in range(count):
+        store.put(ts, RECORD)
+    elapsed = time.perf_counter() - start
+    store.close()
+    return elapsed / count
+
+
+def drain_rate(directory):
+    store = UploadStore(directory, sync=True)
+    count = len(store)
+    start = time.perf_counter()
+    while(len(store)):
+        records = store.peek(BATCH)
+        store.commit(records[-1].position)
+    elapsed = time.perf_counter() - start
+    store.close()
+    return elapsed / count
+
+
+if __name__ == '__main__':
+    root = tempfile.mkdtemp()
+    try:
+        for sync in (True, False):
+            directory = os.path.join(root, f'sync_{sync}')
+            per_record = append_rate(directory, 2000, sync)
+            print(f'append, fsync {str(sync):5s}: {per_record * 1e6:7.1f} us/record')
+        per_record = drain_rate(os.path.join(root, 'sync_True'))
+        print(f'drain, batch {BATCH}:    {per_record * 1e6:7.1f} us/record')
+    finally:
+        shutil.rmtree(root)
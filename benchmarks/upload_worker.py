@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# upload_worker.py
+#
+# libs.uplink.worker.UploadWorker: producer blocking time against an inline
+# upload, and what each overflow policy keeps through an outage.
+# Run from the repository root:
+#   python3 -m benchmarks.upload_worker
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from libs.uplink.store import UploadStore
+from libs.uplink.worker import (UploadWorker, UploadRecord, POLICY_DROP_OLDEST,
+                                POLICY_COALESCE, POLICY_SPILL)
+
+RECORDS = 100
+CAPACITY = 8
+UPLINK_STALL = 0.5  # second per upload call, a modem wait scaled down
+
+
+class FakeUplink(object):
+    def __init__(self, stall_s=0):
+        self.stall_s = stall_s
+        self.up = threading.Event()
+        self.delivered = []
+
+    def __call__(self, records):
+        time.sleep(self.stall_s)
+        if(not self.up.is_set()):
+            return [False] * len(records)
+        self.delivered.extend(record.timestamp for record in records)
+        return [True] * len(records)
+
+
+def producer_block(worker_mode):
+    ''' Longest time the acquisition side waits per record, over 5 records
+    '''
+    uplink = FakeUplink(UPLINK_STALL)
+    uplink.up.set()
+    worker = UploadWorker(uplink, capacity=CAPACITY).start() if worker_mode else None
+    worst = 0
+    for ts in range(5):
+        start = time.perf_counter()
+        if(worker is not None):
+            worker.submit(UploadRecord(ts, {'v': ts}))
+        else:
+            uplink([UploadRecord(ts, {'v': ts})])
+        worst = max(worst, time.perf_counter() - start)
+        time.sleep(0.05)
+    if(worker is not None):
+        worker.stop()
+    return worst
+
+
+def outage(policy, directory):
+    ''' RECORDS submitted while the uplink is down, then the link comes back
+    '''
+    uplink = FakeUplink(0.02)  # records arrive while a batch is uploading
+    store = UploadStore(directory, sync=False) if policy == POLICY_SPILL else None
+    worker = UploadWorker(uplink, store, CAPACITY, policy, batch_size=16, retry_s=0.05).start()
+    for ts in range(RECORDS):
+        worker.submit(UploadRecord(ts, {'v': ts}))
+        time.sleep(0.001)
+    uplink.up.set()
+    worker.wake()
+    deadline = time.monotonic() + 5
+    while(len(worker) and time.monotonic() < deadline):
+        time.sleep(0.01)
+    worker.stop()
+    stats = worker.stats()
+    assert uplink.delivered == sorted(set(uplink.delivered))
+    return uplink.delivered, stats
+
+
+if __name__ == '__main__':
+    print(f'acquisition blocked, inline upload:  {producer_block(False) * 1e3:8.3f} ms')
+    print(f'acquisition blocked, upload worker:  {producer_block(True) * 1e3:8.3f} ms')
+    root = tempfile.mkdtemp()
+    try:
+        for policy in (POLICY_DROP_OLDEST, POLICY_COALESCE, POLICY_SPILL):
+            delivered, stats = outage(policy, os.path.join(root, policy))
+            print(f'{policy:11s}: {len(delivered):3d}/{RECORDS} delivered, max depth {stats["max_depth"]}, '
+                  f'mean depth {stats["mean_depth"]}, dropped {stats["dropped"]}, '
+                  f'coalesced {stats["coalesced"]}, spilled {stats["spilled"]}, failures {stats["failures"]}')
+        assert len(delivered) == RECORDS
+    finally:
+        shutil.rmtree(root)
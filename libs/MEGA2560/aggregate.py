@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# aggregate.py
+
+import math
+import threading
+from bisect import bisect_right, insort
+from collections import namedtuple
+
+from libs.MEGA2560.frame import SENSOR_KEYS
+
+# quantiles: tuple of estimates in the order of the requested probabilities
+ChannelSummary = namedtuple(
+    'ChannelSummary', ['count', 'mean', 'min', 'max', 'std', 'quantiles'])
+
+
+class P2Quantile(object):
+    ''' P-square streaming quantile estimator (Jain & Chlamtac, 1985).
+        O(1) time and memory per sample, 5 markers.
+    '''
+
+    def __init__(self, p):
+        assert 0 < p < 1
+        self.p = p
+        self.__q = []  # marker heights
+        self.__n = [0, 1, 2, 3, 4]  # marker positions
+        self.__np = [0, 2 * p, 4 * p, 2 + 2 * p, 4]  # desired positions
+        self.__dn = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.__q
+        if(len(q) < 5):
+            insort(q, x)
+            return
+        n = self.__n
+        if(x < q[0]):
+            q[0] = x
+            k = 0
+        elif(x >= q[4]):
+            q[4] = x
+            k = 3
+        else:
+            k = bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        np = self.__np
+        dn = self.__dn
+        for i in range(5):
+            np[i] += dn[i]
+        # adjust the three middle markers
+        for i in (1, 2, 3):
+            d = np[i] - n[i]
+            if((d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1)):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if(q[i - 1] < qp < q[i + 1]):
+                    q[i] = qp
+                else:
+                    q[i] += d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self):
+        q = self.__q
+        if(not q):
+            return None
+        if(len(q) < 5):
+            # exact nearest-rank while there are not enough samples
+            return q[min(len(q) - 1, int(self.p * len(q)))]
+        return q[2]
+
+
+class ChannelStats(object):
+    ''' count, mean, min, max, std (Welford) and P-square quantiles of one channel
+    '''
+
+    def __init__(self, quantiles=(0.5, 0.9)):
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self.__m2 = 0.0
+        self.__quantiles = tuple(P2Quantile(p) for p in quantiles)
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.__m2 += delta * (x - self.mean)
+        if(self.min is None or x < self.min):
+            self.min = x
+        if(self.max is None or x > self.max):
+            self.max = x
+        for estimator in self.__quantiles:
+            estimator.add(x)
+
+    @property
+    def std(self):
+        ''' sample standard deviation, 0 with less than 2 samples
+        '''
+        if(self.count < 2):
+            return 0.0
+        return math.sqrt(self.__m2 / (self.count - 1))
+
+    def summary(self):
+        return ChannelSummary(self.count, self.mean if self.count else None, self.min, self.max,
+                              self.std, tuple(estimator.value() for estimator in self.__quantiles))
+
+
+class SensorAggregator(object):
+    ''' Per-window statistics of the Mega2560 channels, fed one reading at a time.
+        keys: channels to aggregate (SENSOR_KEYS names)
+        invalid: {key: value} samples to skip, e.g. {'CO2': 65535}
+    '''
+
+    def __init__(self, keys=SENSOR_KEYS, quantiles=(0.5, 0.9), invalid=None):
+        self.keys = tuple(keys)
+        self.quantiles = tuple(quantiles)
+        self.invalid = dict(invalid or {})
+        self.__index = tuple(SENSOR_KEYS.index(key) for key in self.keys)
+        self.__lock = threading.Lock()
+        self.__window_start = None
+        self.__channels = self.__new_channels()
+
+    def __new_channels(self):
+        return tuple(ChannelStats(self.quantiles) for _ in self.keys)
+
+    def add(self, timestamp, reading):
+        ''' Same signature as a SensorSampler listener
+        '''
+        invalid = self.invalid
+        with self.__lock:
+            if(self.__window_start is None):
+                self.__window_start = timestamp
+            for key, idx, channel in zip(self.keys, self.__index, self.__channels):
+                value = reading[idx]
+                if(invalid.get(key) != value):
+                    channel.add(value)
+
+    def snapshot(self, reset=False):
+        ''' Return (window start timestamp, {key: ChannelSummary}), optionally start a new window
+        '''
+        with self.__lock:
+            summaries = {key: channel.summary()
+                         for key, channel in zip(self.keys, self.__channels)}
+            window_start = self.__window_start
+            if(reset):
+                self.__window_start = None
+                self.__channels = self.__new_channels()
+        return window_start, summaries
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# demux.py
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from libs.MEGA2560.frame import MAPS_GET_SENSOR_ALL_CMD, MAPS_LEADING_CMD, SENSOR_ALL_PAYLOAD_LEN, calc_checksum
+from libs.MEGA2560.port import wait_readable
+
+logger = logging.getLogger(__name__)
+
+MAPS_UART_TXRX_EX_CMD = 0xCE
+MAPS_ECHO_UART_ACTIVE_RX_CMD = 0xD0
+
+MAPS_UART_MAX_DATA_LEN = 2048
+# drop a partial frame when the rest does not arrive in time (second)
+FRAME_TIMEOUT = 0.5
+# a pending partial frame is checked this often (second), with none the reader
+# blocks until data arrives
+READ_WAIT = 0.1
+
+# cmd, body: frame without leading byte, command byte and checksum
+MapsFrame = namedtuple('MapsFrame', ['cmd', 'body'])
+
+
+def _frame_len(cmd, buf):
+    ''' Return (frame length, has checksum), length None if more bytes are needed
+        Commands not listed here echo as AA <cmd> <status> <~status>.
+    '''
+    if(cmd == MAPS_GET_SENSOR_ALL_CMD):
+        return 2 + SENSOR_ALL_PAYLOAD_LEN + 2, True
+    if(cmd in (MAPS_ECHO_UART_ACTIVE_RX_CMD, MAPS_UART_TXRX_EX_CMD)):
+        # AA cmd port len_L len_H data... checksum ~checksum
+        if(len(buf) < 5):
+            return None, True
+        data_len = buf[3] | (buf[4] << 8)
+        if(data_len > MAPS_UART_MAX_DATA_LEN):
+            return -1, True
+        return 5 + data_len + 2, True
+    return 4, False
+
+
+class MapsDemux(object):
+    ''' Own the Mega2560 serial port, frame every 0xAA packet once and route
+        it by command byte to the subscribed consumer.
+    '''
+
+    def __init__(self, port):
+        self.__port = port
+        self.__write_lock = threading.Lock()
+        self.__routes = {}
+        self.__buf = bytearray()
+        self.__partial_since = None
+        self.__running = True
+        # close() writes here to end a wait without data
+        self.__wake_r, self.__wake_w = os.pipe()
+        self.frame_count = 0
+        self.error_count = 0
+        self.drop_count = 0
+        self.__thread = threading.Thread(
+            target=self.__run, name='maps_demux_t', daemon=True)
+        self.__thread.start()
+
+    def subscribe(self, cmds):
+        ''' Return a queue.Queue receiving the MapsFrame of cmds
+        '''
+        frame_queue = queue.Queue()
+        self.add_handler(cmds, frame_queue.put)
+        return frame_queue
+
+    def add_handler(self, cmds, handler):
+        ''' Call handler(frame) from the reader thread for frames of cmds
+        '''
+        for cmd in cmds:
+            self.__routes[cmd] = handler
+
+    def write(self, data):
+        with self.__write_lock:
+            self.__port.write(data)
+
+    def close(self):
+        self.__running = False
+        os.write(self.__wake_w, b'\0')
+        self.__thread.join()
+        os.close(self.__wake_r)
+        os.close(self.__wake_w)
+
+    def __run(self):
+        while(self.__running):
+            try:
+                timeout = None if self.__partial_since is None else READ_WAIT
+                if(wait_readable(self.__port, timeout, self.__wake_r)):
+                    self.__buf.extend(self.__port.read(self.__port.in_waiting or 1))
+                self.__parse()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+                time.sleep(0.1)
+
+    def __parse(self):
+        buf = self.__buf
+        while(buf):
+            if(buf[0] != MAPS_LEADING_CMD):
+                start = buf.find(MAPS_LEADING_CMD)
+                skip = len(buf) if start == -1 else start
+                logger.debug(f'skip {skip} byte')
+                del buf[:skip]
+                continue
+            if(len(buf) < 2):
+                break
+            frame_len, has_checksum = _frame_len(buf[1], buf)
+            if(frame_len == -1):
+                self.__resync('bad length')
+                continue
+            if(frame_len is None or len(buf) < frame_len):
+                # wait for the rest, unless the frame is stuck
+                now = time.monotonic()
+                if(self.__partial_since is None):
+                    self.__partial_since = now
+                elif(now - self.__partial_since > FRAME_TIMEOUT):
+                    self.__resync('frame timeout')
+                    continue
+                break
+            self.__partial_since = None
+            if(has_checksum):
+                checksum = calc_checksum(memoryview(buf)[:frame_len - 2])
+                if(buf[frame_len - 2] != checksum or buf[frame_len - 1] != (~checksum & 0xFF)):
+                    self.__resync(f'cmd {buf[1]:02X} checksum')
+                    continue
+                frame = MapsFrame(buf[1], bytes(buf[2:frame_len - 2]))
+            else:
+                frame = MapsFrame(buf[1], bytes(buf[2:frame_len]))
+            del buf[:frame_len]
+            self.frame_count += 1
+            self.__dispatch(frame)
+
+    def __resync(self, reason):
+        ''' Drop the leading byte and look for the next 0xAA
+        '''
+        logger.error(f'frame error: {reason}.')
+        self.error_count += 1
+        self.__partial_since = None
+        del self.__buf[:1]
+
+    def __dispatch(self, frame):
+        handler = self.__routes.get(frame.cmd)
+        if(handler is None):
+            self.drop_count += 1
+            logger.debug(f'drop cmd {frame.cmd:02X}, no consumer.')
+            return
+        handler(frame)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# frame.py
+
+import struct
+from collections import namedtuple
+
+MAPS_LEADING_CMD = 0xAA
+MAPS_GET_SENSOR_ALL_CMD = 0xB5
+
+# GET_SENSOR_ALL payload: 22 little-endian uint16 fields
+SENSOR_ALL_STRUCT = struct.Struct('<22H')
+SENSOR_ALL_PAYLOAD_LEN = SENSOR_ALL_STRUCT.size  # 44 byte
+
+# Legacy dict keys, same order as the payload
+SENSOR_KEYS = (
+    'TEMP',  # (℃)
+    'HUMI',  # (%RH)
+    'CO2',  # (ppm)
+    'AVE_CO2',  # (ppm)
+    'TVOC',  # (ppb)
+    'eCO2',  # (ppm)
+    'S_H2',  # (Raw)
+    'S_ETHANOL',  # (Raw)
+    'BASELINE_TVOC',  # (Raw)
+    'BASELINE_eCO2',  # (Raw)
+    'Illuminance',  # (Lux)
+    'Color_Temperature',  # (°K)
+    'CH_R',  # (Raw)
+    'CH_G',  # (Raw)
+    'CH_B',  # (Raw)
+    'CH_C',  # (Raw)
+    'PM1.0_AE',  # (ug/m3)
+    'PM2.5_AE',  # (ug/m3)
+    'PM10.0_AE',  # (ug/m3)
+    'PM1.0_SP',  # (ug/m3)
+    'PM2.5_SP',  # (ug/m3)
+    'PM10.0_SP',  # (ug/m3)
+)
+
+_SensorReadingBase = namedtuple('_SensorReadingBase', [
+    'temp', 'humi', 'co2', 'ave_co2', 'tvoc', 'eco2', 's_h2', 's_ethanol',
+    'baseline_tvoc', 'baseline_eco2', 'illuminance', 'color_temperature',
+    'ch_r', 'ch_g', 'ch_b', 'ch_c', 'pm1_0_ae', 'pm2_5_ae', 'pm10_0_ae',
+    'pm1_0_sp', 'pm2_5_sp', 'pm10_0_sp'])
+
+
+class SensorReading(_SensorReadingBase):
+    ''' Immutable GET_SENSOR_ALL reading, fields in payload order.
+    '''
+    __slots__ = ()
+
+    def as_dict(self):
+        ''' Return the reading keyed like Mega2560.get_sensor_all()
+        '''
+        return dict(zip(SENSOR_KEYS, self))
+
+
+# XOR key of every byte is (idx + 1) % 0x100, the pattern repeats every 256 byte
+_CHECKSUM_PATTERN = bytes((idx + 1) & 0xFF for idx in range(0x100))
+_CHECKSUM_CACHE_LEN = 64
+
+
+def _checksum_key(length):
+    pattern = _CHECKSUM_PATTERN * (length // 0x100 + 1)
+    return int.from_bytes(pattern[:length], 'little')
+
+
+# XOR keys of the short command frames, indexed by frame length
+_CHECKSUM_KEYS = [_checksum_key(length) for length in range(_CHECKSUM_CACHE_LEN)]
+
+
+def calc_checksum(datas):
+    ''' MAPS checksum: sum(byte ^ ((idx + 1) % 0x100)) & 0xFF
+    '''
+    length = len(datas)
+    if(length < _CHECKSUM_CACHE_LEN):
+        key = _CHECKSUM_KEYS[length]
+    else:
+        key = _checksum_key(length)
+    xored = int.from_bytes(datas, 'little') ^ key
+    return sum(xored.to_bytes(length, 'little')) & 0xFF
+
+
+# Checksum of the GET_SENSOR_ALL header is fixed, only the payload varies
+_SENSOR_ALL_HEADER = bytes((MAPS_LEADING_CMD, MAPS_GET_SENSOR_ALL_CMD))
+_SENSOR_ALL_HEADER_SUM = sum(
+    data ^ (idx + 1) for idx, data in enumerate(_SENSOR_ALL_HEADER))
+_SENSOR_ALL_PAYLOAD_KEY = int.from_bytes(
+    bytes((idx + 3) & 0xFF for idx in range(SENSOR_ALL_PAYLOAD_LEN)), 'little')
+
+
+def sensor_all_checksum(payload):
+    ''' Checksum of a GET_SENSOR_ALL frame (header included) from its 44 byte payload
+    '''
+    xored = int.from_bytes(payload, 'little') ^ _SENSOR_ALL_PAYLOAD_KEY
+    return (_SENSOR_ALL_HEADER_SUM + sum(xored.to_bytes(SENSOR_ALL_PAYLOAD_LEN, 'little'))) & 0xFF
+
+
+def verify_sensor_all(payload, rcv_checksums):
+    ''' Check the 2 checksum bytes (checksum, ~checksum) against the payload
+    '''
+    if(len(payload) != SENSOR_ALL_PAYLOAD_LEN or len(rcv_checksums) != 2):
+        return False
+    checksum = sensor_all_checksum(payload)
+    return (rcv_checksums[0] == checksum and rcv_checksums[1] == (~checksum & 0xFF))
+
+
+def decode_sensor_all(payload):
+    ''' Decode the 44 byte GET_SENSOR_ALL payload into a SensorReading
+        Note: the payload is not verified, see verify_sensor_all().
+    '''
+    values = SENSOR_ALL_STRUCT.unpack_from(payload)
+    return SensorReading(values[0] / 100, values[1] / 100, *values[2:])
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# history.py
+
+import math
+import threading
+from array import array
+from collections import namedtuple
+
+from libs.MEGA2560.frame import SENSOR_KEYS, SensorReading
+
+_KEY_INDEX = {key: idx for idx, key in enumerate(SENSOR_KEYS)}
+
+
+class HistoryWindow(namedtuple('HistoryWindow', ['timestamps', 'columns'])):
+    ''' timestamps: array('d'), columns: one array('f') per channel in SENSOR_KEYS order
+    '''
+    __slots__ = ()
+
+    def column(self, key):
+        return self.columns[_KEY_INDEX[key]]
+
+
+class SensorHistory(object):
+    ''' Fixed-size columnar ring buffer of sensor readings.
+        Memory is allocated once: capacity * (8 + 4 * 22) byte.
+        Timestamps must not go backwards.
+    '''
+
+    def __init__(self, retention_s=86400, interval_s=1):
+        self.capacity = max(1, int(math.ceil(retention_s / interval_s)))
+        self.__timestamps = array('d', bytes(8 * self.capacity))
+        self.__columns = tuple(array('f', bytes(4 * self.capacity))
+                               for _ in SENSOR_KEYS)
+        self.__head = 0  # next write position
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return self.__count
+
+    def append(self, timestamp, reading):
+        with self.__lock:
+            head = self.__head
+            self.__timestamps[head] = timestamp
+            for column, value in zip(self.__columns, reading):
+                column[head] = value
+            self.__head = (head + 1) % self.capacity
+            if(self.__count < self.capacity):
+                self.__count += 1
+
+    def latest(self):
+        ''' Return (timestamp, SensorReading) of the newest sample, None if empty
+        '''
+        with self.__lock:
+            if(self.__count == 0):
+                return None
+            idx = (self.__head - 1) % self.capacity
+            return (self.__timestamps[idx],
+                    SensorReading._make(column[idx] for column in self.__columns))
+
+    def window(self, start=None, end=None, keys=None):
+        ''' Return the HistoryWindow of samples with start <= timestamp < end
+            keys: only copy these channels, the other columns are empty
+        '''
+        with self.__lock:
+            first = self.__bisect(start) if start is not None else 0
+            last = self.__bisect(end) if end is not None else self.__count
+            wanted = None if keys is None else {_KEY_INDEX[key] for key in keys}
+            timestamps = self.__slice(self.__timestamps, first, last)
+            columns = tuple(self.__slice(column, first, last)
+                            if wanted is None or idx in wanted else array('f')
+                            for idx, column in enumerate(self.__columns))
+        return HistoryWindow(timestamps, columns)
+
+    def column(self, key, start=None, end=None):
+        return self.window(start, end, (key,)).column(key)
+
+    def __oldest(self):
+        return (self.__head - self.__count) % self.capacity
+
+    def __bisect(self, timestamp):
+        ''' First logical index with timestamps >= timestamp
+        '''
+        oldest = self.__oldest()
+        lo, hi = 0, self.__count
+        while(lo < hi):
+            mid = (lo + hi) // 2
+            if(self.__timestamps[(oldest + mid) % self.capacity] < timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __slice(self, column, first, last):
+        ''' Copy logical [first, last) out of the ring, at most two memcpy
+        '''
+        if(first >= last):
+            return array(column.typecode)
+        begin = (self.__oldest() + first) % self.capacity
+        end = begin + (last - first)
+        if(end <= self.capacity):
+            return column[begin:end]
+        return column[begin:] + column[:end - self.capacity]
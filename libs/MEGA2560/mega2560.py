@@ -7,8 +7,12 @@
 # @Date   : 12/15/2021, 11:46:29 AM
 
 import logging
+import queue
 import time
 
+from libs.MEGA2560.demux import MapsDemux
+from libs.MEGA2560.frame import SENSOR_KEYS, calc_checksum, decode_sensor_all
+
 logger = logging.getLogger(__name__)
 
 MAPS_LEADING_CMD = 0xAA
@@ -18,7 +22,13 @@ MAPS_SET_POLLING_SENSOR_CMD = 0xC6
 
 class Mega2560(object):
     def __init__(self, serial):
+        # serial: MapsDemux shared with MAPS6Adapter, or a serial port owned alone
+        if(not isinstance(serial, MapsDemux)):
+            serial = MapsDemux(serial)
         self.__port = serial
+        self.__echo_queue = serial.subscribe(
+            (MAPS_GET_SENSOR_ALL_CMD, MAPS_SET_POLLING_SENSOR_CMD))
+        self.__sensor_reading = None
         self.__sensor_data = {
             'TEMP': 0,  # (℃)
             'HUMI': 0,  # (%RH)
@@ -47,71 +57,52 @@ class Mega2560(object):
     def __Not(self, byte):
         return ~byte & 0xFF
 
-    def __Calc_checkSum(self, datas):
-        return (sum([(data) ^ ((idx + 1) % 0x100) for idx, data in enumerate(datas)]) & 0xFF)
-
-    def __2byte_to_int16(self, _2byte):
-        return ((_2byte[1] << 8) | _2byte[0])
+    def __discard_echo(self):
+        ''' Drop echoes left over from timed out commands
+        '''
+        while(True):
+            try:
+                self.__echo_queue.get_nowait()
+            except queue.Empty:
+                return
 
     def __wait_echo_command(self, echo_cmd, timeout=1000):
         timeout = time.time() + (timeout / 1000)
         while(time.time() < timeout):
-            while(self.__port.inWaiting() >= 2):
-                bytes_data = self.__port.read(2)
-                if(bytes_data[0] == MAPS_LEADING_CMD and bytes_data[1] == echo_cmd):
-                    return True
-        self.__port.read_all()
+            try:
+                frame = self.__echo_queue.get(timeout=timeout - time.time())
+            except (queue.Empty, ValueError):
+                break
+            if(frame.cmd == echo_cmd):
+                return frame
         logger.error(f'echo_cmd: {echo_cmd:02X} error.')
-        return False
+        return None
 
-    def get_sensor_all(self):
+    def get_sensor_reading(self):
+        ''' Read all sensor, return SensorReading or None on error
+        '''
         data = bytearray()
         data.append(MAPS_LEADING_CMD)
         data.append(self.__Not(MAPS_LEADING_CMD))
         data.append(MAPS_GET_SENSOR_ALL_CMD)
         data.append(self.__Not(MAPS_GET_SENSOR_ALL_CMD))
 
+        self.__discard_echo()
         self.__port.write(bytes(data))
-        if(not self.__wait_echo_command(MAPS_GET_SENSOR_ALL_CMD)):
-            return self.__sensor_data
+        # checksum is verified by MapsDemux
+        frame = self.__wait_echo_command(MAPS_GET_SENSOR_ALL_CMD)
+        if(frame is None):
+            return None
+        self.__sensor_reading = decode_sensor_all(frame.body)
+        return self.__sensor_reading
 
-        # read all data
-        data = bytearray(self.__port.read(44))
-        # calc checksum
-        data.insert(0, MAPS_GET_SENSOR_ALL_CMD)
-        data.insert(0, MAPS_LEADING_CMD)
-        rcv_checksums = self.__port.read(2)
-        checksum = self.__Calc_checkSum(data)
-        if (rcv_checksums[0] != checksum or rcv_checksums[1] != self.__Not(checksum)):
-            self.__port.read_all()
-            logger.error('read sensor all data error.')
-            return self.__sensor_data
-        # read sensor data
-        self.__sensor_data['TEMP'] = (self.__2byte_to_int16(data[2:4])/100)
-        self.__sensor_data['HUMI'] = (self.__2byte_to_int16(data[4:6])/100)
-        self.__sensor_data['CO2'] = self.__2byte_to_int16(data[6:8])
-        self.__sensor_data['AVE_CO2'] = self.__2byte_to_int16(data[8:10])
-        self.__sensor_data['TVOC'] = self.__2byte_to_int16(data[10:12])
-        self.__sensor_data['eCO2'] = self.__2byte_to_int16(data[12:14])
-        self.__sensor_data['S_H2'] = self.__2byte_to_int16(data[14:16])
-        self.__sensor_data['S_ETHANOL'] = self.__2byte_to_int16(data[16:18])
-        self.__sensor_data['BASELINE_TVOC'] = self.__2byte_to_int16(
-            data[18:20])
-        self.__sensor_data['BASELINE_eCO2'] = self.__2byte_to_int16(
-            data[20:22])
-        self.__sensor_data['Illuminance'] = self.__2byte_to_int16(data[22:24])
-        self.__sensor_data['Color_Temperature'] = self.__2byte_to_int16(
-            data[24:26])
-        self.__sensor_data['CH_R'] = self.__2byte_to_int16(data[26:28])
-        self.__sensor_data['CH_G'] = self.__2byte_to_int16(data[28:30])
-        self.__sensor_data['CH_B'] = self.__2byte_to_int16(data[30:32])
-        self.__sensor_data['CH_C'] = self.__2byte_to_int16(data[32:34])
-        self.__sensor_data['PM1.0_AE'] = self.__2byte_to_int16(data[34:36])
-        self.__sensor_data['PM2.5_AE'] = self.__2byte_to_int16(data[36:38])
-        self.__sensor_data['PM10.0_AE'] = self.__2byte_to_int16(data[38:40])
-        self.__sensor_data['PM1.0_SP'] = self.__2byte_to_int16(data[40:42])
-        self.__sensor_data['PM2.5_SP'] = self.__2byte_to_int16(data[42:44])
-        self.__sensor_data['PM10.0_SP'] = self.__2byte_to_int16(data[44:46])
+    def get_sensor_all(self):
+        ''' Read all sensor, return the last valid data as dict.
+            A new dict per reading, a dict returned earlier is never changed.
+        '''
+        reading = self.get_sensor_reading()
+        if(reading is not None):
+            self.__sensor_data = dict(zip(SENSOR_KEYS, reading))
         return self.__sensor_data
 
     def set_sensor_all_polling(self):
@@ -129,12 +120,13 @@ class Mega2560(object):
         data.append(light)
         data.append(pms)
         data.append(rtc)
-        checksum = self.__Calc_checkSum(data)
+        checksum = calc_checksum(data)
         data.append(checksum)
         data.append(self.__Not(checksum))
 
+        self.__discard_echo()
         self.__port.write(bytes(data))
-        if(not self.__wait_echo_command(MAPS_SET_POLLING_SENSOR_CMD)):
+        frame = self.__wait_echo_command(MAPS_SET_POLLING_SENSOR_CMD)
+        if(frame is None):
             return False
-        bytes_data = self.__port.read(2)
-        return (bytes_data[0] == 0x00 and bytes_data[1] == 0xFF)
+        return (frame.body[0] == 0x00 and frame.body[1] == 0xFF)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# port.py
+
+import select
+import time
+
+
+def wait_readable(port, timeout, wake_fd=None):
+    ''' Block until the serial port has data or timeout(second) expires,
+        None waits without a limit. Data on wake_fd, e.g. the read end of
+        an os.pipe(), ends the wait too and is left for the caller.
+    '''
+    if(port.in_waiting):
+        return True
+    if(timeout is not None and timeout <= 0):
+        return False
+    try:
+        fd = port.fileno()
+        readable, _, _ = select.select([fd] if wake_fd is None else [fd, wake_fd], [], [], timeout)
+        return fd in readable
+    except (AttributeError, ValueError, OSError):
+        # No selectable fd (e.g. Windows COM port), nap instead of spinning
+        time.sleep(0.01 if timeout is None else min(timeout, 0.01))
+        return port.in_waiting > 0
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# sampler.py
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SensorSampler(object):
+    ''' Poll Mega2560.get_sensor_reading() on a fixed interval in its own thread
+        and push every valid reading into a SensorHistory.
+    '''
+
+    def __init__(self, mega2560, history, interval_s=1):
+        self.mega2560 = mega2560
+        self.history = history
+        self.interval_s = interval_s
+        self.sample_count = 0
+        self.error_count = 0
+        self.__listeners = []
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def add_listener(self, callback):
+        ''' callback(timestamp, reading) is called from the sampler thread
+        '''
+        self.__listeners.append(callback)
+
+    def start(self):
+        self.__stop.clear()
+        self.__thread = threading.Thread(
+            target=self.__run, name='sensor_sampler_t', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        if(self.__thread):
+            self.__thread.join()
+
+    def sample(self):
+        ''' Take one reading now, return (timestamp, reading) or None
+        '''
+        reading = self.mega2560.get_sensor_reading()
+        if(reading is None):
+            self.error_count += 1
+            return None
+        timestamp = time.time()
+        self.history.append(timestamp, reading)
+        self.sample_count += 1
+        for callback in self.__listeners:
+            try:
+                callback(timestamp, reading)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+        return timestamp, reading
+
+    def __run(self):
+        next_time = time.monotonic()
+        while(not self.__stop.is_set()):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            # keep the schedule, skip missed slots instead of bursting
+            next_time += self.interval_s
+            now = time.monotonic()
+            while(next_time < now):
+                next_time += self.interval_s
+            self.__stop.wait(next_time - now)
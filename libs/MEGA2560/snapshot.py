@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# snapshot.py
+
+import threading
+from collections import namedtuple
+
+from libs.MEGA2560.frame import SENSOR_KEYS
+
+_KEY_INDEX = {key: idx for idx, key in enumerate(SENSOR_KEYS)}
+
+
+class SensorSnapshot(namedtuple('SensorSnapshot', ['seq', 'timestamp', 'reading'])):
+    ''' Immutable published sample, seq counts up from 1 with every publish()
+    '''
+    __slots__ = ()
+
+    def value(self, key):
+        ''' Value of a SENSOR_KEYS key, e.g. 'PM2.5_AE'
+        '''
+        return self.reading[_KEY_INDEX[key]]
+
+    def as_dict(self):
+        return self.reading.as_dict()
+
+
+class SnapshotSlot(object):
+    ''' Latest SensorSnapshot shared between threads.
+        publish() builds a new snapshot and swaps it in with one reference
+        assignment, latest() needs no lock and never sees a half-updated
+        sample. Readers keep the seq they last handled to skip unchanged data.
+    '''
+
+    def __init__(self):
+        self.__snapshot = None
+        self.__seq = 0
+        self.__lock = threading.Lock()  # between writers only
+
+    def publish(self, timestamp, reading):
+        with self.__lock:
+            self.__seq += 1
+            snapshot = SensorSnapshot(self.__seq, timestamp, reading)
+            self.__snapshot = snapshot
+        return snapshot
+
+    def latest(self):
+        ''' Return the newest SensorSnapshot, None before the first publish()
+        '''
+        return self.__snapshot
+
+    def newer(self, seq):
+        ''' Return the newest snapshot if it is newer than seq, else None
+        '''
+        snapshot = self.__snapshot
+        if(snapshot is None or snapshot.seq <= seq):
+            return None
+        return snapshot
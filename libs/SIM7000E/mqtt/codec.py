@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# codec.py
+#
+# MQTT 3.1.1 packet encoder/decoder on bytes.
+
+import struct
+from collections import namedtuple
+
+# 2.2.1 MQTT Control Packet type
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+PROTOCOL_NAME = 'MQTT'
+PROTOCOL_LEVEL = 4  # MQTT Version 3.1.1
+
+# 2.2.3 Remaining Length, 4 byte at most
+MAX_REMAINING_LEN = 268435455
+
+# 3.2.2.3 Connect Return code
+CONNACK_RETURN_CODES = {
+    0: 'Connection Accepted',
+    1: 'unacceptable protocol version',
+    2: 'identifier rejected',
+    3: 'Server unavailable',
+    4: 'bad user name or password',
+    5: 'not authorized',
+}
+
+_UINT16 = struct.Struct('>H')
+
+# type: control packet type, flags: low nibble of byte 1, body: variable header + payload
+Packet = namedtuple('Packet', ['type', 'flags', 'body'])
+# packet_id is None for QoS 0
+PublishMessage = namedtuple('PublishMessage', ['topic', 'payload', 'qos', 'retain', 'dup', 'packet_id'])
+
+
+class MalformedPacket(ValueError):
+    pass
+
+
+def encode_remaining_length(length):
+    ''' 2.2.3 variable length integer, 1 to 4 byte
+    '''
+    if(not 0 <= length <= MAX_REMAINING_LEN):
+        raise ValueError(f'Remaining Length out of range: {length}')
+    out = bytearray()
+    while(True):
+        byte = length & 0x7F
+        length >>= 7
+        if(length):
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_remaining_length(buf, offset=1):
+    ''' Return (length, offset of the body), None while buf is too short
+    '''
+    value = 0
+    for idx in range(4):
+        if(offset + idx >= len(buf)):
+            return None
+        byte = buf[offset + idx]
+        value |= (byte & 0x7F) << (7 * idx)
+        if(not byte & 0x80):
+            return value, offset + idx + 1
+    raise MalformedPacket('Remaining Length exceeds 4 byte')
+
+
+def encode_string(string):
+    ''' 1.5.3 UTF-8 encoded string with a 2 byte length prefix
+    '''
+    data = string.encode('utf-8') if isinstance(string, str) else bytes(string)
+    if(len(data) > 0xFFFF):
+        raise ValueError('string longer than 65535 byte')
+    return _UINT16.pack(len(data)) + data
+
+
+def decode_string(buf, offset=0):
+    ''' Return (string, offset after it)
+    '''
+    if(offset + 2 > len(buf)):
+        raise MalformedPacket('string length truncated')
+    length, = _UINT16.unpack_from(buf, offset)
+    end = offset + 2 + length
+    if(end > len(buf)):
+        raise MalformedPacket('string truncated')
+    return bytes(buf[offset + 2:end]).decode('utf-8'), end
+
+
+def encode_packet(packet_type, flags, *parts):
+    ''' Fixed header + the concatenated parts
+    '''
+    body_len = sum(len(part) for part in parts)
+    return b''.join((bytes((packet_type << 4 | flags,)), encode_remaining_length(body_len)) + parts)
+
+
+def connect(client_id, username='', password='', keepalive=60, clean_session=True):
+    ''' 3.1 CONNECT
+    '''
+    flags = clean_session << 1
+    payload = [encode_string(client_id)]
+    if(username):
+        flags |= 0x80
+        payload.append(encode_string(username))
+    if(password):
+        flags |= 0x40
+        payload.append(encode_string(password))
+    variable_header = encode_string(PROTOCOL_NAME) + bytes((PROTOCOL_LEVEL, flags)) + _UINT16.pack(keepalive)
+    return encode_packet(CONNECT, 0, variable_header, *payload)
+
+
+def publish(topic, payload, qos=0, retain=False, packet_id=None, dup=False):
+    ''' 3.3 PUBLISH, payload: bytes or str (UTF-8)
+    '''
+    if(isinstance(payload, str)):
+        payload = payload.encode('utf-8')
+    flags = (dup << 3) | (qos << 1) | retain
+    if(qos):
+        return encode_packet(PUBLISH, flags, encode_string(topic), _UINT16.pack(packet_id), payload)
+    return encode_packet(PUBLISH, flags, encode_string(topic), payload)
+
+
+def puback(packet_id):
+    ''' 3.4 PUBACK
+    '''
+    return encode_packet(PUBACK, 0, _UINT16.pack(packet_id))
+
+
+def subscribe(packet_id, topic, qos=0):
+    ''' 3.8 SUBSCRIBE, one topic filter
+    '''
+    return encode_packet(SUBSCRIBE, 0x02, _UINT16.pack(packet_id), encode_string(topic), bytes((qos,)))
+
+
+def unsubscribe(packet_id, topic):
+    ''' 3.10 UNSUBSCRIBE, one topic filter
+    '''
+    return encode_packet(UNSUBSCRIBE, 0x02, _UINT16.pack(packet_id), encode_string(topic))
+
+
+def pingreq():
+    return b'\xC0\x00'
+
+
+def disconnect():
+    return b'\xE0\x00'
+
+
+def parse(buf, offset=0):
+    ''' Return (Packet, offset after it), (None, offset) while the packet is incomplete
+    '''
+    if(len(buf) - offset < 2):
+        return None, offset
+    result = decode_remaining_length(buf, offset + 1)
+    if(result is None):
+        return None, offset
+    length, start = result
+    end = start + length
+    if(end > len(buf)):
+        return None, offset
+    byte = buf[offset]
+    return Packet(byte >> 4, byte & 0x0F, bytes(buf[start:end])), end
+
+
+def decode_connack(packet):
+    ''' Return (session present, return code)
+    '''
+    if(packet.type != CONNACK or len(packet.body) != 2):
+        raise MalformedPacket('not a CONNACK')
+    return bool(packet.body[0] & 0x01), packet.body[1]
+
+
+def decode_packet_id(packet):
+    ''' Packet Identifier of PUBACK, PUBREC, PUBREL, PUBCOMP, SUBACK and UNSUBACK
+    '''
+    if(len(packet.body) < 2):
+        raise MalformedPacket('Packet Identifier truncated')
+    return _UINT16.unpack_from(packet.body)[0]
+
+
+def decode_suback(packet):
+    ''' Return (packet id, [return code per topic]), 0x80 is failure
+    '''
+    return decode_packet_id(packet), list(packet.body[2:])
+
+
+def decode_publish(packet):
+    if(packet.type != PUBLISH):
+        raise MalformedPacket('not a PUBLISH')
+    qos = (packet.flags >> 1) & 0x03
+    topic, offset = decode_string(packet.body)
+    packet_id = None
+    if(qos):
+        if(offset + 2 > len(packet.body)):
+            raise MalformedPacket('Packet Identifier truncated')
+        packet_id, = _UINT16.unpack_from(packet.body, offset)
+        offset += 2
+    return PublishMessage(topic, packet.body[offset:], qos, bool(packet.flags & 0x01),
+                          bool(packet.flags & 0x08), packet_id)
+
+
+class PacketReader(object):
+    ''' Split a byte stream into packets, feed() what the socket returns
+    '''
+
+    def __init__(self):
+        self.__buf = bytearray()
+
+    def feed(self, data):
+        self.__buf.extend(data)
+
+    def __len__(self):
+        return len(self.__buf)
+
+    def needed(self):
+        ''' Byte still missing for the next packet, at least 1 while its header is incomplete
+        '''
+        if(len(self.__buf) < 2):
+            return 2 - len(self.__buf)
+        result = decode_remaining_length(self.__buf)
+        if(result is None):
+            return 1
+        length, start = result
+        return max(0, start + length - len(self.__buf))
+
+    def read(self):
+        ''' Return the next complete packet, None while it is incomplete
+        '''
+        packet, offset = parse(self.__buf)
+        if(packet is not None):
+            del self.__buf[:offset]
+        return packet
+
+    def packets(self):
+        ''' Yield every complete packet buffered
+        '''
+        packet = self.read()
+        while(packet is not None):
+            yield packet
+            packet = self.read()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# manager.py
+
+import logging
+import threading
+import time
+
+from libs.SIM7000E.mqtt import codec
+from libs.SIM7000E.sim_access.urc import URC_CIPRXGET, URC_CLOSED, URC_PDP_DEACT
+from libs.retry.retry import Backoff, CircuitOpen, JITTER_EQUAL, circuit_breaker
+
+logger = logging.getLogger('maps6')
+
+# reconnect delay after a failure (second), doubled up to the maximum
+RECONNECT_MIN_DELAY = 5
+RECONNECT_MAX_DELAY = 300
+# failures in a row that open the broker circuit, no connect while it is open (second)
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 600
+# PINGREQ after this fraction of the keep alive without any packet sent
+PING_RATIO = 0.5
+# second without PINGRESP before the session counts as lost
+PING_TIMEOUT = 60
+
+
+class MQTTConnectionManager(object):
+    ''' Keep one MQTT session open across uploads while active() is True,
+        e.g. while NB-IoT is the uplink, and close it when it turns False.
+        A thread sends PINGREQ when the session is idle and reconnects with
+        exponential backoff after a failed connect, PINGREQ or publish.
+        A circuit breaker per broker stops connect attempts for a while
+        after BREAKER_THRESHOLD failures in a row, a connect skipped because
+        the module circuit is open does not count.
+        It also reads what the broker pushes, only after the module notified
+        data (+CIPRXGET: 1), and calls mqtt.callback from its own thread.
+        MQTT operations are serialized by a session lock. The modem lock
+        (tcp.lock) is held per AT command, never across a broker reply wait.
+    '''
+
+    def __init__(self, mqtt, tick_s=1, active=None):
+        self.mqtt = mqtt
+        self.tcp = mqtt.tcp
+        self.tick_s = tick_s
+        self.active = active or (lambda: True)
+        self.connect_count = 0
+        self.connect_failures = 0
+        self.disconnect_count = 0
+        self.ping_count = 0
+        self.handshake_time = 0.0  # seconds spent in successful connects
+        self.last_handshake = None
+        self.__connected = False
+        self.__last_activity = 0
+        self.__ping_sent = None  # monotonic time of the PINGREQ waiting for PINGRESP
+        self.__session = threading.RLock()
+        # jitter keeps a fleet from reconnecting in step
+        self.backoff = Backoff(RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY, jitter=JITTER_EQUAL)
+        self.breaker = circuit_breaker(f'mqtt://{mqtt.broker}:{mqtt.port}',
+                                       failure_threshold=BREAKER_THRESHOLD, reset_timeout_s=BREAKER_RESET)
+        self.__failures = 0  # connect failures in a row
+        self.__retry_time = 0
+        self.__subscriptions = {}  # topic: qos, subscribed again after each connect
+        self.__stop = threading.Event()
+        # set when the module notifies data (+CIPRXGET: 1)
+        self.__wake = threading.Event()
+        self.__thread = None
+        self.tcp.urc.add_handler(URC_CIPRXGET, self.__on_data)
+        self.tcp.urc.add_handler(URC_CLOSED, self.__on_link_lost)
+        self.tcp.urc.add_handler(URC_PDP_DEACT, self.__on_link_lost)
+
+    def start(self):
+        self.__stop.clear()
+        self.__thread = threading.Thread(
+            target=self.__run, name='mqtt_manager_t', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self, disconnect=True):
+        self.__stop.set()
+        self.__wake.set()
+        if(self.__thread):
+            self.__thread.join()
+        if(disconnect and self.__connected):
+            with self.__session:
+                self.mqtt.disconnect()
+            self.__connected = False
+
+    def connected(self):
+        return self.__connected
+
+    def publish(self, topic, msg, qos=0, retain=False):
+        ''' MQTT.publish() on the managed session, False while reconnecting is backed off
+        '''
+        with self.__session:
+            if(not self.__ensure_connected()):
+                return False
+            result = self.mqtt.publish(topic, msg, qos, retain)
+            self.__on_result(result, 'PUBLISH')
+            return result
+
+    def publish_many(self, messages, qos=1, retain=False, window=8):
+        ''' MQTT.publish_many() on the managed session
+        '''
+        messages = list(messages)
+        with self.__session:
+            if(not self.__ensure_connected()):
+                return [False] * len(messages)
+            results = self.mqtt.publish_many(messages, qos, retain, window)
+            self.__on_result(all(results), 'PUBLISH')
+            return results
+
+    def subscribe(self, topic, qos=0):
+        ''' Subscribe now if connected and after every reconnect
+        '''
+        self.__subscriptions[topic] = qos
+        with self.__session:
+            if(self.__connected):
+                return self.mqtt.subscribe(topic, qos)
+        return None
+
+    def stats(self):
+        return {
+            'connected': self.__connected,
+            'connect_count': self.connect_count,
+            'connect_failures': self.connect_failures,
+            'disconnect_count': self.disconnect_count,
+            'ping_count': self.ping_count,
+            'last_handshake': self.last_handshake,
+            'mean_handshake': self.handshake_time / self.connect_count if self.connect_count else None,
+            'circuit': self.breaker.stats(),
+        }
+
+    def __on_data(self, name, line):
+        self.__wake.set()
+
+    def __on_link_lost(self, name, line):
+        # URC handlers run with tcp.lock held by the reader
+        if(self.__connected):
+            self.__mark_down(line)
+
+    def __mark_down(self, reason):
+        logger.warning(f'MQTT session lost: {reason}')
+        self.__connected = False
+        self.__ping_sent = None
+        self.disconnect_count += 1
+        self.__retry_time = time.monotonic()
+
+    def __on_result(self, result, what):
+        if(result):
+            self.__last_activity = time.monotonic()
+            # a PINGRESP read by a publish is dropped there, the broker answered anyway
+            self.__ping_sent = None
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+            self.__mark_down(f'{what} failed')
+
+    def __ensure_connected(self):
+        if(self.__connected):
+            return True
+        if(time.monotonic() < self.__retry_time or not self.breaker.allow()):
+            return False
+        return self.__connect()
+
+    def __connect(self):
+        start = time.monotonic()
+        try:
+            if(self.tcp.connected()):
+                # TCP without an MQTT session, CONNECT must be the first packet
+                self.tcp.disconnect()
+            result = self.mqtt.connect()
+        except CircuitOpen as e:
+            # the module is locked out already, not a failure of the broker
+            logger.warning(f'MQTT connect skipped, {e.name} circuit open')
+            self.__retry_time = time.monotonic() + self.backoff.delay(self.__failures)
+            return False
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            result = False
+        elapsed = time.monotonic() - start
+        if(result):
+            self.connect_count += 1
+            self.handshake_time += elapsed
+            self.last_handshake = elapsed
+            self.__connected = True
+            self.__last_activity = time.monotonic()
+            self.__failures = 0
+            self.breaker.record_success()
+            logger.info(f'MQTT session up in {elapsed:.2f} s ({self.connect_count} connects)')
+            for topic, qos in self.__subscriptions.items():
+                if(self.mqtt.subscribe(topic, qos) is None):
+                    logger.warning(f'MQTT subscribe {topic} failed')
+            return True
+        self.connect_failures += 1
+        self.breaker.record_failure()
+        delay = self.backoff.delay(self.__failures)
+        self.__failures += 1
+        self.__retry_time = time.monotonic() + delay
+        logger.warning(f'MQTT connect failed, retry in {delay:.0f} s')
+        return False
+
+    def __tick(self):
+        with self.__session:
+            if(not self.active()):
+                if(self.__connected):
+                    logger.info('MQTT session not needed, disconnect')
+                    self.mqtt.disconnect()
+                    self.__connected = False
+                return
+            if(not self.__connected):
+                self.__ensure_connected()
+                return
+            # no CIPRXGET=4 round trip unless the module has sent something
+            if(self.tcp.data_available_flag or self.tcp.adapter.available()):
+                for packet in self.mqtt.poll():
+                    if(packet.type == codec.PINGRESP):
+                        self.__on_result(True, 'PINGREQ')
+                    else:
+                        logger.debug(f'Unprocessable packet: {packet}')
+            if(not self.__connected):
+                return
+            now = time.monotonic()
+            if(self.__ping_sent is not None):
+                if(now - self.__ping_sent > PING_TIMEOUT):
+                    self.__on_result(False, 'PINGREQ')
+            elif(now - self.__last_activity >= self.mqtt.keepAlive_s * PING_RATIO):
+                # PINGRESP comes back through poll() on a later tick
+                self.ping_count += 1
+                self.__ping_sent = now
+                if(not self.mqtt.sendPingReq()):
+                    self.__on_result(False, 'PINGREQ')
+        self.mqtt.processInbound()
+
+    def __run(self):
+        while(not self.__stop.is_set()):
+            try:
+                self.__tick()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            self.__wake.wait(self.tick_s)
+            self.__wake.clear()
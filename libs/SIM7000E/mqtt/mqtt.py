@@ -6,46 +6,23 @@
 # @Link   :
 # @Date   : 11/26/2021, 5:45:18 PM
 
-import re
-
 import logging
+import queue
 import time
+from collections import OrderedDict, deque
 from random import randint
 import hashlib
-import re
+from libs.SIM7000E.mqtt import codec
 from libs.SIM7000E.sim_access.adapter import SerialAdapter, MAPS6Adapter
 from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+from libs.retry.retry import CircuitOpen
 
 
 logger = logging.getLogger('maps6')
 
 
-# byte 1, bits 7-0. Table 2.1 and 2.2
-MQTT_CONTROL_TYPE_PACKET_CONNECT = '10'  # Client request to connect to Server
-MQTT_CONTROL_TYPE_PACKET_CONNACK = '20'  # Connect acknowledgment
-# FIXME: AND Table 2.2 - flag bits
-MQTT_CONTROL_TYPE_PACKET_PUBLISH = '3'  # Publish message
-MQTT_CONTROL_TYPE_PACKET_PUBACK = '40'   # Publish acknowledgment
-# Publish re_TYPEceived (assured delivery part 1)
-MQTT_CONTROL_TYPE_PACKET_PUBREC = '50'
-# Publish release (assured delivery part 2)
-MQTT_CONTROL_TYPE_PACKET_PUBREL = '62'
-# Publish co_TYPEmplete (assured delivery part 3)
-MQTT_CONTROL_TYPE_PACKET_PUBCOMP = '70'
-MQTT_CONTROL_TYPE_PACKET_SUBSCRIBE = '82'  # Client subscribe request
-MQTT_CONTROL_TYPE_PACKET_SUBACK = '90'  # Subscribe acknowledgment
-MQTT_CONTROL_TYPE_PACKET_UNSUBSCRIBE = 'A2'  # Unsubscribe request
-MQTT_CONTROL_TYPE_PACKET_UNSUBACK = 'B0'  # Unsubscribe acknowledgment
-MQTT_CONTROL_TYPE_PACKET_PINGREQ = 'C0'  # PING request
-MQTT_CONTROL_TYPE_PACKET_PINGRESP = 'D0'  # PING response
-MQTT_CONTROL_TYPE_PACKET_DISCONNECT = 'E0'  # Client is disconnecting
-
-MQTT_PROTOCOL_NAME = 'MQTT'
-MQTT_PROTOCOL_LEVEL = '4'  # MQTT Version 3.1.1
-
-
 class MQTT(object):
-    ''' Note: Remaining Length currently support range 0~16383(1~2 byte).
+    ''' Note: Packets are built by libs.SIM7000E.mqtt.codec, Remaining Length up to 268435455.
         Note: QoS currently support range 0~1.
         Note: All exceptions are handled in the MQTT category.
     '''
@@ -68,94 +45,46 @@ class MQTT(object):
         self.clean_session = clean_session
         self.publish_qos1_count = 0
         self.callback = None
-        self.buffer = []
+        # PUBLISH packets from the broker (codec.PublishMessage) waiting for the callback
+        self.inbound = queue.Queue()
+        # other packets received but not consumed yet
+        self.__packets = deque()
         self.pingReq_timer = time.time() + self.keepAlive_s
+        self.__reader = codec.PacketReader()
 
     def connect(self):
         ''' 3.1 CONNECT - Client requests a connection to a Server
+            CircuitOpen from the module is raised, other errors return False.
         '''
         try:
             if(not self.tcp.connected()):
                 self.tcp.connect(self.broker, self.port)
-                # 3.1.1 Fixed header，xx = Remaining len
-                packet = MQTT_CONTROL_TYPE_PACKET_CONNECT + 'XX'
-                # 3.1.2.1 Protocol Name
-                packet += str(len(MQTT_PROTOCOL_NAME)).zfill(4)
-                packet += self.__strToHexString(MQTT_PROTOCOL_NAME)
-                # 3.1.2.2 Protocol Level
-                packet += str(MQTT_PROTOCOL_LEVEL).zfill(2)
-                # 3.1.2.3 Connect Flags
-                flag_bit = 0x00
-                if(self.username):
-                    # 3.1.2.8 User Name Flag
-                    flag_bit |= 0x80
-                if(self.password):
-                    # 3.1.2.9 Password Flag
-                    flag_bit |= 0x40
-                # TODO: Add Will Retain(3.1.2.7)、Will QoS(3.1.2.6)、Will Flag(3.1.2.5)
-                # 3.1.2.4 Clean Session
-                flag_bit |= (self.clean_session << 1)
-                packet += (hex(flag_bit)[2:].upper())
-                # 3.1.2.10 Keep Alive
-                packet += (hex(self.keepAlive_s)[2:].upper().zfill(4))
-                # 3.1.3.1 Client Identifier
+                self.__reader = codec.PacketReader()
+                self.__packets.clear()
                 # FIXME: [MQTT-3.1.3-9]
                 if(not self.mqtt_id):
                     self.mqtt_id = hashlib.md5(
                         str(randint(0, 65535)).encode('utf-8')).hexdigest()
-                packet += (hex(len(self.mqtt_id))[2:].upper().zfill(4))
-                packet += self.__strToHexString(self.mqtt_id)
                 # TODO: Add Will Topic(3.1.3.2)、Will Message(3.1.3.3)
-                # 3.1.3.4 User Name
-                if(self.username):
-                    packet += (hex(len(self.username))[2:].upper().zfill(4))
-                    packet += self.__strToHexString(self.username)
-                if(self.password):
-                    packet += (hex(len(self.password))[2:].upper().zfill(4))
-                    packet += self.__strToHexString(self.password)
-                # Replace the remaining length field
-                remaining_len = int(len(packet[4:]) / 2)
-                packet = packet.replace(
-                    'XX', self.__calcRemainingLen(remaining_len))
-                logger.debug(packet)
+                packet = codec.connect(self.mqtt_id, self.username, self.password,
+                                       self.keepAlive_s, self.clean_session)
+                logger.debug(packet.hex())
                 self.tcp.sendData(packet)
-                # Wait Response
                 # 3.2 CONNACK - Acknowledge connection request
-                if(self.__waitResponse(MQTT_CONTROL_TYPE_PACKET_CONNACK + '02')):
-                    # 3.2.1 Fixed header
-                    # 3.2.2 Variable header
-                    receive_packet = self.tcp.readData(2)
-                    if(int(len(receive_packet) / 2) == 2):
-                        byte1 = receive_packet[:2]
-                        byte2 = receive_packet[2:4]
-                        if(byte1 == '01'):
-                            logger.warning(
-                                'Server has stored 684 Session state')
-                        if(byte2 == '00'):
-                            logger.info('MQTT Connection Accepted.')
-                            return True
-                        elif(byte2 == '01'):
-                            logger.warning(
-                                'MQTT Connection Refused, unacceptable protocol version')
-                        elif(byte2 == '02'):
-                            logger.warning(
-                                'MQTT Connection Refused, identifier rejected')
-                        elif(byte2 == '03'):
-                            logger.warning(
-                                'MQTT Connection Refused, Server unavailable')
-                        elif(byte2 == '04'):
-                            logger.warning(
-                                'MQTT Connection Refused, bad user name or password')
-                        elif(byte2 == '05'):
-                            logger.warning(
-                                'MQTT Connection Refused, not authorized')
-                        return False
-                    else:
-                        raise Exception(
-                            'receive_packet >> The length is not 2 bytes')
-                else:
-                    raise Exception(
-                        'receive_packet >> The beginning does not match 2002')
+                receive_packet = self.__waitResponse(codec.CONNACK)
+                if(receive_packet is None):
+                    raise Exception('No CONNACK received')
+                session_present, return_code = codec.decode_connack(receive_packet)
+                if(session_present):
+                    logger.warning('Server has stored Session state')
+                if(return_code == 0):
+                    logger.info('MQTT Connection Accepted.')
+                    return True
+                logger.warning('MQTT Connection Refused, {}'.format(
+                    codec.CONNACK_RETURN_CODES.get(return_code, return_code)))
+                return False
+        except CircuitOpen:
+            raise
         except Exception as e:
             error = str(e)
             logger.error(error)
@@ -164,10 +93,9 @@ class MQTT(object):
     def disconnect(self):
         ''' 3.14 DISCONNECT - Disconnect notification
         '''
-        # 3.14.1 Fixed header
         try:
-            packet = MQTT_CONTROL_TYPE_PACKET_DISCONNECT + '00'
-            logger.debug(packet)
+            packet = codec.disconnect()
+            logger.debug(packet.hex())
             try:
                 if(self.tcp.connected()):
                     self.tcp.sendData(packet)
@@ -184,49 +112,25 @@ class MQTT(object):
 
     def publish(self, topic, msg, qos=0, retain=False):
         assert isinstance(topic, str)
-        assert isinstance(msg, str)
+        assert isinstance(msg, (str, bytes))
         assert isinstance(qos, int)
         assert isinstance(retain, bool)
         assert (qos >= 0 and qos <= 1)
         try:
             if(self.tcp.connected()):
                 # TODO: 3.3.1.1 DUP
-                # 3.3.1.2 QoS
-                flag_bits = 0x00 | (qos << 1)
-                flag_bits |= retain
-                packet = MQTT_CONTROL_TYPE_PACKET_PUBLISH + \
-                    hex(flag_bits)[2:].upper() + 'XX'
-                # 3.3.2.1 Topic Name
-                packet += (hex(len(topic))[2:].upper().zfill(4))
-                packet += self.__strToHexString(topic)
-                # 3.3.2.2 Packet Identifier
-                send_identifier = ''
+                send_identifier = None
                 if(qos == 1):
-                    self.publish_qos1_count += 1
-                    self.publish_qos1_count %= 0xFFFF
-                    send_identifier = (hex(self.publish_qos1_count)[
-                        2:].upper().zfill(4))
-                    packet += send_identifier
-                # 3.3.3 Payload
-                packet += self.__strToHexString(msg)
-                # Replace the remaining length field
-                remaining_len = int(len(packet[4:]) / 2)
-                packet = packet.replace(
-                    'XX', self.__calcRemainingLen(remaining_len))
-                logger.debug(packet)
+                    send_identifier = self.__nextIdentifier()
+                packet = codec.publish(topic, msg, qos, retain, send_identifier)
+                logger.debug(packet.hex())
                 self.tcp.sendData(packet)
                 if(qos == 0):
                     return True
-                # Wait Response
                 # 3.4 PUBACK - Publish acknowledgement
-                if(self.__waitResponse(MQTT_CONTROL_TYPE_PACKET_PUBACK + '02')):
-                    # 3.4.1 Fixed header
-                    receive_packet = self.tcp.readData(2)
-                    if(int(len(receive_packet) / 2) == 2):
-                        # 3.4.2 Variable header
-                        receive_identifier = receive_packet
-                        if(receive_identifier == send_identifier):
-                            return True
+                receive_packet = self.__waitResponse(codec.PUBACK)
+                if(receive_packet is not None):
+                    return codec.decode_packet_id(receive_packet) == send_identifier
             else:
                 logger.info('MQTT not connected.')
             return False
@@ -235,6 +139,76 @@ class MQTT(object):
             logger.error(error)
             return False
 
+    def publish_many(self, messages, qos=1, retain=False, window=8, ack_timeout=30000, max_retries=3):
+        ''' Publish (topic, msg) pairs keeping up to window QoS 1 messages in flight.
+            PUBACKs are matched by Packet Identifier as they arrive, a message
+            without PUBACK after ack_timeout(ms) is sent again with DUP set.
+            Return a list of bool in the order of messages.
+        '''
+        assert isinstance(qos, int)
+        assert (qos >= 0 and qos <= 1)
+        assert window >= 1
+        messages = list(messages)
+        results = [False] * len(messages)
+        # packet id: [message index, packet, ack deadline, retries]
+        in_flight = OrderedDict()
+        next_idx = 0
+        pingresp = []  # answers a sendPingReq(), poll() returns it later
+        try:
+            if(not self.tcp.connected()):
+                logger.info('MQTT not connected.')
+                return results
+            while(next_idx < len(messages) or in_flight):
+                # fill the window, the new packets go out in one sendData()
+                batch = bytearray()
+                while(next_idx < len(messages) and len(in_flight) < window):
+                    topic, msg = messages[next_idx]
+                    if(qos == 0):
+                        batch.extend(codec.publish(topic, msg, 0, retain))
+                        results[next_idx] = True
+                    else:
+                        identifier = self.__nextIdentifier(in_flight)
+                        packet = codec.publish(topic, msg, qos, retain, identifier)
+                        in_flight[identifier] = [next_idx, (topic, msg),
+                                                 time.time() + ack_timeout / 1000, 0]
+                        batch.extend(packet)
+                    next_idx += 1
+                now = time.time()
+                for identifier, entry in list(in_flight.items()):
+                    if(now < entry[2]):
+                        continue
+                    if(entry[3] >= max_retries):
+                        logger.warning(f'No PUBACK for packet {identifier}, give up.')
+                        del in_flight[identifier]
+                        continue
+                    # 3.3.1.1 DUP, same Packet Identifier
+                    entry[2] = now + ack_timeout / 1000
+                    entry[3] += 1
+                    topic, msg = entry[1]
+                    batch.extend(codec.publish(topic, msg, qos, retain, identifier, dup=True))
+                if(batch):
+                    logger.debug(f'send {len(batch)} byte, {len(in_flight)} in flight')
+                    self.tcp.sendData(bytes(batch))
+                if(not in_flight):
+                    continue
+                # 3.4 PUBACK - Publish acknowledgement
+                deadline = min(entry[2] for entry in in_flight.values())
+                for packet in self.__readPackets(max(0, deadline - time.time()) * 1000):
+                    if(packet.type == codec.PINGRESP):
+                        pingresp.append(packet)
+                    if(packet.type != codec.PUBACK):
+                        continue
+                    entry = in_flight.pop(codec.decode_packet_id(packet), None)
+                    if(entry is not None):
+                        results[entry[0]] = True
+            return results
+        except Exception as e:
+            error = str(e)
+            logger.error(error)
+            return results
+        finally:
+            self.__packets.extendleft(pingresp)
+
     def subscribe(self, topic, qos=0):
         ''' 3.8 SUBSCRIBE - Subscribe to topics
             return qos
@@ -244,35 +218,17 @@ class MQTT(object):
         assert (qos >= 0 and qos <= 1)
         try:
             if(self.tcp.connected()):
-                # 3.8.1 Fixed header
-                packet = MQTT_CONTROL_TYPE_PACKET_SUBSCRIBE + 'XX'
-                # 3.8.2 Variable header
-                send_identifier = (hex(randint(0, 65535))[2:].upper().zfill(4))
-                packet += send_identifier
-                # 3.8.3 Payload
-                packet += (hex(len(topic))[2:].upper().zfill(4))
-                packet += self.__strToHexString(topic)
-                packet += str(qos).zfill(2)
-                # Replace the remaining length field
-                remaining_len = int(len(packet[4:]) / 2)
-                packet = packet.replace(
-                    'XX', self.__calcRemainingLen(remaining_len))
-                logger.debug(packet)
+                send_identifier = randint(1, 0xFFFF)
+                packet = codec.subscribe(send_identifier, topic, qos)
+                logger.debug(packet.hex())
                 self.tcp.sendData(packet)
-                # Wait Response
                 # 3.9 SUBACK - Subscribe acknowledgement
-                if(self.__waitResponse(MQTT_CONTROL_TYPE_PACKET_SUBACK + '03')):
-                    # 3.9.1 Fixed header
-                    receive_packet = self.tcp.readData(3)
-                    if(int(len(receive_packet) / 2) == 3):
-                        # 3.9.2 Variable header
-                        receive_identifier = receive_packet[:4]
-                        if(receive_identifier == send_identifier):
-                            receive_qos = receive_packet[4:6]
-                            if(receive_qos == '80'):
-                                return None
-                            elif(receive_qos == '00' or receive_qos == '01'):
-                                return int(receive_qos)
+                receive_packet = self.__waitResponse(codec.SUBACK)
+                if(receive_packet is not None):
+                    receive_identifier, return_codes = codec.decode_suback(receive_packet)
+                    if(receive_identifier == send_identifier and return_codes):
+                        if(return_codes[0] in (0, 1)):
+                            return return_codes[0]
             else:
                 logger.info('MQTT not connected.')
             return None
@@ -287,30 +243,14 @@ class MQTT(object):
         assert isinstance(topic, str)
         try:
             if(self.tcp.connected()):
-                # 3.10.1 Fixed header
-                packet = MQTT_CONTROL_TYPE_PACKET_UNSUBSCRIBE + 'XX'
-                # 3.10.2 Variable header
-                send_identifier = (hex(randint(0, 65535))[2:].upper().zfill(4))
-                packet += send_identifier
-                # 3.10.3 Payload
-                packet += (hex(len(topic))[2:].upper().zfill(4))
-                packet += self.__strToHexString(topic)
-                # Replace the remaining length field
-                remaining_len = int(len(packet[4:]) / 2)
-                packet = packet.replace(
-                    'XX', self.__calcRemainingLen(remaining_len))
-                logger.debug(packet)
+                send_identifier = randint(1, 0xFFFF)
+                packet = codec.unsubscribe(send_identifier, topic)
+                logger.debug(packet.hex())
                 self.tcp.sendData(packet)
-                # Wait Response
                 # 3.11 UNSUBACK - Unsubscribe acknowledgement
-                if(self.__waitResponse(MQTT_CONTROL_TYPE_PACKET_UNSUBACK + '02')):
-                    # 3.11.1 Fixed header
-                    receive_packet = self.tcp.readData(2)
-                    if(int(len(receive_packet) / 2) == 2):
-                        # 3.11.2 Variable header
-                        receive_identifier = receive_packet
-                        if(receive_identifier == send_identifier):
-                            return True
+                receive_packet = self.__waitResponse(codec.UNSUBACK)
+                if(receive_packet is not None):
+                    return codec.decode_packet_id(receive_packet) == send_identifier
             else:
                 logger.info('MQTT not connected.')
             return False
@@ -322,18 +262,27 @@ class MQTT(object):
     def pingReq(self):
         ''' 3.12 PINGREQ - PING request
         '''
+        try:
+            if(self.sendPingReq()):
+                # 3.13 PINGRESP - PING response
+                return (self.__waitResponse(codec.PINGRESP) is not None)
+            return False
+        except Exception as e:
+            error = str(e)
+            logger.error(error)
+            return False
+
+    def sendPingReq(self):
+        ''' Send PINGREQ without waiting, poll() returns the PINGRESP
+        '''
         try:
             if(self.tcp.connected()):
-                # 3.12.1 Fixed header
-                packet = MQTT_CONTROL_TYPE_PACKET_PINGREQ + '00'
-                logger.debug(packet)
+                packet = codec.pingreq()
+                logger.debug(packet.hex())
                 self.tcp.sendData(packet)
                 logger.info('pingReq')
-                # Wait Response
-                # 3.13 PINGRESP - PING response
-                return (self.__waitResponse(MQTT_CONTROL_TYPE_PACKET_PINGRESP + '00'))
-            else:
-                logger.info('MQTT not connected.')
+                return True
+            logger.info('MQTT not connected.')
             return False
         except Exception as e:
             error = str(e)
@@ -352,6 +301,8 @@ class MQTT(object):
         self.callback = callback
 
     def loop(self):
+        ''' PINGREQ when due, read what the broker sent and call the callback
+        '''
         try:
             if(time.time() > self.pingReq_timer):
                 self.pingReq_timer = time.time() + self.keepAlive_s
@@ -359,67 +310,116 @@ class MQTT(object):
                     logger.info(
                         'Not receive ping response, TCP Disconnecting...')
                     self.disconnect()
-            # FIXME: 暫不處理MQTT被動收到的資料
-            # Handle temp buffer
-            # self.__waitResponse('', 50)
-            # while(len(self.buffer) > 0):
-            #     buff = self.buffer[0]
-            #     topic_len = int(buff[1][:4], 16)
-            #     topic_end_idx = 4 + (topic_len * 2)
-            #     topic = self.__hexStrToStr(buff[1][4:topic_end_idx])
-            #     # Qos
-            #     if(buff[0] == 1):
-            #         identifier = int(buff[1][topic_end_idx:topic_end_idx + 4], 16)
-            #         topic_end_idx += 4
-            #     msg = self.__hexStrToStr(buff[1][topic_end_idx:])
-            #     self.callback(topic, msg)
-            #     self.buffer = self.buffer[1:]
+                    return True
+            self.poll()
+            self.processInbound()
             return True
         except Exception as e:
             error = str(e)
             logger.error(error)
             return False
 
+    def poll(self):
+        ''' Read the packets the broker sent without waiting, queue PUBLISH in inbound.
+            Asks the module only after +CIPRXGET: 1 or the periodic check of available().
+            Return the other packets.
+        '''
+        data_len = self.tcp.available()
+        if(data_len):
+            self.__reader.feed(self.__readBytes(data_len))
+        self.__handlePackets()
+        packets = list(self.__packets)
+        self.__packets.clear()
+        return packets
+
+    def processInbound(self):
+        ''' Call callback(topic, msg) for every queued PUBLISH, return the count.
+            Does not touch the module, it can run without holding tcp.lock.
+        '''
+        count = 0
+        while(True):
+            try:
+                message = self.inbound.get_nowait()
+            except queue.Empty:
+                return count
+            count += 1
+            if(self.callback is None):
+                logger.debug(f'No callback, drop message on {message.topic}')
+                continue
+            try:
+                self.callback(message.topic, message.payload.decode('utf-8', errors='replace'))
+            except Exception as e:
+                logger.error(e, exc_info=True)
+
     def setKeepAliveInterval(self, keepAliveInterval):
         self.keepAlive_s = keepAliveInterval
 
-    def __strToHexString(self, string):
-        return (''.join([hex(ord(x))[2:] for x in string])).upper()
+    def __nextIdentifier(self, in_use=()):
+        # 2.3.1 Packet Identifier, non-zero and not in flight
+        self.publish_qos1_count = self.publish_qos1_count % 0xFFFF + 1
+        while(self.publish_qos1_count in in_use):
+            self.publish_qos1_count = self.publish_qos1_count % 0xFFFF + 1
+        return self.publish_qos1_count
+
+    def __readBytes(self, data_len):
+        ''' readData() as bytes, the TCP socket may be in hex mode
+        '''
+        data = self.tcp.readData(data_len)
+        return bytes.fromhex(data) if isinstance(data, str) else data
 
-    def __hexStrToStr(self, hexStr):
-        hex_byte_s = re.findall(r'.{2}', hexStr)
-        return (''.join(chr(int(hex_byte, 16)) for hex_byte in hex_byte_s))
+    def __handlePackets(self):
+        ''' Take every complete packet from the reader, PUBLISH goes to inbound
+            (acknowledged if QoS 1), the others to __packets
+        '''
+        for packet in self.__reader.packets():
+            if(packet.type != codec.PUBLISH):
+                self.__packets.append(packet)
+                continue
+            message = codec.decode_publish(packet)
+            logger.debug(f'PUBLISH from the broker on {message.topic}')
+            if(message.qos == 1):
+                self.tcp.sendData(codec.puback(message.packet_id))
+            self.inbound.put(message)
 
-    def __calcRemainingLen(self, remaining_len):
-        if(remaining_len > 0x7F):
-            byte1 = (int(remaining_len % 0x80) + 0x80)
-            byte2 = int(remaining_len / 0x80)
-            return (hex(byte1)[2:].upper()) + \
-                (hex(byte2)[2:].upper().zfill(2))
-        else:
-            return hex(remaining_len)[2:].upper().zfill(2)
+    def __receive(self, timeout):
+        ''' Wait up to timeout(ms) for a complete packet unless one is pending
+        '''
+        if(not self.__packets and self.__reader.needed()):
+            data_len = self.tcp.wait_available(timeout)
+            if(data_len):
+                self.__reader.feed(self.__readBytes(data_len))
+        self.__handlePackets()
 
-    def __waitResponse(self, packet_header, timeout=120000):
-        # FIXME: There may be bugs here...
+    def __readPackets(self, timeout):
+        ''' Return the packets received within timeout(ms)
+        '''
+        self.__receive(timeout)
+        packets = list(self.__packets)
+        self.__packets.clear()
+        return packets
+
+    def __waitResponse(self, packet_type, timeout=120000):
+        ''' Return the next packet of packet_type, None on timeout
+        '''
         m_timeout = time.time() + (timeout / 1000)
-        while(time.time() < m_timeout):
-            if(self.tcp.available() >= 2):
-                receive_packet = self.tcp.readData(2)
-                if(receive_packet == packet_header):
-                    return True
-                elif(receive_packet[:2] == '30' or receive_packet[:2] == '32'):
-                    qos = (int(receive_packet[1:2], 16) >> 1)
-                    # Save data publish from the broker
-                    if(self.tcp.available()):
-                        remaining_len = int(receive_packet[2:4], 16)
-                        # FIXME: 暫不儲存MQTT被動收到的資料
-                        # self.buffer.append(
-                        #     [qos, self.tcp.readData(remaining_len)])
-                        m_timeout = time.time() + (timeout / 1000)
-                else:
-                    logger.error(
-                        'Unprocessable packet: {}'.format(receive_packet))
-        return False
+        pingresp = []
+        try:
+            while(True):
+                while(self.__packets):
+                    packet = self.__packets.popleft()
+                    if(packet.type == packet_type):
+                        return packet
+                    if(packet.type == codec.PINGRESP):
+                        # answers a sendPingReq(), poll() returns it later
+                        pingresp.append(packet)
+                        continue
+                    logger.error('Unprocessable packet: {}'.format(packet))
+                remaining = m_timeout - time.time()
+                if(remaining <= 0):
+                    return None
+                self.__receive(min(1000, remaining * 1000))
+        finally:
+            self.__packets.extendleft(pingresp)
 
 
 if __name__ == '__main__':
@@ -138,8 +138,8 @@ class ATCommands(object):
         return atset('CIPRXGET', True) + '3,{}\r\n'.format(len)
 
     @classmethod
-    def tcp_setTxHex(cls):
-        return atset('CIPSENDHEX', True) + '1\r\n'
+    def tcp_setTxHex(cls, enable=True):
+        return atset('CIPSENDHEX', True) + ('1\r\n' if enable else '0\r\n')
     
     @classmethod
     def Gnss_Pwr_on(cls):
@@ -13,8 +13,14 @@ import six
 import serial
 from abc import ABCMeta, abstractmethod
 import logging
+import queue
+import threading
 import time
 
+from libs.MEGA2560.demux import MapsDemux
+from libs.MEGA2560.frame import calc_checksum
+from libs.MEGA2560.port import wait_readable
+
 
 logger = logging.getLogger('maps6')
 
@@ -23,11 +29,11 @@ logger = logging.getLogger('maps6')
 class AdapterBase(object):
 
     @abstractmethod
-    def read(self, size=0):
+    def read(self, size=0, timeout=50):
         raise NotImplementedError()
 
     @abstractmethod
-    def readline(self):
+    def readline(self, timeout=50):
         raise NotImplementedError()
 
     @abstractmethod
@@ -38,6 +44,10 @@ class AdapterBase(object):
     def available(self):
         raise NotImplementedError()
 
+    @abstractmethod
+    def transact(self, data, byte_timeout=50, wait_timeout=1000):
+        raise NotImplementedError()
+
 
 class SerialAdapter(AdapterBase):
     ''' Python Serial
@@ -46,22 +56,52 @@ class SerialAdapter(AdapterBase):
     def __init__(self, COM, baud=115200):
         self.__port = serial.Serial(COM, baudrate=baud, timeout=0.05)
 
-    def read(self, size=0):
-        return self.__port.read_all() if size == 0 else self.__port.read(size)
+    def read(self, size=0, timeout=50):
+        if(size == 0):
+            return self.__port.read_all()
+        self.__port.timeout = timeout / 1000
+        try:
+            return self.__port.read(size)
+        finally:
+            self.__port.timeout = 0.05
 
-    def readline(self):
-        data = self.__port.readline()
-        logger.debug('<' + data.decode())
+    def readline(self, timeout=50):
+        self.__port.timeout = timeout / 1000
+        try:
+            data = self.__port.readline()
+        finally:
+            self.__port.timeout = 0.05
+        logger.debug('<' + data.decode(errors='replace'))
         return data
 
     def write(self, data):
         assert isinstance(data, bytes)
-        logger.debug('>' + data.decode())
+        logger.debug('>' + data.decode(errors='replace'))
         self.__port.write(data)
 
     def available(self):
         return self.__port.in_waiting
 
+    def wait_available(self, timeout=None):
+        ''' Block until module bytes are buffered, timeout(ms) None waits forever
+        '''
+        return wait_readable(self.__port, None if timeout is None else timeout / 1000)
+
+    def transact(self, data, byte_timeout=50, wait_timeout=1000):
+        ''' Send data, return the reply ended by byte_timeout(ms) of silence, None if no reply
+        '''
+        self.write(data)
+        timeout = time.time() + (wait_timeout / 1000)
+        reply = bytearray()
+        while(time.time() < timeout):
+            chunk = self.__port.read(self.__port.in_waiting or 1)
+            if(chunk):
+                reply.extend(chunk)
+                timeout = min(timeout, time.time() + (byte_timeout / 1000))
+            elif(reply):
+                break
+        return bytes(reply) if reply else None
+
 
 MAPS_NBIOT_UART_PORT = 0x00
 MAPS_LEADING_CMD = 0xAA
@@ -71,18 +111,35 @@ MAPS_UART_TX_RX_CMD = 0xCD
 MAPS_UART_TXRX_EX_CMD = 0xCE
 MAPS_ECHO_UART_ACTIVE_RX_CMD = 0xD0
 
+# AT+CIPSEND prompt, readline() returns it like a line
+PROMPT = b'> '
+
 
 class ByteFIFO(object):
-    """ byte FIFO buffer """
+    """ byte FIFO buffer, holds at most capacity byte.
+        On overflow the oldest bytes are dropped, counted in overflow_count
+        and logged: the module output has a gap and the reader must resync.
+    """
 
-    def __init__(self):
+    def __init__(self, capacity=16384):
+        self.capacity = capacity
         self.__buf = bytearray()
+        self.overflow_count = 0
+
+    def __len__(self):
+        return len(self.__buf)
 
     def put(self, data):
         self.__buf.extend(data)
+        if(len(self.__buf) > self.capacity):
+            # keep the newest bytes
+            dropped = len(self.__buf) - self.capacity
+            del self.__buf[:dropped]
+            self.overflow_count += dropped
+            logger.warning(f'RX buffer overflow, dropped the {dropped} oldest byte')
 
     def get(self, size):
-        data = self.__buf[:size]
+        data = bytes(self.__buf[:size])
         # The fast delete syntax
         self.__buf[:size] = b''
         return data
@@ -94,11 +151,14 @@ class ByteFIFO(object):
         # peek with no copy
         return bytes(self.__buf)
 
+    def has_line(self):
+        return self.__buf.find(0x0A) != -1
+
     def readline(self):
         end_idx = self.__buf.find(0x0A)
         if(end_idx != -1):
-            return bytes(self.get(end_idx + 1))
-        return bytes(self.get(self._len()))
+            return self.get(end_idx + 1)
+        return self.get(self._len())
 
     def _len(self):
         return len(self.__buf)
@@ -109,8 +169,18 @@ class MAPS6Adapter(AdapterBase):
     '''
 
     def __init__(self, port):
+        # port: MapsDemux shared with Mega2560, or a serial port owned alone
+        if(not isinstance(port, MapsDemux)):
+            port = MapsDemux(port)
         self.__port = port
         self.__buffer_FIFO = ByteFIFO()
+        self.__ack_queue = port.subscribe(
+            (MAPS_UART_BEGIN_CMD, MAPS_UART_ENABLE_ACTIVE_RX_CMD, MAPS_UART_TX_RX_CMD))
+        self.__transact_queue = port.subscribe((MAPS_UART_TXRX_EX_CMD,))
+        # guards __buffer_FIFO, notified by the reader thread on new module data
+        self.__rx_cond = threading.Condition()
+        self.__available_callback = None
+        port.add_handler((MAPS_ECHO_UART_ACTIVE_RX_CMD,), self.__on_echo)
         self.__port.write(self.__Make_PROTOCOL_UART_BEGIN_CMD())
         self.__wait_response(MAPS_UART_BEGIN_CMD)
         self.__port.write(self.__Make_ENABLE_UART_ACTIVE_RX_CMD(
@@ -120,9 +190,6 @@ class MAPS6Adapter(AdapterBase):
     def __Not(self, byte):
         return ~byte & 0xFF
 
-    def __Calc_checkSum(self, datas):
-        return (sum([(data) ^ ((idx + 1) % 0x100) for idx, data in enumerate(datas)]) & 0xFF)
-
     def __int16_to_2byte(self, num):
         return [num & 0xFF, (num >> 8) & 0xFF]
 
@@ -140,7 +207,7 @@ class MAPS6Adapter(AdapterBase):
         data.append(polling_time)
         data.append(byte_timeout)
         data.extend(self.__int16_to_2byte(rcv_timeout))
-        checksum = self.__Calc_checkSum(data)
+        checksum = calc_checksum(data)
         data.append(checksum)
         data.append(self.__Not(checksum))
         return bytes(data)
@@ -156,7 +223,7 @@ class MAPS6Adapter(AdapterBase):
         data.extend(self.__int16_to_2byte(0))
         data.extend(self.__int32_to_4byte(0))
         data.extend(cmd)
-        checksum = self.__Calc_checkSum(data)
+        checksum = calc_checksum(data)
         data.append(checksum)
         data.append(self.__Not(checksum))
         return bytes(data)
@@ -172,7 +239,7 @@ class MAPS6Adapter(AdapterBase):
         data.append(byte_timeout)
         data.extend(self.__int32_to_4byte(wait_timeout))
         data.extend(cmd)
-        checksum = self.__Calc_checkSum(data)
+        checksum = calc_checksum(data)
         data.append(checksum)
         data.append(self.__Not(checksum))
         return bytes(data)
@@ -186,68 +253,72 @@ class MAPS6Adapter(AdapterBase):
         data.append(0x00)
         data.append(0x04)
         data.append(0x00)
-        checksum = self.__Calc_checkSum(data)
+        checksum = calc_checksum(data)
         data.append(checksum)
         data.append(self.__Not(checksum))
         return bytes(data)
 
-    def __wait_response(self, response_cmd=0x00, timeout=1000):
+    def __wait_response(self, response_cmd, timeout=1000):
         timeout = time.time() + (timeout / 1000)
         while(time.time() < timeout):
-            while(self.__port.inWaiting() >= 2):
-                bytes_data = self.__port.read(2)
-                if(bytes_data[0] == MAPS_LEADING_CMD and bytes_data[1] == response_cmd):
-                    bytes_data = self.__port.read(2)
-                    return (bytes_data[0] == 0x00 and bytes_data[1] == 0xFF)
-                elif(bytes_data[0] == MAPS_LEADING_CMD and bytes_data[1] == MAPS_ECHO_UART_ACTIVE_RX_CMD):
-                    if(not self.__receive_maps_echo(bytes_data)):
-                        logger.debug(f'Maps Echo: False')
+            try:
+                frame = self.__ack_queue.get(timeout=timeout - time.time())
+            except (queue.Empty, ValueError):
+                break
+            if(frame.cmd == response_cmd):
+                return (frame.body[0] == 0x00 and frame.body[1] == 0xFF)
+            logger.debug(f'drop stale response {frame.cmd:02X}')
         return False
 
-    def __receive_maps_echo(self, bytes_header):
-        uart_port = self.__port.read(1)
-        if(uart_port[0] != MAPS_NBIOT_UART_PORT):
-            self.__port.read_all()
-            return False
-        rx_length_k = self.__port.read(2)
-        rcv_len = (rx_length_k[0] | (rx_length_k[1] << 8))
-        if(rcv_len < 1 or rcv_len > 2048):
-            self.__port.read_all()
-            return False
-        module_data = self.__port.read(rcv_len)
-        if(len(module_data) != rcv_len):
-            self.__port.read_all()
-            return False
-        all_data = bytearray()
-        all_data.extend(bytes_header)
-        all_data.extend(uart_port)
-        all_data.extend(rx_length_k)
-        all_data.extend(module_data)
-        checksum = self.__Calc_checkSum(all_data)
-        rcv_checksums = self.__port.read(2)
-        if (rcv_checksums[0] != checksum or rcv_checksums[1] != self.__Not(checksum)):
-            self.__port.read_all()
-            return False
-        self.__buffer_FIFO.put(module_data)
-        return True
-
-    def read(self, size=0):
-        self.__wait_response(timeout=50)
-        if(size == 0):
-            data = self.__buffer_FIFO.get(self.__buffer_FIFO._len())
-        else:
-            data = self.__buffer_FIFO.get(size)
+    def __on_echo(self, frame):
+        ''' Called by the MapsDemux reader thread
+        '''
+        # checksum is verified by MapsDemux, body: port, len_L, len_H, data...
+        if(frame.body[0] != MAPS_NBIOT_UART_PORT):
+            logger.debug(f'Maps Echo: unknown port {frame.body[0]}')
+            return
+        with self.__rx_cond:
+            self.__buffer_FIFO.put(frame.body[3:])
+            self.__rx_cond.notify_all()
+        callback = self.__available_callback
+        if(callback):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+
+    def __line_ready(self):
+        # the '> ' send prompt is not followed by a newline
+        return self.__buffer_FIFO.has_line() or self.__buffer_FIFO.peek(2) == PROMPT
+
+    def read(self, size=0, timeout=50):
+        ''' Wait up to timeout(ms) for size byte (any byte when size is 0) and read them
+        '''
+        with self.__rx_cond:
+            self.__rx_cond.wait_for(
+                lambda: self.__buffer_FIFO._len() >= max(size, 1), timeout / 1000)
+            if(size == 0):
+                data = self.__buffer_FIFO.get(self.__buffer_FIFO._len())
+            else:
+                data = self.__buffer_FIFO.get(size)
         return data
 
     def readline(self, timeout=50):
-        self.__wait_response(timeout=timeout)
-        data = self.__buffer_FIFO.readline()
-        logger.debug('<' + data.decode())
+        ''' Return the next line as soon as it is complete, or the buffered
+            partial line after timeout(ms)
+        '''
+        with self.__rx_cond:
+            if(self.__rx_cond.wait_for(self.__line_ready, timeout / 1000)
+                    and not self.__buffer_FIFO.has_line()):
+                data = self.__buffer_FIFO.get(len(PROMPT))
+            else:
+                data = self.__buffer_FIFO.readline()
+        logger.debug('<' + data.decode(errors='replace'))
         return data
 
     def write(self, data):
         assert isinstance(data, bytes)
-        logger.debug('>' + data.decode())
+        logger.debug('>' + data.decode(errors='replace'))
         try_count = 0
         while(try_count < 10):
             self.__port.write(self.__Make_PROTOCOL_UART_TX_CMD(
@@ -258,5 +329,49 @@ class MAPS6Adapter(AdapterBase):
             try_count += 1
             time.sleep(1)
 
+    def transact(self, data, byte_timeout=50, wait_timeout=1000):
+        ''' Send data and collect the module reply in one TXRX_EX (0xCE) bridge exchange.
+            The Mega2560 waits up to wait_timeout(ms) for the first byte and ends the
+            reply after byte_timeout(ms, max 255) of silence.
+            Return the reply bytes, None when the bridge did not answer.
+        '''
+        assert isinstance(data, bytes)
+        logger.debug('>' + data.decode(errors='replace'))
+        while(True):
+            # drop replies of timed out exchanges
+            try:
+                self.__transact_queue.get_nowait()
+            except queue.Empty:
+                break
+        self.__port.write(self.__Make_PROTOCOL_UART_TXRX_EX_CMD(
+            MAPS_NBIOT_UART_PORT, data, min(byte_timeout, 0xFF), wait_timeout))
+        try:
+            # the bridge answers within wait_timeout plus the UART transfer time
+            frame = self.__transact_queue.get(
+                timeout=(wait_timeout + byte_timeout) / 1000 + 1)
+        except queue.Empty:
+            logger.debug('transact: no reply')
+            return None
+        # checksum is verified by MapsDemux, body: port, len_L, len_H, data...
+        reply = frame.body[3:]
+        logger.debug('<' + reply.decode(errors='replace'))
+        return reply
+
     def available(self):
-        pass
+        ''' Return the count of received module bytes, never blocks
+        '''
+        with self.__rx_cond:
+            return self.__buffer_FIFO._len()
+
+    def wait_available(self, timeout=None):
+        ''' Block until module bytes are buffered, timeout(ms) None waits forever
+        '''
+        with self.__rx_cond:
+            return self.__rx_cond.wait_for(self.__buffer_FIFO._len,
+                                           None if timeout is None else timeout / 1000)
+
+    def set_available_callback(self, callback):
+        ''' callback() runs in the MapsDemux reader thread whenever module data arrives.
+            It must not block or read the adapter, use it to wake up a reader.
+        '''
+        self.__available_callback = callback
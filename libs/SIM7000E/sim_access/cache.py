@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache.py
+
+import threading
+import time
+
+
+STATE_ATTACH = 'attach'  # AT+CGATT?
+STATE_CSQ = 'csq'  # AT+CSQ
+STATE_TCP = 'tcp'  # AT+CIPSTATUS
+
+# time to live of each state (second), 0 always asks the module.
+# CSQ outlives main.py's 10 s check_task period, every other check reads it
+# from here. Attach is read again each period, twice within one.
+STATE_TTL = {
+    STATE_ATTACH: 8,
+    STATE_CSQ: 12,
+    STATE_TCP: 5,
+}
+
+
+class StateCache(object):
+    ''' TTL cache of modem state reads, shared by every caller of the module.
+        Entries are dropped by URC handlers and failed sends, the next read
+        asks the module again.
+    '''
+
+    def __init__(self, ttl=None):
+        self.ttl = dict(STATE_TTL)
+        self.ttl.update(ttl or {})
+        self.hits = {}
+        self.misses = {}
+        self.__values = {}  # key: (expire time, value)
+        self.__lock = threading.Lock()
+
+    def get(self, key, fetch):
+        ''' Return the cached value of key, or fetch() and cache its result.
+            Exceptions of fetch() are not cached.
+        '''
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__values.get(key)
+            if(entry is not None and now < entry[0]):
+                self.hits[key] = self.hits.get(key, 0) + 1
+                return entry[1]
+            self.misses[key] = self.misses.get(key, 0) + 1
+        value = fetch()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        ''' Store a state learned without asking, e.g. from a URC or CIPSTART
+        '''
+        ttl = self.ttl.get(key, 0)
+        with self.__lock:
+            if(ttl > 0):
+                self.__values[key] = (time.monotonic() + ttl, value)
+            else:
+                self.__values.pop(key, None)
+
+    def invalidate(self, *keys):
+        ''' Drop keys, all states without arguments
+        '''
+        with self.__lock:
+            if(not keys):
+                self.__values.clear()
+            for key in keys:
+                self.__values.pop(key, None)
+
+    def stats(self):
+        ''' Return {key: (hits, misses)}
+        '''
+        with self.__lock:
+            return {key: (self.hits.get(key, 0), self.misses.get(key, 0))
+                    for key in set(self.hits) | set(self.misses)}
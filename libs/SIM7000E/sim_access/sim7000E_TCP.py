@@ -12,15 +12,66 @@ import time
 
 from libs.SIM7000E.sim_access.ATCommands import ATCommands
 from libs.SIM7000E.sim_access.adapter import AdapterBase, SerialAdapter, MAPS6Adapter
+from libs.SIM7000E.sim_access.cache import STATE_TCP
 from libs.SIM7000E.sim_access.simcom import SIMModuleBase
+from libs.SIM7000E.sim_access.urc import URC_CLOSED, URC_PDP_DEACT
+from libs.retry.retry import RetryPolicy, Backoff, RetryBudget, CircuitOpen, circuit_breaker
 
 
 logger = logging.getLogger('maps6')
 
+# Ask the module with AT+CIPRXGET=4 at least this often (second),
+# even without a +CIPRXGET: 1 notification
+RXGET_CHECK_INTERVAL = 2
+
+# CIPSTATUS states with an active PDP context, CIPSTART can reuse it
+SOCKET_OPEN_STATES = ('CONNECT OK', 'TCP CONNECTING')
+BEARER_UP_STATES = ('IP STATUS', 'TCP CLOSED') + SOCKET_OPEN_STATES
+
+# Payload limit of one CIPSEND and of one CIPRXGET=2 / CIPRXGET=3 read (byte)
+SEND_MAX_LEN = 1460
+READ_MAX_LEN = 1460
+READ_HEX_MAX_LEN = 730
+
+CONNECT_FAST = 'fast'  # CIPCLOSE/CIPSTART on the active PDP context
+CONNECT_FULL = 'full'  # CIPSHUT and the whole bring-up sequence
+
+# A command answered with ERROR is sent again after a backoff (second),
+# up to MODEM_MAX_ATTEMPTS times. MODEM_BREAKER_THRESHOLD connects or sends in
+# a row failing open the circuit, they fail at once for MODEM_BREAKER_RESET.
+# Polls, reads, close and status queries are retried but never trip it.
+MODEM_MAX_ATTEMPTS = 4
+MODEM_BACKOFF_BASE = 0.2
+MODEM_BACKOFF_CAP = 5
+MODEM_BREAKER_THRESHOLD = 3
+MODEM_BREAKER_RESET = 30
+
 
 class SIM7000E_TPC(SIMModuleBase):
-    def __init__(self, adapter):
+    ''' hex_mode: send with CIPSENDHEX=1 and read with CIPRXGET=3, payload bytes
+        cross the UART as two hex digits. Otherwise plain CIPSEND and CIPRXGET=2.
+        Every AT exchange holds self.lock on its own, other threads can use
+        the module between the steps of a connect or a long read.
+    '''
+
+    def __init__(self, adapter, hex_mode=True):
         assert isinstance(adapter, MAPS6Adapter)
+        self.hex_mode = hex_mode
+        self.__rxget_check_time = 0
+        # True after the full bring-up until CIPSHUT or PDP deactivation
+        self.__bearer_ready = False
+        # {tier: [attempts, successes, seconds spent]}
+        self.connect_stats = {CONNECT_FAST: [0, 0, 0.0], CONNECT_FULL: [0, 0, 0.0]}
+        budget = RetryBudget()
+        # connect and send, the only calls that count against the circuit
+        self.retry = RetryPolicy('sim7000e', MODEM_MAX_ATTEMPTS,
+                                 Backoff(MODEM_BACKOFF_BASE, MODEM_BACKOFF_CAP),
+                                 circuit_breaker('sim7000e', failure_threshold=MODEM_BREAKER_THRESHOLD,
+                                                 reset_timeout_s=MODEM_BREAKER_RESET),
+                                 budget, retry_if=lambda e: str(e) == 'Failed')
+        self.query_retry = RetryPolicy('sim7000e_query', MODEM_MAX_ATTEMPTS,
+                                       Backoff(MODEM_BACKOFF_BASE, MODEM_BACKOFF_CAP),
+                                       budget=budget, retry_if=lambda e: str(e) == 'Failed')
         done = False
         timeout = time.time() + 5
         while(time.time() < timeout):
@@ -40,178 +91,323 @@ class SIM7000E_TPC(SIMModuleBase):
                     raise Exception('Unknown exception: {}'.format(error))
         if(not done):
             raise Exception('No module or SIM card')
+        self.urc.add_handler(URC_CLOSED, self.__on_link_urc)
+        self.urc.add_handler(URC_PDP_DEACT, self.__on_link_urc)
+
+    def __on_link_urc(self, name, line):
+        logger.warning(f'TCP link lost: {line}')
+        self.state_cache.set(STATE_TCP, False)
+        if(name == URC_PDP_DEACT):
+            self.__bearer_ready = False
+
+    def __locked(self, func, *args):
+        with self.lock:
+            return func(*args)
+
+    def __call(self, func, *args, lock=True, policy=None):
+        ''' Run func under the retry policy, self.query_retry by default,
+            'Failed' is retried with backoff.
+            Each attempt holds self.lock unless lock is False.
+            Raise 'reset module', 'Failed', 'Circuit open' or 'Unknown exception'.
+        '''
+        policy = policy or self.query_retry
+        try:
+            if(lock):
+                return policy.call(self.__locked, func, *args)
+            return policy.call(func, *args)
+        except CircuitOpen:
+            logger.warning('module keeps failing, circuit open')
+            raise
+        except Exception as e:
+            error = str(e)
+            if(error == 'No reply'):
+                logger.warning('reset module ...')
+                raise Exception('reset module')
+            elif(error == 'Failed'):
+                logger.warning('module response error, give up')
+                raise
+            else:
+                logger.error('Unknown exception: {}'.format(error))
+                raise Exception('Unknown exception')
+
+    def __record_connect(self, tier, start, success):
+        stats = self.connect_stats[tier]
+        stats[0] += 1
+        stats[1] += success
+        stats[2] += time.time() - start
+
+    def __start_tcp(self, ip, port):
+        ''' CIPSTART, return False on CONNECT FAIL
+        '''
+        tmp = ATCommands.tcp_connect(ip, port)
+        self.adapter.write(tmp.encode())
+        msgs = self.wait_key(('CONNECT OK\r\n', 'ALREADY CONNECT\r\n', 'CONNECT FAIL\r\n'),
+                             timeout=120000)
+        if(msgs[-1] == 'CONNECT FAIL\r\n'):
+            return False
+        self.state_cache.set(STATE_TCP, True)
+        return True
+
+    def __reconnect(self, ip, port):
+        ''' Fast path, reopen the socket on the active PDP context.
+            Return False when the full bring-up is needed.
+        '''
+        if(not self.__bearer_ready):
+            return False
+        start = time.time()
+        try:
+            state = self.tcp_state()
+            if(state not in BEARER_UP_STATES):
+                logger.info(f'PDP context is not active ({state})')
+                self.__bearer_ready = False
+                return False
+            with self.lock:
+                if(state in SOCKET_OPEN_STATES):
+                    tmp = ATCommands.tcp_close()
+                    self.adapter.write(tmp.encode())
+                    self.wait_key('CLOSE OK\r\n', 5000)
+                done = self.__start_tcp(ip, port)
+        except Exception as e:
+            logger.warning(f'fast reconnect failed: {e}')
+            done = False
+        self.__record_connect(CONNECT_FAST, start, done)
+        return done
 
     def connect(self, ip, port):
-        ''' Connect TCP socket
+        ''' Connect TCP socket, reuse the PDP context if it is still active,
+            otherwise shut it and bring the network up again
         '''
         assert isinstance(ip, str)
         assert isinstance(port, int)
-        while(True):
-            try:
-                self.network_Deact_PDP()
-                tmp = ATCommands.tcp_setRxGet_Manual()
-                self.adapter.write(tmp.encode())
-                self.wait_ok()
-                tmp = ATCommands.tcp_setTxHex()
-                self.adapter.write(tmp.encode())
-                self.wait_ok()
-                apn = self.network_getapn()
-                logger.debug('APN: {}'.format(apn))
-                self.network_setapn(apn)
-                self.network_bringup()
-                local_ip = self.network_ipaddr()
-                logger.debug(f'local ip: {local_ip}')
-                tmp = ATCommands.tcp_connect(ip, port)
-                self.adapter.write(tmp.encode())
-                self.wait_key('CONNECT OK\r\n', timeout=120000)
-                break
-            except Exception as e:
-                error = str(e)
-                if(error == 'No reply'):
-                    logger.warning('reset module ...')
-                    raise Exception('reset module')
-                elif(error == 'Failed'):
-                    logger.warning('module response error, try again ...')
-                else:
-                    logger.error('Unknown exception: {}'.format(error))
-                    raise Exception('Unknown exception')
+        if(self.__reconnect(ip, port)):
+            logger.info('TCP is Connected (fast path).')
+            return
+        start = time.time()
+        try:
+            self.__call(self.__bring_up, ip, port, lock=False, policy=self.retry)
+        except Exception:
+            self.__record_connect(CONNECT_FULL, start, False)
+            raise
+        self.__record_connect(CONNECT_FULL, start, True)
         logger.info('TCP is Connected.')
 
-    def disconnect(self):
-        ''' Disconnect TCP socket
+    def __bring_up(self, ip, port):
+        # the lock is taken step by step, CIPSHUT, CIICR and CIPSTART can take long
+        with self.lock:
+            self.__bearer_ready = False
+            self.network_Deact_PDP()
+        with self.lock:
+            tmp = ATCommands.tcp_setRxGet_Manual()
+            self.adapter.write(tmp.encode())
+            self.wait_ok()
+            tmp = ATCommands.tcp_setTxHex(self.hex_mode)
+            self.adapter.write(tmp.encode())
+            self.wait_ok()
+        with self.lock:
+            apn = self.network_getapn()
+            logger.debug('APN: {}'.format(apn))
+            self.network_setapn(apn)
+        with self.lock:
+            self.network_bringup()
+        with self.lock:
+            local_ip = self.network_ipaddr()
+            logger.debug(f'local ip: {local_ip}')
+        self.__bearer_ready = True
+        with self.lock:
+            if(not self.__start_tcp(ip, port)):
+                raise Exception('Failed')
+
+    def disconnect(self, shut_bearer=False):
+        ''' Disconnect TCP socket, the PDP context is kept for the next
+            connect() unless shut_bearer
         '''
-        while(True):
-            try:
-                self.network_Deact_PDP()
-                break
-            except Exception as e:
-                error = str(e)
-                if(error == 'No reply'):
-                    logger.warning('reset module ...')
-                    raise Exception('reset module')
-                elif(error == 'Failed'):
-                    logger.warning('module response error, try again ...')
-                else:
-                    logger.error('Unknown exception: {}'.format(error))
-                    raise Exception('Unknown exception')
+        self.__call(self.__close, shut_bearer)
         logger.info('TCP is Disconnected.')
 
+    def __close(self, shut_bearer):
+        if(self.__bearer_ready and not shut_bearer):
+            state = self.tcp_state()
+            if(state in BEARER_UP_STATES):
+                if(state in SOCKET_OPEN_STATES):
+                    tmp = ATCommands.tcp_close()
+                    self.adapter.write(tmp.encode())
+                    self.wait_key('CLOSE OK\r\n', 5000)
+                self.state_cache.set(STATE_TCP, False)
+                return
+        self.__bearer_ready = False
+        self.network_Deact_PDP()
+
     def sendData(self, data):
         ''' Send packets via TCP Socket
+            data: bytes, or a HEX string as returned by readData() in hex mode
         '''
-        assert isinstance(data, str)
-        while(True):
-            try:
-                tmp = ATCommands.tcp_send(int(len(data) / 2))
-                self.adapter.write(tmp.encode())
-                self.wait_key('> ')
-                self.adapter.write(data.encode())
-                self.wait_key('SEND OK\r\n', 30000)
-                break
-            except Exception as e:
-                error = str(e)
-                if(error == 'No reply'):
-                    logger.warning('reset module ...')
-                    raise Exception('reset module')
-                elif(error == 'Failed'):
-                    logger.warning('module response error, try again ...')
-                else:
-                    logger.error('Unknown exception: {}'.format(error))
-                    raise Exception('Unknown exception')
+        assert isinstance(data, (str, bytes, bytearray))
+        if(isinstance(data, str)):
+            data = bytes.fromhex(data)
+        for idx in range(0, len(data), SEND_MAX_LEN):
+            self.__send_chunk(data[idx:idx + SEND_MAX_LEN])
         logger.info('TCP send success.')
 
+    def __send_chunk(self, data):
+        payload = data.hex().upper().encode() if self.hex_mode else bytes(data)
+        self.__call(self.__send_once, len(data), payload, policy=self.retry)
+
+    def __send_once(self, data_len, payload):
+        try:
+            tmp = ATCommands.tcp_send(data_len)
+            self.adapter.write(tmp.encode())
+            self.wait_key('> ')
+            self.adapter.write(payload)
+            self.wait_key('SEND OK\r\n', 30000)
+        except Exception:
+            # the socket may be gone, ask CIPSTATUS next time
+            self.state_cache.invalidate(STATE_TCP)
+            raise
+
     def available(self):
         ''' Return the length of the TCP Socket receiving buffer
+            The AT round trip is skipped while the module has not notified
+            new data (+CIPRXGET: 1).
+        '''
+        with self.lock:
+            self.poll_urc()
+            if(not self.data_available_flag and time.time() < self.__rxget_check_time):
+                return 0
+            self.__rxget_check_time = time.time() + RXGET_CHECK_INTERVAL
+            return self.__call(self.__check_data)
+
+    def __check_data(self):
+        tmp = ATCommands.tcp_chkData()
+        self.adapter.write(tmp.encode())
+        msgs = self.wait_ok()
+        for msg in msgs:
+            re_result = re.search('\+CIPRXGET: 4,([\d]+)', msg)
+            if(re_result):
+                assert len(re_result.groups()) == 1
+                data_len = re_result.group(1)
+                logger.debug('data available {} byte'.format(data_len))
+                self.data_available_flag = (int(data_len) > 0)
+                return int(data_len)
+        # The response exceeded expectations
+        raise Exception('Failed')
+
+    def wait_available(self, timeout=1000):
+        ''' Block until the TCP Socket has data or timeout(ms), return available()
         '''
+        deadline = time.time() + (timeout / 1000)
         while(True):
-            try:
-                tmp = ATCommands.tcp_chkData()
-                self.adapter.write(tmp.encode())
-                msgs = self.wait_ok()
-                for msg in msgs:
-                    re_result = re.search('\+CIPRXGET: 4,([\d]+)', msg)
-                    if(re_result):
-                        assert len(re_result.groups()) == 1
-                        data_len = re_result.group(1)
-                        logger.debug('data available {} byte'.format(data_len))
-                        return int(data_len)
-                assert Exception('The response exceeded expectations')
-            except Exception as e:
-                error = str(e)
-                if(error == 'No reply'):
-                    logger.warning('reset module ...')
-                    raise Exception('reset module')
-                elif(error == 'Failed'):
-                    logger.warning('module response error, try again ...')
-                else:
-                    logger.error('Unknown exception: {}'.format(error))
-                    raise Exception('Unknown exception')
+            self.data_event.clear()
+            data_len = self.available()
+            remaining = deadline - time.time()
+            if(data_len or remaining <= 0):
+                return data_len
+            # wake on +CIPRXGET: 1, dispatched by the URC reader, or for the periodic check
+            check = max(self.__rxget_check_time - time.time(), 0)
+            self.data_event.wait(min(remaining, check))
 
     def readData(self, data_len):
-        ''' Read packets from TCP Socket
-            Return HEX Packets
+        ''' Read up to data_len byte from TCP Socket
+            Return HEX Packets in hex mode, bytes otherwise
         '''
         assert isinstance(data_len, int)
+        data = bytearray()
+        max_len = READ_HEX_MAX_LEN if self.hex_mode else READ_MAX_LEN
+        while(len(data) < data_len):
+            chunk, rest_len = self.__read_chunk(min(data_len - len(data), max_len))
+            data.extend(chunk)
+            if(not chunk or rest_len == 0):
+                break
+        logger.debug('read {} byte'.format(len(data)))
+        return data.hex().upper() if self.hex_mode else bytes(data)
+
+    def __read_chunk(self, data_len):
+        ''' One CIPRXGET read, return (data, byte left in the module)
+        '''
+        return self.__call(self.__read_once, data_len)
+
+    def __read_once(self, data_len):
+        if(self.hex_mode):
+            tmp = ATCommands.tcp_readHEXData(data_len)
+            self.adapter.write(tmp.encode())
+            msgs = self.wait_ok()
+            for idx, msg in enumerate(msgs):
+                re_result = re.search('\+CIPRXGET: 3,(\d+),(\d+)', msg)
+                if(re_result):
+                    assert len(re_result.groups()) == 2
+                    re_data = re.search('[0-9A-Fa-f]+', msgs[idx + 1])
+                    data = bytes.fromhex(re_data.group()) if re_data else b''
+                    self.data_available_flag = (int(re_result.group(2)) > 0)
+                    return data, int(re_result.group(2))
+            # The response exceeded expectations
+            raise Exception('Failed')
+        tmp = ATCommands.tcp_readData(data_len)
+        self.adapter.write(tmp.encode())
+        cnf_len, rest_len = self.__wait_rxget_header(2)
+        data = self.__read_exact(cnf_len)
+        self.wait_ok()
+        self.data_available_flag = (rest_len > 0)
+        return data, rest_len
+
+    def __wait_rxget_header(self, mode, timeout=2000):
+        ''' Wait +CIPRXGET: mode,<cnflength>,<reqlength>, the payload follows it
+        '''
+        deadline = time.time() + (timeout / 1000)
         while(True):
-            try:
-                tmp = ATCommands.tcp_readHEXData(data_len)
-                self.adapter.write(tmp.encode())
-                msgs = self.wait_ok()
-                for idx, msg in enumerate(msgs):
-                    re_result = re.search(
-                        '\+CIPRXGET: 3,{},([\d]+)'.format(data_len), msg)
-                    if(re_result):
-                        assert len(re_result.groups()) == 1
-                        cnf_len = re_result.group(1)
-                        logger.debug('read {} byte'.format(data_len))
-                        logger.debug('cnflength {} byte'.format(cnf_len))
-                        data = msgs[idx + 1]
-                        re_result = re.search('\w+', data)
-                        if(re_result):
-                            return re_result.group()
-                        return ''
-                assert Exception('The response exceeded expectations')
-            except Exception as e:
-                error = str(e)
-                if(error == 'No reply'):
-                    logger.warning('reset module ...')
-                    raise Exception('reset module')
-                elif(error == 'Failed'):
-                    logger.warning('module response error, try again ...')
-                else:
-                    logger.error('Unknown exception: {}'.format(error))
-                    raise Exception('Unknown exception')
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                raise Exception('No reply')
+            line = self.adapter.readline(timeout=remaining * 1000).decode(errors='replace')
+            if(not line or self.urc.dispatch(line)):
+                continue
+            logger.debug(line)
+            if line == 'ERROR\r\n':
+                raise Exception('Failed')
+            re_result = re.match('\+CIPRXGET: {},(\d+),(\d+)'.format(mode), line)
+            if(re_result):
+                return int(re_result.group(1)), int(re_result.group(2))
+
+    def __read_exact(self, size, timeout=2000):
+        ''' Read size raw byte from the adapter, they may contain CR LF
+        '''
+        data = bytearray()
+        deadline = time.time() + (timeout / 1000)
+        while(len(data) < size):
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                raise Exception('No reply')
+            data.extend(self.adapter.read(size - len(data), timeout=remaining * 1000))
+        return bytes(data)
 
     def connected(self):
-        ''' Check TCP is connected
+        ''' Check TCP is connected, served from the state cache within its TTL
         '''
-        while(True):
-            try:
-                tmp = ATCommands.tcp_status()
-                self.adapter.write(tmp.encode())
-                self.wait_ok()
-                tmp = '\r\n'
-                while tmp == '\r\n':
-                    tmp = self.adapter.readline()
-                    tmp = tmp.decode()
-                re_result = re.search('STATE: ([A-Z ]+)', tmp)
-                if(re_result):
-                    assert len(re_result.groups()) == 1
-                    status = re_result.group(1)
-                    logger.debug('tcp status: {}'.format(status))
-                    logger.debug('TCP Status: {}'.format(status))
-                    return (status == 'CONNECT OK')
-                assert Exception('The response exceeded expectations')
-            except Exception as e:
-                error = str(e)
-                if(error == 'No reply'):
-                    logger.warning('reset module ...')
-                    raise Exception('reset module')
-                elif(error == 'Failed'):
-                    logger.warning('module response error, try again ...')
-                else:
-                    logger.error('Unknown exception: {}'.format(error))
-                    raise Exception('Unknown exception')
+        return self.state_cache.get(STATE_TCP, lambda: self.tcp_state() == 'CONNECT OK')
+
+    def tcp_state(self):
+        ''' Return the CIPSTATUS state, e.g. IP INITIAL, IP STATUS, CONNECT OK, TCP CLOSED
+        '''
+        return self.__call(self.__query_status)
+
+    def __query_status(self):
+        tmp = ATCommands.tcp_status()
+        msgs = self.query(tmp)
+        # STATE follows OK, it is usually part of the same reply
+        tmp = ''.join(msgs[msgs.index('OK\r\n') + 1:]).strip()
+        timeout = time.time() + 2
+        while(not tmp):
+            if(time.time() > timeout):
+                raise Exception('No reply')
+            tmp = self.adapter.readline().decode()
+            tmp = '' if self.urc.dispatch(tmp) else tmp.strip()
+        re_result = re.search('STATE: ([A-Z ]+)', tmp)
+        if(re_result):
+            assert len(re_result.groups()) == 1
+            status = re_result.group(1)
+            logger.debug('tcp status: {}'.format(status))
+            logger.debug('TCP Status: {}'.format(status))
+            return status.strip()
+        # The response exceeded expectations
+        raise Exception('Failed')
 
 
 if __name__ == '__main__':
@@ -9,22 +9,71 @@
 import re
 import time
 import logging
+import functools
+import threading
 
 from libs.SIM7000E.sim_access.ATCommands import ATCommands
 from libs.SIM7000E.sim_access.adapter import AdapterBase, SerialAdapter, MAPS6Adapter
+from libs.SIM7000E.sim_access.cache import StateCache, STATE_ATTACH, STATE_CSQ, STATE_TCP
+from libs.SIM7000E.sim_access.urc import URCDispatcher, URC_CIPRXGET, URC_PDP_DEACT, URC_READY
 
 
 logger = logging.getLogger('maps6')
 
+# TXRX_EX byte timeout of query() (ms), the reply ends after this much silence
+QUERY_BYTE_TIMEOUT = 50
+# time poll_urc() waits for the end of a line cut by the readline() timeout (ms)
+URC_LINE_TIMEOUT = 1000
+# TXRX_EX misses in a row before query() falls back to TX/RX
+TRANSACT_MAX_MISSES = 3
+# second before query() tries TXRX_EX again after a fallback
+TRANSACT_RETRY_INTERVAL = 300
+
+
+def _locked(method):
+    ''' Run a command holding self.lock, the URC reader never takes its reply
+    '''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class SIMModuleBase(object):
+    ''' A thread dispatches unsolicited lines as they arrive while no command
+        holds self.lock, e.g. CLOSED or +PDP: DEACT drop the cached state at
+        once. Commands and command sequences hold self.lock.
+    '''
 
     def __init__(self, adapter):
         assert isinstance(adapter, AdapterBase)
         self.adapter = adapter
+        # hold it around command sequences when more than one thread uses the module
+        self.lock = threading.RLock()
+        # set by the +CIPRXGET: 1 notification, cleared when the socket buffer is empty
+        self.data_available_flag = False
+        # set with data_available_flag, for waiters
+        self.data_event = threading.Event()
+        # unsolicited lines never reach the reply lists, they go to the URC handlers
+        self.urc = URCDispatcher()
+        self.__urc_partial = b''  # unterminated line left by poll_urc()
+        self.urc.add_handler(URC_CIPRXGET, self.__on_data_urc)
+        # attach, CSQ and TCP status reads are served from here within their TTL
+        self.state_cache = StateCache()
+        self.urc.add_handler(URC_PDP_DEACT, self.__on_state_urc)
+        self.urc.add_handler(URC_READY, self.__on_state_urc)
+        # query() uses adapter.transact() until the bridge misses
+        # TRANSACT_MAX_MISSES replies in a row, it tries again at
+        # transact_retry_time (monotonic)
+        self.transact_enabled = True
+        self.transact_misses = 0
+        self.transact_retry_time = 0
         self.check_module_exist()
         self.__initialize()
-        self.data_available_flag = False
+        self.__urc_thread = threading.Thread(
+            target=self.__read_urc, name='sim_urc_t', daemon=True)
+        self.__urc_thread.start()
 
     def check_module_exist(self):
         if(self.test_module()):
@@ -48,31 +97,125 @@ class SIMModuleBase(object):
         self.adapter.write(tmp.encode())
         self.wait_ok()
 
+    def __on_data_urc(self, name, line):
+        self.data_available_flag = True
+        self.data_event.set()
+
+    def __on_state_urc(self, name, line):
+        if(name == URC_PDP_DEACT):
+            self.state_cache.set(STATE_TCP, False)
+            self.state_cache.invalidate(STATE_ATTACH)
+        else:
+            # module restarted
+            self.state_cache.invalidate()
+
+    def __read_urc(self):
+        ''' Wait for module output, dispatch it when no command is running
+        '''
+        while(True):
+            try:
+                if(self.adapter.wait_available(None)):
+                    with self.lock:
+                        self.poll_urc()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+                time.sleep(1)
+
+    def poll_urc(self):
+        ''' Dispatch the unsolicited lines received while no command was running.
+            A line cut by the readline() timeout is completed first, one still
+            unterminated after URC_LINE_TIMEOUT is kept for the next read.
+        '''
+        while(self.adapter.available()):
+            line = self.__urc_partial + self.adapter.readline()
+            deadline = time.time() + (URC_LINE_TIMEOUT / 1000)
+            while(line and not line.endswith(b'\n')):
+                remaining = deadline - time.time()
+                if(remaining <= 0):
+                    break
+                line += self.adapter.readline(timeout=remaining * 1000)
+            if(not line.endswith(b'\n')):
+                self.__urc_partial = line
+                return
+            self.__urc_partial = b''
+            line = line.decode(errors='replace')
+            if(not self.urc.dispatch(line) and line != '\r\n'):
+                logger.debug(f'discard: {line}')
+
     def wait_ok(self):
         return self.wait_key('OK\r\n')
 
     def wait_key(self, key, timeout=2000):
-        done = False
+        ''' Read lines until key, each readline() returns as soon as a line is complete
+            key: a line or a tuple of lines, msgs[-1] is the one received
+        '''
+        keys = key if isinstance(key, tuple) else (str(key),)
         msgs = []
-        timeout = time.time() + (timeout / 1000)
-        while done == False and time.time() < timeout:
-            line = self.adapter.readline()
+        deadline = time.time() + (timeout / 1000)
+        while(True):
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                raise Exception('No reply')
+            line = self.adapter.readline(timeout=remaining * 1000)
+            if(self.__urc_partial):
+                # the rest of a line poll_urc() could not finish
+                line = self.__urc_partial + line
+                self.__urc_partial = b''
             line = line.decode()
+            if(not line):
+                continue
             logger.debug(line)
+            if(self.urc.dispatch(line)):
+                continue
             msgs.append(line)
-            if line == str(key):
-                done = True
+            if line in keys:
+                return msgs
             elif line == 'ERROR\r\n':
-                done = False
                 raise Exception('Failed')
-            elif line == '+CIPRXGET: 1\r\n':
-                self.data_available_flag = True
-            elif line == '':
-                time.sleep(0.2)
-        if not done:
-            raise Exception('No reply')
-        return msgs
 
+    @_locked
+    def query(self, cmd, timeout=2000):
+        ''' Send a short command answered by OK/ERROR, return the reply lines like wait_ok()
+            The command and its reply go through one adapter.transact() exchange,
+            falling back to write() + wait_ok() if the bridge does not support it.
+        '''
+        if(self.transact_enabled or time.monotonic() >= self.transact_retry_time):
+            reply = self.adapter.transact(cmd.encode(), QUERY_BYTE_TIMEOUT, timeout)
+            if(reply is not None):
+                self.transact_misses = 0
+                if(not self.transact_enabled):
+                    logger.info('TXRX_EX answers again, use it for queries.')
+                    self.transact_enabled = True
+                msgs = []
+                for line in reply.decode().splitlines(keepends=True):
+                    logger.debug(line)
+                    if(self.urc.dispatch(line)):
+                        continue
+                    msgs.append(line)
+                    if line == 'ERROR\r\n':
+                        raise Exception('Failed')
+                if('OK\r\n' not in msgs):
+                    # the module paused longer than the byte timeout, the rest
+                    # of the reply comes through the active RX path
+                    partial = msgs.pop() if msgs and not msgs[-1].endswith('\n') else ''
+                    rest = self.wait_ok()
+                    if(rest):
+                        rest[0] = partial + rest[0]
+                    msgs.extend(rest)
+                return msgs
+            self.transact_misses += 1
+            if(self.transact_enabled and self.transact_misses < TRANSACT_MAX_MISSES):
+                logger.warning(f'No TXRX_EX reply ({self.transact_misses} in a row).')
+            else:
+                if(self.transact_enabled):
+                    logger.warning(f'No TXRX_EX reply, use TX/RX for queries '
+                                   f'for {TRANSACT_RETRY_INTERVAL} s.')
+                self.transact_enabled = False
+                self.transact_retry_time = time.monotonic() + TRANSACT_RETRY_INTERVAL
+        self.adapter.write(cmd.encode())
+        return self.wait_ok()
+
+    @_locked
     def test_module(self):
         ''' test module
         '''
@@ -81,6 +224,7 @@ class SIMModuleBase(object):
         self.wait_ok()
         return True
 
+    @_locked
     def module_checkready(self):
         ''' check if module is ready
         '''
@@ -92,13 +236,17 @@ class SIMModuleBase(object):
                 return True
         return False
 
+    @_locked
     def network_Deact_PDP(self):
         ''' Deactivate GPRS PDP Context
         '''
         tmp = ATCommands.shut_PDP()
         self.adapter.write(tmp.encode())
+        self.state_cache.invalidate(STATE_TCP)
         self.wait_key('SHUT OK\r\n', 15000)
+        self.state_cache.set(STATE_TCP, False)
 
+    @_locked
     def network_getapn(self):
         ''' get apn
         '''
@@ -114,6 +262,7 @@ class SIMModuleBase(object):
                 return apn
         return ""
 
+    @_locked
     def network_setapn(self, apn):
         ''' set up APN for network access
         '''
@@ -121,13 +270,16 @@ class SIMModuleBase(object):
         self.adapter.write(tmp.encode())
         self.wait_ok()
 
+    @_locked
     def network_attach(self):
         ''' attach up network
         '''
         tmp = ATCommands.network_attach()
         self.adapter.write(tmp.encode())
+        self.state_cache.invalidate(STATE_ATTACH)
         self.wait_ok()
 
+    @_locked
     def network_bringup(self):
         ''' bring up network
         '''
@@ -135,13 +287,14 @@ class SIMModuleBase(object):
         self.adapter.write(tmp.encode())
         self.wait_ok()
 
+    @_locked
     def network_ipaddr(self):
         ''' get local ip address
         '''
         tmp = ATCommands.network_ipaddr()
         self.adapter.write(tmp.encode())
         tmp = '\r\n'
-        while tmp == '\r\n':
+        while tmp == '\r\n' or self.urc.dispatch(tmp):
             tmp = self.adapter.readline(timeout=500)
             tmp = tmp.decode()
         re_result = re.search('\d+.\d+.\d+.\d+', tmp)
@@ -152,9 +305,11 @@ class SIMModuleBase(object):
     def network_chkAttach(self):
         ''' check attach status
         '''
+        return self.state_cache.get(STATE_ATTACH, self.__read_attach)
+
+    def __read_attach(self):
         tmp = ATCommands.read_network_attach()
-        self.adapter.write(tmp.encode())
-        msgs = self.wait_ok()
+        msgs = self.query(tmp)
         for msg in msgs:
             re_result = re.search('\+CGATT: ([0-1])', msg)
             if(re_result):
@@ -166,9 +321,11 @@ class SIMModuleBase(object):
     def network_getCsq(self):
         ''' check CSQ
         '''
+        return self.state_cache.get(STATE_CSQ, self.__read_csq)
+
+    def __read_csq(self):
         tmp = ATCommands.csq()
-        self.adapter.write(tmp.encode())
-        msgs = self.wait_ok()
+        msgs = self.query(tmp)
         for msg in msgs:
             re_result = re.search('\+CSQ: ([\d]+),([\d]+)', msg)
             if(re_result):
@@ -178,6 +335,7 @@ class SIMModuleBase(object):
                 return rssi
         return ""
 
+    @_locked
     def get_gps_info(self):
         ''' get GPS info
         '''
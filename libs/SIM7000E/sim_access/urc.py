@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# urc.py
+
+import re
+import logging
+import threading
+
+
+logger = logging.getLogger('maps6')
+
+# Unsolicited result codes of the SIM7000E, (name, line pattern).
+# Only lines that are never part of a command reply belong here,
+# e.g. +CPIN: READY also answers AT+CPIN? and +CGNSINF: answers AT+CGNSINF.
+URC_CIPRXGET = 'CIPRXGET'  # TCP data received (AT+CIPRXGET=1 manual mode)
+URC_CLOSED = 'CLOSED'  # TCP connection closed by the remote side
+URC_PDP_DEACT = 'PDP_DEACT'  # GPRS PDP context deactivated by the network
+URC_GNSS = 'GNSS'  # GNSS navigation push (AT+CGNSURC)
+URC_READY = 'READY'  # module (re)started
+URC_POWER_DOWN = 'POWER_DOWN'
+
+URC_CODES = (
+    (URC_CIPRXGET, r'\+CIPRXGET: 1(,\d)?$'),
+    (URC_CLOSED, r'(\d, )?CLOSED$'),
+    (URC_PDP_DEACT, r'(\+PDP: DEACT|\+APP PDP: (\d,)?DEACTIVE)$'),
+    (URC_GNSS, r'\+UGNSINF: '),
+    (URC_READY, r'(RDY|SMS Ready|Call Ready)$'),
+    (URC_POWER_DOWN, r'(NORMAL POWER DOWN|UNDER-VOLTAGE POWER DOWN)$'),
+)
+
+
+class URCDispatcher(object):
+    ''' Recognise unsolicited lines and pass them to the handlers of their code.
+        handler(name, line), line without the trailing CR LF
+    '''
+
+    def __init__(self, codes=URC_CODES):
+        self.__codes = [(name, re.compile(pattern)) for name, pattern in codes]
+        self.__handlers = {}
+        self.__lock = threading.Lock()
+        self.urc_count = 0
+
+    def add_code(self, name, pattern):
+        with self.__lock:
+            self.__codes.append((name, re.compile(pattern)))
+
+    def add_handler(self, name, handler):
+        with self.__lock:
+            self.__handlers.setdefault(name, []).append(handler)
+
+    def remove_handler(self, name, handler):
+        with self.__lock:
+            handlers = self.__handlers.get(name, [])
+            if(handler in handlers):
+                handlers.remove(handler)
+
+    def match(self, line):
+        ''' Return the code name of an unsolicited line, None for anything else
+        '''
+        line = line.rstrip('\r\n')
+        for name, pattern in self.__codes:
+            if(pattern.match(line)):
+                return name
+        return None
+
+    def dispatch(self, line):
+        ''' Call the handlers if line is unsolicited, return True when it was
+        '''
+        name = self.match(line)
+        if(name is None):
+            return False
+        self.urc_count += 1
+        line = line.rstrip('\r\n')
+        logger.debug(f'URC {name}: {line}')
+        with self.__lock:
+            handlers = list(self.__handlers.get(name, ()))
+        for handler in handlers:
+            try:
+                handler(name, line)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+        return True
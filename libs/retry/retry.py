@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# retry.py
+
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('maps6')
+
+# Backoff jitter
+JITTER_NONE = 'none'  # the capped exponential delay
+JITTER_FULL = 'full'  # uniform in [0, delay]
+JITTER_EQUAL = 'equal'  # uniform in [delay / 2, delay]
+
+# CircuitBreaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    ''' Raised instead of calling an endpoint whose circuit is open
+    '''
+
+    def __init__(self, name):
+        super().__init__('Circuit open')
+        self.name = name
+
+
+class Backoff(object):
+    ''' Delay before retry number attempt (0 based): base_s * multiplier ** attempt,
+        capped at cap_s, then jittered
+    '''
+
+    def __init__(self, base_s=0.5, cap_s=30, multiplier=2, jitter=JITTER_FULL):
+        self.base_s = base_s
+        self.cap_s = cap_s
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        delay = min(self.cap_s, self.base_s * self.multiplier ** min(attempt, 32))
+        if(self.jitter == JITTER_FULL):
+            return random.uniform(0, delay)
+        if(self.jitter == JITTER_EQUAL):
+            return random.uniform(delay / 2, delay)
+        return delay
+
+
+class CircuitBreaker(object):
+    ''' Stop calling an endpoint after failure_threshold failures in a row.
+        After reset_timeout_s one trial call is let through (half open), its
+        result closes the circuit or opens it again.
+    '''
+
+    def __init__(self, name, failure_threshold=5, reset_timeout_s=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = CLOSED
+        self.open_count = 0
+        self.rejected = 0
+        self.__failures = 0
+        self.__opened_at = 0
+        self.__open_time = 0.0  # second, closed periods only
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    def allow(self):
+        ''' Return False while the circuit is open, count the rejected call
+        '''
+        with self.__lock:
+            if(self.state == OPEN and time.monotonic() - self.__opened_at >= self.reset_timeout_s):
+                self.state = HALF_OPEN
+                self.__trial = False
+            if(self.state == CLOSED):
+                return True
+            if(self.state == HALF_OPEN and not self.__trial):
+                self.__trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+            if(self.state != CLOSED):
+                self.__open_time += time.monotonic() - self.__opened_at
+                self.state = CLOSED
+                logger.info(f'circuit {self.name} closed')
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if(self.state == HALF_OPEN or
+               (self.state == CLOSED and self.__failures >= self.failure_threshold)):
+                if(self.state == CLOSED):
+                    self.open_count += 1
+                    self.__opened_at = time.monotonic()
+                else:
+                    # the open period goes on, restart its timeout only
+                    self.__open_time += time.monotonic() - self.__opened_at
+                    self.__opened_at = time.monotonic()
+                self.state = OPEN
+                logger.warning(f'circuit {self.name} open for {self.reset_timeout_s} s')
+
+    def open_time(self):
+        ''' Second spent open or half open, the current period included
+        '''
+        with self.__lock:
+            if(self.state == CLOSED):
+                return self.__open_time
+            return self.__open_time + time.monotonic() - self.__opened_at
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'open_count': self.open_count,
+            'open_time_s': round(self.open_time(), 1),
+            'rejected': self.rejected,
+        }
+
+
+class RetryBudget(object):
+    ''' Token bucket limiting retries to a share of the calls: every call
+        deposits ratio token, every retry takes one. Starts full.
+    '''
+
+    def __init__(self, ratio=0.2, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.__tokens = float(max_tokens)
+        self.__lock = threading.Lock()
+
+    def deposit(self):
+        with self.__lock:
+            self.__tokens = min(self.max_tokens, self.__tokens + self.ratio)
+
+    def withdraw(self):
+        ''' Return False when no retry is left
+        '''
+        with self.__lock:
+            if(self.__tokens < 1):
+                return False
+            self.__tokens -= 1
+            return True
+
+
+class RetryPolicy(object):
+    ''' Call func, retry it with backoff while retry_if(exception) is True,
+        up to max_attempts calls and while the budget allows. The breaker
+        sees the outcome of each call() after its retries.
+    '''
+
+    def __init__(self, name, max_attempts=3, backoff=None, breaker=None, budget=None,
+                 retry_if=None, sleep=time.sleep):
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff or Backoff()
+        self.breaker = breaker
+        self.budget = budget
+        self.retry_if = retry_if or (lambda e: True)
+        self.sleep = sleep
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.budget_exhausted = 0
+        self.__lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        if(self.breaker is not None and not self.breaker.allow()):
+            raise CircuitOpen(self.breaker.name)
+        with self.__lock:
+            self.calls += 1
+        if(self.budget is not None):
+            self.budget.deposit()
+        attempt = 0
+        while(True):
+            with self.__lock:
+                self.attempts += 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if(not self.__retry(e, attempt)):
+                    with self.__lock:
+                        self.failures += 1
+                    if(self.breaker is not None):
+                        self.breaker.record_failure()
+                    raise
+                delay = self.backoff.delay(attempt)
+                logger.warning(f'{self.name}: {e}, retry {attempt + 1} in {delay:.2f} s')
+                self.sleep(delay)
+                attempt += 1
+                continue
+            if(self.breaker is not None):
+                self.breaker.record_success()
+            return result
+
+    def stats(self):
+        stats = {
+            'calls': self.calls,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'failures': self.failures,
+            'budget_exhausted': self.budget_exhausted,
+        }
+        if(self.breaker is not None):
+            stats['circuit'] = self.breaker.stats()
+        return stats
+
+    def __retry(self, error, attempt):
+        if(attempt + 1 >= self.max_attempts or not self.retry_if(error)):
+            return False
+        if(self.budget is not None and not self.budget.withdraw()):
+            with self.__lock:
+                self.budget_exhausted += 1
+            return False
+        with self.__lock:
+            self.retries += 1
+        return True
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(name, **kwargs):
+    ''' Shared CircuitBreaker of an endpoint, created on first use with kwargs
+    '''
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if(breaker is None):
+            breaker = _breakers[name] = CircuitBreaker(name, **kwargs)
+        return breaker
+
+
+def breaker_stats():
+    with _breakers_lock:
+        return {name: breaker.stats() for name, breaker in _breakers.items()}
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# scheduler.py
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('maps6')
+
+# where a task runs
+EXECUTOR_INLINE = 'inline'  # scheduler thread, for short tasks only
+EXECUTOR_POOL = 'pool'  # shared thread pool
+EXECUTOR_THREAD = 'thread'  # a thread of its own, for tasks that block
+
+POOL_SIZE = 2
+
+
+class TaskStats(object):
+    ''' jitter: start time - due time (second), overruns: runs skipped because
+        the previous one was still going, missed: slots skipped after a late start
+    '''
+    __slots__ = ('runs', 'errors', 'overruns', 'missed', 'jitter_sum', 'jitter_max',
+                 'duration_sum', 'duration_max')
+
+    def __init__(self):
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.missed = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.duration_sum = 0.0
+        self.duration_max = 0.0
+
+    def as_dict(self):
+        runs = max(1, self.runs)
+        return {
+            'runs': self.runs,
+            'errors': self.errors,
+            'overruns': self.overruns,
+            'missed': self.missed,
+            'jitter_mean_ms': round(self.jitter_sum / runs * 1e3, 2),
+            'jitter_max_ms': round(self.jitter_max * 1e3, 2),
+            'duration_mean_ms': round(self.duration_sum / runs * 1e3, 2),
+            'duration_max_ms': round(self.duration_max * 1e3, 2),
+        }
+
+
+class Task(object):
+    def __init__(self, name, func, interval_s, executor):
+        self.name = name
+        self.func = func
+        self.interval_s = interval_s
+        self.executor = executor
+        self.stats = TaskStats()
+        self.running = False
+        self.due = 0.0
+        self.token = 0  # heap entries of an older token are stale
+        self.wake = threading.Event()  # EXECUTOR_THREAD only
+        self.run_due = 0.0
+
+
+class Scheduler(object):
+    ''' Run periodic tasks from a heap of deadlines.
+        The scheduler thread sleeps until the earliest deadline or until a
+        task is added or triggered, there is no polling. A task whose
+        previous run has not finished is skipped and counted as an overrun,
+        a slow task only delays itself.
+    '''
+
+    def __init__(self, pool_size=POOL_SIZE):
+        self.pool_size = pool_size
+        self.wakeups = 0
+        self.__tasks = {}
+        self.__heap = []  # (due, seq, token, triggered, task)
+        self.__seq = itertools.count()
+        self.__cond = threading.Condition()
+        self.__stop = threading.Event()
+        self.__pool = None
+        self.__thread = None
+
+    def add(self, name, func, interval_s, executor=EXECUTOR_INLINE, delay_s=0):
+        ''' Run func() every interval_s, the first time after delay_s
+        '''
+        task = Task(name, func, interval_s, executor)
+        if(executor == EXECUTOR_THREAD):
+            threading.Thread(target=self.__worker, args=(task,),
+                             name=f'{name}_t', daemon=True).start()
+        with self.__cond:
+            self.__tasks[name] = task
+            self.__push(task, time.monotonic() + delay_s)
+        return task
+
+    def remove(self, name):
+        with self.__cond:
+            task = self.__tasks.pop(name, None)
+            if(task is not None):
+                task.token += 1
+                task.wake.set()
+
+    def trigger(self, name):
+        ''' Run the task as soon as possible, its period starts again from now
+        '''
+        with self.__cond:
+            task = self.__tasks.get(name)
+            if(task is not None):
+                self.__push(task, time.monotonic(), True)
+
+    def run(self):
+        ''' Dispatch tasks on the calling thread until stop()
+        '''
+        if(self.__pool is None):
+            self.__pool = ThreadPoolExecutor(self.pool_size, thread_name_prefix='scheduler_pool')
+        while(not self.__stop.is_set()):
+            with self.__cond:
+                task, due, triggered = self.__next()
+                if(task is None):
+                    continue
+            self.__dispatch(task, due, triggered)
+
+    def start(self):
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.run, name='scheduler_t', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        with self.__cond:
+            for task in self.__tasks.values():
+                task.wake.set()
+            self.__cond.notify_all()
+        if(self.__thread and self.__thread is not threading.current_thread()):
+            self.__thread.join()
+        if(self.__pool is not None):
+            self.__pool.shutdown(wait=False)
+
+    def stats(self):
+        with self.__cond:
+            return {name: task.stats.as_dict() for name, task in self.__tasks.items()}
+
+    def __push(self, task, due, triggered=False):
+        task.token += 1
+        task.due = due
+        heapq.heappush(self.__heap, (due, next(self.__seq), task.token, triggered, task))
+        self.__cond.notify()
+
+    def __next(self):
+        ''' Pop the next due task, or sleep until it is due. Call with __cond held.
+        '''
+        while(self.__heap and self.__heap[0][2] != self.__heap[0][4].token):
+            heapq.heappop(self.__heap)  # stale after trigger() or remove()
+        if(not self.__heap):
+            self.__cond.wait()
+            self.wakeups += 1
+            return None, None, False
+        due, _, _, triggered, task = self.__heap[0]
+        now = time.monotonic()
+        if(due > now):
+            self.__cond.wait(due - now)
+            self.wakeups += 1
+            return None, None, False
+        heapq.heappop(self.__heap)
+        # keep the period, skip the slots missed instead of bursting
+        next_due = due + task.interval_s
+        while(next_due <= now):
+            next_due += task.interval_s
+            task.stats.missed += 1
+        self.__push(task, next_due)
+        return task, due, triggered
+
+    def __dispatch(self, task, due, triggered):
+        if(task.running):
+            # a trigger while the task runs is served by that run
+            if(not triggered):
+                task.stats.overruns += 1
+                logger.warning(f'task {task.name} overrun, still running since its last period')
+            return
+        task.running = True
+        if(task.executor == EXECUTOR_THREAD):
+            task.run_due = due
+            task.wake.set()
+        elif(task.executor == EXECUTOR_POOL):
+            self.__pool.submit(self.__execute, task, due)
+        else:
+            self.__execute(task, due)
+
+    def __execute(self, task, due):
+        start = time.monotonic()
+        stats = task.stats
+        jitter = start - due
+        stats.jitter_sum += jitter
+        stats.jitter_max = max(stats.jitter_max, jitter)
+        try:
+            task.func()
+        except Exception as e:
+            stats.errors += 1
+            logger.error(e, exc_info=True)
+        finally:
+            duration = time.monotonic() - start
+            stats.runs += 1
+            stats.duration_sum += duration
+            stats.duration_max = max(stats.duration_max, duration)
+            task.running = False
+
+    def __worker(self, task):
+        while(not self.__stop.is_set()):
+            task.wake.wait()
+            task.wake.clear()
+            if(self.__stop.is_set() or task.name not in self.__tasks):
+                return
+            if(task.running):
+                self.__execute(task, task.run_due)
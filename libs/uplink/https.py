@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# https.py
+
+import time
+import logging
+import threading
+
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from libs.retry.retry import RetryPolicy, Backoff, RetryBudget, CircuitOpen, circuit_breaker
+
+logger = logging.getLogger('maps6')
+
+CONNECT_TIMEOUT = 5  # second, TCP + TLS handshake
+READ_TIMEOUT = 15  # second, between two bytes of the reply
+# a request failing on the network, with 429 or 5xx is sent again once
+MAX_ATTEMPTS = 2
+RETRY_BACKOFF_BASE = 1  # second
+RETRY_BACKOFF_CAP = 10
+# failed requests in a row that open the host circuit, and for how long (second)
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 60
+
+
+class HTTPSUplink(object):
+    ''' Upload messages over one keep-alive requests.Session, the TLS
+        handshake is paid once per connection instead of once per upload.
+        params are sent with every request, the message goes in 'msg'.
+        batch_size > 1 POSTs up to batch_size 'msg' fields per request, only
+        for endpoints that accept it (LASS takes one message per GET).
+        verify: as requests, False or the path of a CA bundle
+        Failed requests are retried with backoff and a retry budget, a
+        circuit breaker per host fails uploads at once while it is down.
+    '''
+
+    def __init__(self, url, params=None, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), batch_size=1,
+                 verify=True, max_attempts=MAX_ATTEMPTS):
+        self.url = url
+        self.params = dict(params or {})
+        self.timeout = timeout
+        self.batch_size = max(1, batch_size)
+        self.verify = verify
+        self.request_count = 0
+        self.failure_count = 0
+        self.message_count = 0
+        self.request_time = 0  # second, sum over every request
+        host = urlsplit(url).netloc
+        self.retry = RetryPolicy(f'https://{host}', max_attempts,
+                                 Backoff(RETRY_BACKOFF_BASE, RETRY_BACKOFF_CAP),
+                                 circuit_breaker(f'https://{host}', failure_threshold=BREAKER_THRESHOLD,
+                                                 reset_timeout_s=BREAKER_RESET),
+                                 RetryBudget(), retry_if=_retryable)
+        self.__lock = threading.Lock()
+        self.__session = self.__new_session()
+
+    def upload(self, msg):
+        ''' Send one message, return True on HTTP 200
+        '''
+        return self.__request('GET', params=dict(self.params, msg=msg), count=1)
+
+    def upload_many(self, messages):
+        ''' Send messages in order, stop at the first failure.
+            Return a list of bool in the order of messages.
+        '''
+        messages = list(messages)
+        results = [False] * len(messages)
+        if(self.batch_size == 1):
+            for idx, msg in enumerate(messages):
+                if(not self.upload(msg)):
+                    break
+                results[idx] = True
+            return results
+        for start in range(0, len(messages), self.batch_size):
+            chunk = messages[start:start + self.batch_size]
+            fields = list(self.params.items()) + [('msg', msg) for msg in chunk]
+            if(not self.__request('POST', data=fields, count=len(chunk))):
+                break
+            results[start:start + len(chunk)] = [True] * len(chunk)
+        return results
+
+    def close(self):
+        with self.__lock:
+            self.__session.close()
+
+    def stats(self):
+        return {
+            'requests': self.request_count,
+            'failures': self.failure_count,
+            'messages': self.message_count,
+            'mean_request_ms': round(self.request_time / max(1, self.request_count) * 1e3, 1),
+            'retry': self.retry.stats(),
+        }
+
+    def __new_session(self):
+        session = requests.Session()
+        # one pooled connection, retries are up to the caller
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def __request(self, method, count, **kwargs):
+        with self.__lock:
+            try:
+                return self.retry.call(self.__send, method, count, **kwargs)
+            except CircuitOpen:
+                logger.debug(f'HTTPS {method} skipped, circuit open')
+            except requests.RequestException as e:
+                logger.error(f'HTTPS {method} failed: {e}')
+            return False
+
+    def __send(self, method, count, **kwargs):
+        ''' One request, raise on the failures worth a retry. Call with __lock held.
+        '''
+        start = time.perf_counter()
+        self.request_count += 1
+        try:
+            # params and data are percent-encoded by requests
+            # verify per request, the session default loses to REQUESTS_CA_BUNDLE
+            reply = self.__session.request(method, self.url, timeout=self.timeout,
+                                           verify=self.verify, **kwargs)
+            # read the body so the connection goes back to the pool
+            reply.content
+        except requests.RequestException:
+            self.failure_count += 1
+            # drop a connection left half-open by the failure
+            self.__session.close()
+            self.__session = self.__new_session()
+            raise
+        finally:
+            self.request_time += time.perf_counter() - start
+        logger.debug(f'HTTPS {method} result: {reply.status_code}')
+        if(reply.status_code == 200):
+            self.message_count += count
+            return True
+        self.failure_count += 1
+        if(reply.status_code == 429 or reply.status_code >= 500):
+            raise requests.HTTPError(f'HTTP {reply.status_code}', response=reply)
+        # the server is up and refused the request, a retry would not help
+        logger.warning(f'HTTPS {method} result: {reply.status_code}')
+        return False
+
+
+def _retryable(error):
+    return isinstance(error, requests.RequestException)
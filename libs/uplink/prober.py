@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# prober.py
+
+import errno
+import logging
+import select
+import socket
+import threading
+import time
+
+logger = logging.getLogger('maps6')
+
+# probe interval (second), doubled while the state stays the same
+PROBE_MIN_INTERVAL = 2
+PROBE_MAX_INTERVAL = 60
+PROBE_TIMEOUT = 3  # second, TCP connect
+DNS_TTL = 300  # second, a stale address is kept while DNS fails
+# failed probes in a row before the link counts as down
+DOWN_AFTER = 2
+
+
+class ConnectivityProber(object):
+    ''' Check the upload endpoint with a TCP connect from its own thread.
+        The interval starts at min_interval after a state change and doubles
+        up to max_interval while the state is stable. online is a
+        threading.Event the uploader can wait on.
+    '''
+
+    def __init__(self, host, port=443, min_interval=PROBE_MIN_INTERVAL, max_interval=PROBE_MAX_INTERVAL,
+                 timeout=PROBE_TIMEOUT, dns_ttl=DNS_TTL, down_after=DOWN_AFTER):
+        self.host = host
+        self.port = port
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.dns_ttl = dns_ttl
+        self.down_after = down_after
+        self.online = threading.Event()
+        self.probe_count = 0
+        self.failure_count = 0
+        self.change_count = 0
+        self.dns_lookups = 0
+        self.connect_time = 0.0  # second, sum over successful probes
+        self.__state = None  # None until the first probe
+        self.__failures = 0
+        self.__interval = min_interval
+        self.__address = None  # (expire time, sockaddr)
+        self.__listeners = []
+        self.__stop = threading.Event()
+        self.__wake = threading.Event()
+        self.__thread = None
+
+    def add_listener(self, callback):
+        ''' callback(online) is called from the prober thread on every change
+        '''
+        self.__listeners.append(callback)
+
+    def start(self):
+        self.__stop.clear()
+        self.__thread = threading.Thread(
+            target=self.__run, name='connectivity_prober_t', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        self.__wake.set()
+        if(self.__thread):
+            self.__thread.join()
+
+    def is_online(self):
+        return self.online.is_set()
+
+    def wait_online(self, timeout=None):
+        ''' Block until the endpoint is reachable, timeout in second. Return the state.
+        '''
+        return self.online.wait(timeout)
+
+    def kick(self):
+        ''' Probe now, e.g. after an upload failed
+        '''
+        self.__interval = self.min_interval
+        self.__wake.set()
+
+    def probe(self):
+        ''' Try one TCP connect, return True when it was accepted
+        '''
+        self.probe_count += 1
+        try:
+            address = self.__resolve()
+        except OSError as e:
+            logger.debug(f'probe {self.host}: DNS {e}')
+            return False
+        start = time.monotonic()
+        if(self.__connect(address)):
+            self.connect_time += time.monotonic() - start
+            return True
+        # the host may have moved, ask DNS again next time
+        self.__address = (0, address)
+        return False
+
+    def stats(self):
+        return {
+            'online': self.online.is_set(),
+            'interval': self.__interval,
+            'probes': self.probe_count,
+            'failures': self.failure_count,
+            'changes': self.change_count,
+            'dns_lookups': self.dns_lookups,
+            'mean_connect_ms': round(self.connect_time / max(1, self.probe_count - self.failure_count) * 1e3, 1),
+        }
+
+    def __resolve(self):
+        now = time.monotonic()
+        if(self.__address is not None and now < self.__address[0]):
+            return self.__address[1]
+        self.dns_lookups += 1
+        try:
+            infos = socket.getaddrinfo(self.host, self.port, socket.AF_INET, socket.SOCK_STREAM)
+        except OSError:
+            if(self.__address is not None):
+                return self.__address[1]
+            raise
+        self.__address = (now + self.dns_ttl, infos[0][4])
+        return infos[0][4]
+
+    def __connect(self, address):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            err = sock.connect_ex(address)
+            if(err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK)):
+                return False
+            _, writable, _ = select.select([], [sock], [], self.timeout)
+            if(not writable):
+                return False
+            return sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+        except OSError:
+            return False
+        finally:
+            sock.close()
+
+    def __update(self, result):
+        if(result):
+            self.__failures = 0
+        else:
+            self.failure_count += 1
+            self.__failures += 1
+            # keep the last state until the failure is confirmed
+            if(self.__state and self.__failures < self.down_after):
+                self.__interval = self.min_interval
+                return
+        if(result == self.__state):
+            self.__interval = min(self.__interval * 2, self.max_interval)
+            return
+        self.__state = result
+        self.__interval = self.min_interval
+        self.change_count += 1
+        logger.info(f'{self.host}:{self.port} {"reachable" if result else "unreachable"}')
+        if(result):
+            self.online.set()
+        else:
+            self.online.clear()
+        for callback in self.__listeners:
+            try:
+                callback(result)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+
+    def __run(self):
+        while(not self.__stop.is_set()):
+            try:
+                self.__update(self.probe())
+            except Exception as e:
+                logger.error(e, exc_info=True)
+            self.__wake.wait(self.__interval)
+            self.__wake.clear()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# selector.py
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger('maps6')
+
+HEDGE_AFTER = 1  # second per record, the secondary path gets the batch when the primary is slower
+MIN_SUCCESS = 0.5  # EWMA success rate below which a path counts as degraded
+EWMA_ALPHA = 0.2  # weight of the newest upload
+DEDUPE_WINDOW = 1024  # delivered record timestamps remembered
+
+
+class UplinkPath(object):
+    ''' One way to LASS. upload(records) returns a list of bool in the order
+        of records, available() tells whether the link is worth a try.
+        success_rate and latency (second per record) are EWMA over its uploads,
+        so batches of any size compare.
+    '''
+
+    def __init__(self, name, upload, available=None, alpha=EWMA_ALPHA):
+        self.name = name
+        self.upload = upload
+        self.available = available or (lambda: True)
+        self.alpha = alpha
+        self.success_rate = 1.0
+        self.latency = None  # None before the first upload
+        self.uploads = 0
+        self.records = 0
+        self.delivered = 0
+        self.busy = False
+
+    def record(self, sent, delivered, elapsed):
+        self.uploads += 1
+        self.records += sent
+        self.delivered += delivered
+        rate = delivered / sent if sent else 1.0
+        self.success_rate += self.alpha * (rate - self.success_rate)
+        latency = elapsed / max(1, sent)
+        if(self.latency is None):
+            self.latency = latency
+        else:
+            self.latency += self.alpha * (latency - self.latency)
+
+    def stats(self):
+        return {
+            'success_rate': round(self.success_rate, 3),
+            'latency_ms': round(self.latency * 1e3) if self.latency is not None else None,
+            'uploads': self.uploads,
+            'records': self.records,
+            'delivered': self.delivered,
+        }
+
+
+class UplinkSelector(object):
+    ''' Upload a batch on the first available path, in the order of paths.
+        When the primary has not answered after hedge_after_s per record of
+        the batch, or is already degraded (slower than hedge_after_s per
+        record or failing on average), the records it has not
+        delivered yet also go out on the next available path. Failures are
+        retried on the next path the same way. A record counts as delivered
+        when any path delivered it, timestamps delivered recently are not
+        sent again, e.g. after a slow primary finished late.
+        A path is used by one upload at a time, the one still busy with an
+        abandoned batch is skipped.
+    '''
+
+    def __init__(self, paths, hedge_after_s=HEDGE_AFTER, min_success=MIN_SUCCESS,
+                 dedupe_window=DEDUPE_WINDOW):
+        self.paths = list(paths)
+        self.hedge_after_s = hedge_after_s
+        self.min_success = min_success
+        self.dedupe_window = dedupe_window
+        self.hedges = 0  # secondary sent while the primary was still running
+        self.failovers = 0  # secondary sent after the primary failed
+        self.hedge_wins = 0  # records delivered by another path than the primary
+        self.deduped = 0
+        self.__delivered = set()
+        self.__delivered_order = deque()
+        self.__lock = threading.Lock()
+        self.__pool = ThreadPoolExecutor(len(self.paths), thread_name_prefix='uplink_path')
+
+    def degraded(self, path):
+        return (path.success_rate < self.min_success or
+                (path.latency is not None and path.latency > self.hedge_after_s))
+
+    def upload(self, records):
+        ''' Return a list of bool in the order of records
+        '''
+        records = list(records)
+        with self.__lock:
+            delivered = {record.timestamp for record in records if record.timestamp in self.__delivered}
+        self.deduped += len(delivered)
+        tried = []
+        in_flight = {}
+        while(True):
+            remaining = [record for record in records if record.timestamp not in delivered]
+            if(not remaining):
+                break
+            path = self.__next_path(tried)
+            # the next path starts when none is running, or the running ones are degraded
+            if(path is not None and all(self.degraded(running) for running in in_flight.values())):
+                if(tried and in_flight):
+                    self.hedges += 1
+                    logger.info(f'upload raced on {path.name}, {tried[0].name} is degraded')
+                elif(tried):
+                    self.failovers += 1
+                    logger.info(f'upload failed over to {path.name}')
+                tried.append(path)
+                in_flight[self.__submit(path, remaining)] = path
+                continue
+            if(not in_flight):
+                if(not tried):
+                    logger.info('There is no valid network, please check if you can connect to WiFi or NB-IoT')
+                break
+            # a busy path may be free by the end of the wait
+            waiting = any(path not in tried and path.available() for path in self.paths)
+            timeout = self.hedge_after_s * len(remaining) if waiting else None
+            done, _ = wait(in_flight, timeout, FIRST_COMPLETED)
+            if(not done):
+                path = self.__next_path(tried)
+                if(path is not None):
+                    self.hedges += 1
+                    logger.info(f'upload hedged on {path.name}, {tried[0].name} is slow')
+                    tried.append(path)
+                    in_flight[self.__submit(path, remaining)] = path
+                continue
+            for future in done:
+                path = in_flight.pop(future)
+                won = [timestamp for timestamp in future.result() if timestamp not in delivered]
+                if(path is not tried[0]):
+                    self.hedge_wins += len(won)
+                delivered.update(won)
+        return [record.timestamp in delivered for record in records]
+
+    def close(self):
+        self.__pool.shutdown(wait=False)
+
+    def stats(self):
+        stats = {path.name: path.stats() for path in self.paths}
+        stats.update(hedges=self.hedges, failovers=self.failovers,
+                     hedge_wins=self.hedge_wins, deduped=self.deduped)
+        return stats
+
+    def __next_path(self, tried):
+        for path in self.paths:
+            if(path not in tried and not path.busy and path.available()):
+                return path
+        return None
+
+    def __submit(self, path, records):
+        path.busy = True
+        return self.__pool.submit(self.__upload, path, records)
+
+    def __upload(self, path, records):
+        ''' Upload on one path from the pool, return the timestamps delivered
+        '''
+        start = time.monotonic()
+        try:
+            results = list(path.upload(records))
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            results = []
+        elapsed = time.monotonic() - start
+        timestamps = [record.timestamp for record, result in zip(records, results) if result]
+        path.record(len(records), len(timestamps), elapsed)
+        with self.__lock:
+            for timestamp in timestamps:
+                if(timestamp not in self.__delivered):
+                    self.__delivered.add(timestamp)
+                    self.__delivered_order.append(timestamp)
+            while(len(self.__delivered_order) > self.dedupe_window):
+                self.__delivered.discard(self.__delivered_order.popleft())
+        path.busy = False
+        return timestamps
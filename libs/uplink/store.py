@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# store.py
+
+import os
+import json
+import zlib
+import logging
+import threading
+from collections import deque, namedtuple
+
+
+logger = logging.getLogger('maps6')
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+CURSOR_FILE = 'cursor'
+
+SEGMENT_BYTES = 256 * 1024  # byte
+MAX_BYTES = 16 * 1024 * 1024  # byte
+DEDUPE_WINDOW = 1024  # queued record timestamps remembered
+
+# segment: base sequence number of the segment file, offset: byte in it,
+# seq: sequence number of the record at that offset
+Cursor = namedtuple('Cursor', ['segment', 'offset', 'seq'])
+# position: cursor after the record, pass it to commit()
+StoredRecord = namedtuple('StoredRecord', ['seq', 'timestamp', 'data', 'position'])
+
+
+def _encode_line(record):
+    payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+
+def _decode_line(line):
+    ''' Return the record of a stored line, None if it is torn or corrupt
+    '''
+    if(len(line) < 10 or not line.endswith(b'\n') or line[8:9] != b' '):
+        return None
+    payload = line[9:-1]
+    try:
+        if(int(line[:8], 16) != zlib.crc32(payload)):
+            return None
+        return json.loads(payload.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+class UploadStore(object):
+    ''' Append-only queue of upload records on disk.
+        Segment files are named after the sequence number of their first
+        record and hold one "<crc32> <json>" line per record. The commit
+        cursor file is replaced atomically and a torn last line is cut off
+        on open, so a power cut loses at most the record being written.
+        The oldest segments are evicted once the store grows beyond max_bytes.
+    '''
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_bytes=MAX_BYTES, sync=True,
+                 dedupe_window=DEDUPE_WINDOW):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, 2 * segment_bytes)
+        self.sync = sync
+        self.dedupe_window = dedupe_window
+        self.appended = 0
+        self.committed = 0
+        self.evicted = 0
+        self.duplicates = 0
+        self.corrupt = 0
+        self.last_timestamp = None
+        self.__recent = set()
+        self.__recent_order = deque()
+        self.__sizes = {}  # segment base: byte
+        self.__next_seq = 0
+        self.__cursor = None
+        self.__writer = None
+        self.__lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self.__open()
+
+    def __len__(self):
+        ''' Records not committed yet
+        '''
+        with self.__lock:
+            return max(0, self.__next_seq - self.__cursor.seq)
+
+    def put(self, timestamp, data):
+        ''' Append a record, data must be JSON serializable.
+            Return False when timestamp is one of the last dedupe_window
+            records', a reading is only queued once.
+        '''
+        with self.__lock:
+            if(timestamp in self.__recent):
+                self.duplicates += 1
+                return False
+            line = _encode_line({'seq': self.__next_seq, 'ts': timestamp, 'data': data})
+            active = max(self.__sizes) if self.__sizes else None
+            if(active is None or (self.__sizes[active] and
+                                  self.__sizes[active] + len(line) > self.segment_bytes)):
+                active = self.__roll()
+            self.__writer.write(line)
+            self.__writer.flush()
+            if(self.sync):
+                os.fsync(self.__writer.fileno())
+            self.__sizes[active] += len(line)
+            self.__next_seq += 1
+            self.__remember(timestamp)
+            self.appended += 1
+            self.__evict()
+            return True
+
+    def peek(self, count):
+        ''' Return up to count of the oldest uncommitted records, oldest first
+        '''
+        records = []
+        with self.__lock:
+            cursor = self.__cursor
+            for base in sorted(self.__sizes):
+                if(base < cursor.segment):
+                    continue
+                offset = cursor.offset if base == cursor.segment else 0
+                for record, end in self.__scan(base, offset):
+                    records.append(StoredRecord(record['seq'], record['ts'], record['data'],
+                                                Cursor(base, end, record['seq'] + 1)))
+                    if(len(records) >= count):
+                        return records
+            if(not records and self.__sizes and cursor.seq < self.__next_seq):
+                # only corrupt lines left, skip them
+                active = max(self.__sizes)
+                self.corrupt += self.__next_seq - cursor.seq
+                self.__cursor = Cursor(active, self.__sizes[active], self.__next_seq)
+                self.__write_cursor()
+                self.__drop_consumed()
+        return records
+
+    def commit(self, position):
+        ''' Mark every record up to position as uploaded
+        '''
+        with self.__lock:
+            if(position.seq <= self.__cursor.seq):
+                return
+            self.committed += position.seq - self.__cursor.seq
+            self.__cursor = position
+            self.__write_cursor()
+            self.__drop_consumed()
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'pending': len(self),
+                'bytes': sum(self.__sizes.values()),
+                'segments': len(self.__sizes),
+                'appended': self.appended,
+                'committed': self.committed,
+                'evicted': self.evicted,
+                'duplicates': self.duplicates,
+                'corrupt': self.corrupt,
+            }
+
+    def close(self):
+        with self.__lock:
+            if(self.__writer is not None):
+                self.__writer.close()
+                self.__writer = None
+
+    def __path(self, base):
+        return os.path.join(self.directory, f'{SEGMENT_PREFIX}{base:012d}{SEGMENT_SUFFIX}')
+
+    def __open(self):
+        for name in os.listdir(self.directory):
+            if(name.endswith('.tmp')):
+                os.remove(os.path.join(self.directory, name))
+            elif(name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+                try:
+                    base = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                except ValueError:
+                    continue
+                self.__sizes[base] = os.path.getsize(self.__path(base))
+        if(self.__sizes):
+            active = max(self.__sizes)
+            self.__recover(active)
+            self.__writer = open(self.__path(active), 'ab')
+        self.__cursor = self.__load_cursor()
+        logger.info(f'upload store {self.directory}: {len(self)} records queued')
+
+    def __recover(self, base):
+        ''' Cut the torn tail of the active segment, find the next sequence number
+        '''
+        self.__next_seq = base
+        good_end = 0
+        offset = 0
+        with open(self.__path(base), 'rb') as f:
+            for line in f:
+                offset += len(line)
+                record = _decode_line(line)
+                if(record is None):
+                    self.corrupt += 1
+                    continue
+                good_end = offset
+                self.__next_seq = record['seq'] + 1
+                self.__remember(record['ts'])
+        if(good_end < self.__sizes[base]):
+            logger.warning(f'upload store: drop {self.__sizes[base] - good_end} byte torn tail')
+            with open(self.__path(base), 'r+b') as f:
+                f.truncate(good_end)
+                f.flush()
+                os.fsync(f.fileno())
+            self.__sizes[base] = good_end
+
+    def __remember(self, timestamp):
+        self.last_timestamp = timestamp
+        if(timestamp not in self.__recent):
+            self.__recent.add(timestamp)
+            self.__recent_order.append(timestamp)
+        while(len(self.__recent_order) > self.dedupe_window):
+            self.__recent.discard(self.__recent_order.popleft())
+
+    def __load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), 'r') as f:
+                cursor = Cursor(**json.load(f))
+            if(cursor.segment in self.__sizes and cursor.offset <= self.__sizes[cursor.segment]):
+                return cursor
+            return self.__seek(cursor.seq)
+        except FileNotFoundError:
+            return self.__seek(0)
+        except (ValueError, TypeError) as e:
+            logger.error(f'upload store cursor: {e}')
+            return self.__seek(0)
+
+    def __seek(self, seq):
+        ''' Cursor of the first record >= seq, the oldest record if seq was evicted
+        '''
+        if(not self.__sizes):
+            return Cursor(self.__next_seq, 0, self.__next_seq)
+        bases = sorted(self.__sizes)
+        base = max([b for b in bases if b <= seq] or bases[:1])
+        offset = 0
+        for record, end in self.__scan(base, 0):
+            if(record['seq'] >= seq):
+                break
+            offset = end
+        return Cursor(base, offset, max(seq, base))
+
+    def __scan(self, base, offset):
+        ''' Yield (record, offset after it) from offset of a segment
+        '''
+        with open(self.__path(base), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                record = _decode_line(line)
+                if(record is None):
+                    continue
+                yield record, offset
+
+    def __roll(self):
+        ''' Start a new segment at the next sequence number, return its base
+        '''
+        if(self.__writer is not None):
+            self.__writer.close()
+        base = self.__next_seq
+        self.__writer = open(self.__path(base), 'ab')
+        self.__sizes[base] = 0
+        self.__sync_directory()
+        self.__drop_consumed()
+        return base
+
+    def __drop_consumed(self):
+        ''' Remove the segments behind the cursor, never the active one
+        '''
+        bases = sorted(self.__sizes)
+        cursor = self.__cursor
+        idx = bases.index(cursor.segment) if cursor.segment in bases else 0
+        if(idx + 1 < len(bases) and cursor.offset >= self.__sizes[cursor.segment]):
+            # the cursor is at the end of its segment, move it to the next one
+            self.__cursor = Cursor(bases[idx + 1], 0, cursor.seq)
+            self.__write_cursor()
+        for base in bases[:-1]:
+            if(base < self.__cursor.segment):
+                self.__remove(base)
+
+    def __evict(self):
+        ''' Drop the oldest segments while the store is larger than max_bytes
+        '''
+        while(sum(self.__sizes.values()) > self.max_bytes and len(self.__sizes) > 1):
+            bases = sorted(self.__sizes)
+            base, following = bases[0], bases[1]
+            if(self.__cursor.segment <= base):
+                lost = following - max(self.__cursor.seq, base)
+                self.evicted += lost
+                logger.warning(f'upload store full, evict {lost} oldest records')
+                self.__cursor = Cursor(following, 0, following)
+                self.__write_cursor()
+            self.__remove(base)
+
+    def __remove(self, base):
+        os.remove(self.__path(base))
+        del self.__sizes[base]
+
+    def __write_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.__cursor._asdict(), f)
+            f.flush()
+            if(self.sync):
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self.__sync_directory()
+
+    def __sync_directory(self):
+        if(not self.sync):
+            return
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# worker.py
+
+import logging
+import threading
+from collections import deque, namedtuple
+
+from libs.retry.retry import Backoff, JITTER_EQUAL
+
+logger = logging.getLogger('maps6')
+
+# what submit() does when the memory queue is full
+POLICY_DROP_OLDEST = 'drop_oldest'  # drop the oldest queued record
+POLICY_COALESCE = 'coalesce'  # the new record replaces the newest queued one
+POLICY_SPILL = 'spill'  # move the oldest queued record to the UploadStore
+
+CAPACITY = 32  # records in memory
+BATCH_SIZE = 16
+RETRY_INTERVAL = 10  # second, doubled after each failure in a row
+RETRY_MAX_INTERVAL = 600
+
+# data is JSON serializable and never changed after submit()
+UploadRecord = namedtuple('UploadRecord', ['timestamp', 'data'])
+
+
+class UploadWorker(object):
+    ''' Upload records from its own thread, submit() never blocks.
+        upload(records) returns a list of bool in the order of records and
+        is called with records already on disk first, oldest first. With a
+        store, records that failed to upload are spilled to it, so memory
+        only holds records that have not been tried yet. While a batch from
+        memory is uploading, overflow waits in memory and is spilled after
+        the batch, behind any of its records that failed.
+        After a failed batch it waits about retry_s, doubled for every
+        failure in a row up to retry_max_s, wake() retries at once.
+    '''
+
+    def __init__(self, upload, store=None, capacity=CAPACITY, policy=POLICY_SPILL,
+                 batch_size=BATCH_SIZE, retry_s=RETRY_INTERVAL, retry_max_s=RETRY_MAX_INTERVAL):
+        assert policy in (POLICY_DROP_OLDEST, POLICY_COALESCE, POLICY_SPILL)
+        self.upload = upload
+        self.store = store
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self.batch_size = batch_size
+        self.retry_s = retry_s
+        self.backoff = Backoff(retry_s, max(retry_s, retry_max_s), jitter=JITTER_EQUAL)
+        self.__failures = 0  # failed batches in a row
+        self.submitted = 0
+        self.uploaded = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.spilled = 0
+        self.failures = 0
+        self.max_depth = 0
+        self.__depth_sum = 0  # depth seen by each submit()
+        self.__queue = deque()
+        self.__in_flight = False  # a batch taken from memory is uploading
+        self.__cond = threading.Condition()
+        self.__wake = False
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def __len__(self):
+        ''' Records waiting, in memory and on disk
+        '''
+        with self.__cond:
+            return len(self.__queue) + (len(self.store) if self.store is not None else 0)
+
+    def submit(self, record):
+        ''' Queue a record, return False when an old record was dropped for it
+        '''
+        with self.__cond:
+            self.submitted += 1
+            self.__depth_sum += len(self.__queue)
+            accepted = True
+            if(len(self.__queue) >= self.capacity):
+                accepted = self.__overflow(record)
+            else:
+                self.__queue.append(record)
+            self.max_depth = max(self.max_depth, len(self.__queue))
+            self.__cond.notify()
+            return accepted
+
+    def wake(self):
+        ''' Retry now, e.g. when a link comes up
+        '''
+        with self.__cond:
+            self.__wake = True
+            self.__cond.notify()
+
+    def start(self):
+        self.__stop.clear()
+        self.__thread = threading.Thread(
+            target=self.__run, name='upload_worker_t', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        ''' Stop the thread, records still in memory are spilled to the store
+        '''
+        self.__stop.set()
+        self.wake()
+        if(self.__thread):
+            self.__thread.join()
+        with self.__cond:
+            if(self.store is not None):
+                self.__spill(len(self.__queue))
+
+    def stats(self):
+        with self.__cond:
+            return {
+                'depth': len(self.__queue),
+                'max_depth': self.max_depth,
+                'mean_depth': round(self.__depth_sum / max(1, self.submitted), 2),
+                'stored': len(self.store) if self.store is not None else 0,
+                'submitted': self.submitted,
+                'uploaded': self.uploaded,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'spilled': self.spilled,
+                'failures': self.failures,
+            }
+
+    def __overflow(self, record):
+        if(self.policy == POLICY_COALESCE):
+            self.__queue[-1] = record
+            self.coalesced += 1
+            return True
+        if(self.policy == POLICY_SPILL and self.store is not None):
+            if(not self.__in_flight):
+                self.__spill(1)
+            self.__queue.append(record)
+            return True
+        self.__queue.popleft()
+        self.__queue.append(record)
+        self.dropped += 1
+        return False
+
+    def __spill(self, count):
+        ''' Move the count oldest records in memory to the store. Call with __cond held.
+        '''
+        for _ in range(min(count, len(self.__queue))):
+            record = self.__queue.popleft()
+            if(self.store.put(record.timestamp, record.data)):
+                self.spilled += 1
+
+    def __take(self):
+        ''' Return (batch, from store), records on disk are older than those in memory
+        '''
+        if(self.store is not None and len(self.store)):
+            return self.store.peek(self.batch_size), True
+        with self.__cond:
+            batch = [self.__queue.popleft() for _ in range(min(self.batch_size, len(self.__queue)))]
+            self.__in_flight = bool(batch)
+        return batch, False
+
+    def __upload(self, batch):
+        try:
+            results = list(self.upload(batch))
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            results = []
+        done = 0
+        while(done < len(batch) and done < len(results) and results[done]):
+            done += 1
+        return done
+
+    def __give_back(self, records):
+        ''' Keep records that failed to upload, oldest first. Call with __cond held.
+        '''
+        if(self.store is not None):
+            for record in records:
+                if(self.store.put(record.timestamp, record.data)):
+                    self.spilled += 1
+            return
+        self.__queue.extendleft(reversed(records))
+        while(len(self.__queue) > self.capacity):
+            self.__queue.popleft()
+            self.dropped += 1
+
+    def __wait(self, timeout):
+        with self.__cond:
+            if(not self.__wake and not self.__stop.is_set()):
+                self.__cond.wait(timeout)
+            self.__wake = False
+
+    def __run(self):
+        while(not self.__stop.is_set()):
+            batch, stored = self.__take()
+            if(not batch):
+                with self.__cond:
+                    if(not self.__queue and not self.__stop.is_set()):
+                        self.__cond.wait()
+                    self.__wake = False
+                continue
+            done = self.__upload(batch)
+            self.uploaded += done
+            if(stored and done):
+                self.store.commit(batch[done - 1].position)
+            elif(not stored):
+                with self.__cond:
+                    self.__give_back(batch[done:])
+                    self.__in_flight = False
+                    if(self.store is not None):
+                        # overflow held back during the upload
+                        self.__spill(len(self.__queue) - self.capacity)
+            if(done < len(batch)):
+                self.failures += 1
+                delay = self.backoff.delay(self.__failures)
+                self.__failures += 1
+                logger.info(f'upload {done}/{len(batch)}, try again in {delay:.0f} seconds')
+                self.__wait(delay)
+            else:
+                self.__failures = 0
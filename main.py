@@ -7,10 +7,10 @@
 # @Date   : 12/15/2021, 11:43:57 AM
 
 import serial
-from time import sleep, perf_counter
+from time import sleep, time
 import logging
 from datetime import datetime
-import requests
+from urllib.parse import urlsplit
 import os
 from enum import Enum
 import threading
@@ -19,10 +19,24 @@ from os import listdir
 
 from libs.MEGA2560 import mega2560
 from libs.MEGA2560.mega2560 import Mega2560
+from libs.MEGA2560.frame import SENSOR_KEYS
+from libs.MEGA2560.demux import MapsDemux
+from libs.MEGA2560.history import SensorHistory
+from libs.MEGA2560.sampler import SensorSampler
+from libs.MEGA2560.aggregate import SensorAggregator
+from libs.MEGA2560.snapshot import SnapshotSlot
 from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
 from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
 from libs.SIM7000E.mqtt.mqtt import MQTT
+from libs.SIM7000E.mqtt.manager import MQTTConnectionManager
 from libs.SSD1306.ssd1306 import SSD1306
+from libs.uplink.store import UploadStore
+from libs.uplink.https import HTTPSUplink
+from libs.uplink.prober import ConnectivityProber
+from libs.uplink.worker import UploadWorker, UploadRecord, POLICY_SPILL
+from libs.uplink.selector import UplinkSelector, UplinkPath
+from libs.scheduler.scheduler import Scheduler, EXECUTOR_THREAD
+from libs.retry.retry import breaker_stats
 
 logger = logging.getLogger('maps6')
 logging.basicConfig(
@@ -44,6 +58,16 @@ GET_SENSOR_DATA_INTERVAL = 5  # second
 CHECK_WIFI_INTERVAL = 10  # second
 SAVE_SD_INTERVAL = 60  # second
 REUPLOAD_INTERVAL = 10  # second
+HISTORY_RETENTION = 24 * 60 * 60  # second
+# Upload the mean of each upload window instead of the last sample
+UPLOAD_AGGREGATE = False
+UPLOAD_KEYS = ('CO2', 'TEMP', 'PM2.5_AE', 'HUMI', 'TVOC')
+# Store-and-forward queue of upload records, drained by the active uplink
+UPLOAD_QUEUE_DIR = '/var/lib/maps6/upload_queue'  # off the SD card, it is unmounted at times
+UPLOAD_QUEUE_MAX_BYTES = 16 * 1024 * 1024  # byte, oldest records are evicted beyond it
+UPLOAD_BATCH = 16  # records per upload
+UPLOAD_WORKER_CAPACITY = 32  # records in memory, the oldest spill to UPLOAD_QUEUE_DIR beyond it
+UPLOAD_HEDGE_AFTER = 1  # second per record, a batch also goes out on NB-IoT when WiFi has not answered
 
 # Device config
 DEVIDE_ID = open(
@@ -53,6 +77,7 @@ APP_ID = 'MAPS6'
 
 # HTTPS config (WiFi)
 LASS_REST_URL = 'https://data.lass-net.org/Upload/MAPS-secure.php'
+HTTPS_TIMEOUT = (5, 15)  # second, (connect, read)
 
 # MQTT config (NBIoT)
 BROKER = '35.162.236.171'
@@ -66,7 +91,14 @@ CLEAR_SESSION = True
 TOPIC = f'MAPS/MAPS6/{MQTT_ID}'
 QOS = 1
 
-sensor_data = None
+sensor_slot = SnapshotSlot()  # latest sample, read without a lock
+sensor_history = SensorHistory(HISTORY_RETENTION, GET_SENSOR_DATA_INTERVAL)
+sensor_aggregator = SensorAggregator(UPLOAD_KEYS, invalid={'CO2': 65535})
+https_uplink = HTTPSUplink(LASS_REST_URL, {'topic': APP_ID, 'device_id': DEVIDE_ID, 'key': 'NoKey'},
+                           HTTPS_TIMEOUT)
+# TCP connect to the upload endpoint, WiFi is up when it is reachable
+wifi_prober = ConnectivityProber(urlsplit(LASS_REST_URL).hostname, 443)
+task_scheduler = Scheduler()
 connectionState = ConnectionState.NAN
 nbiot_csq = '-'
 gps_lat = '-'
@@ -76,23 +108,26 @@ nbiot_detected = False
 
 
 def save_sd_task():
-    global sensor_data
-
     path = "/mnt/SD"
     First_line_data = "Device ID,Date,Time,Temperature,Humidity,PM2.5_AE,PM1.0_AE,PM10.0_AE,Illuminance,CO2,TVOC,longitude,latitude"
+    saved_seq = 0
     while(True):
         try:
             sleep(SAVE_SD_INTERVAL)
-            time_pairs = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S").split(' ')
+            # no new sample since the last row
+            snapshot = sensor_slot.newer(saved_seq)
+            if(snapshot is None):
+                continue
+            time_pairs = datetime.utcfromtimestamp(snapshot.timestamp).strftime("%Y-%m-%d %H:%M:%S").split(' ')
             # check is SD card is on the board
             if os.path.exists("/dev/mmcblk2p1"):
                 logger.info("SD exists")
                 # check if path is mountpoint (mounted or not)
                 if(not(os.path.ismount("/mnt/SD"))):
                     os.system(f'mount -v -t auto /dev/mmcblk2p1 {path}')
-                data_list = [DEVIDE_ID, time_pairs[0], time_pairs[1], sensor_data['TEMP'], sensor_data['HUMI'], sensor_data['PM2.5_AE'],
-                             sensor_data['PM1.0_AE'], sensor_data['PM10.0_AE'], sensor_data[
-                                 'Illuminance'], sensor_data['CO2'],  sensor_data['TVOC'],
+                reading = snapshot.reading
+                data_list = [DEVIDE_ID, time_pairs[0], time_pairs[1], reading.temp, reading.humi, reading.pm2_5_ae,
+                             reading.pm1_0_ae, reading.pm10_0_ae, reading.illuminance, reading.co2, reading.tvoc,
                              gps_lon, gps_lat]
                 data = ','.join([str(d) for d in data_list])
                 create_flag = False
@@ -104,6 +139,7 @@ def save_sd_task():
                         logger.info(f'Create file: {filename}')
                         f.write(f'{First_line_data}\n')
                     f.write(f'{data}\n')
+                saved_seq = snapshot.seq
                 logger.info('Save sensor data to SD Card.')
             else:
                 logger.info("NO SD card")
@@ -111,70 +147,162 @@ def save_sd_task():
             logger.error(e, exc_info=True)
 
 
-def NBIoT_publish_to_lass(m_mqtt):
-    global sensor_data
-
-    pairs = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S").split(' ')
-    msg = f"|s_g8={sensor_data['CO2']}|s_t0={sensor_data['TEMP']}|app={APP_ID}|date={pairs[0]}|s_d0={sensor_data['PM2.5_AE']}|s_h0={sensor_data['HUMI']}|device_id={DEVIDE_ID}|s_gg={sensor_data['TVOC']}|ver_app={MAPS_PI_VERSION}|time={pairs[1]}|MQ"
-    gps_data = f"|gps_lon={gps_lon}|gps_lat={gps_lat}"
-    if(gps_lon != '-' and gps_lat != '-'):
-        msg = gps_data + msg
-    logger.info(f'publish message: {msg}')
-    return m_mqtt.publish(TOPIC, msg, QOS)
+def on_sensor_sample(timestamp, reading):
+    if(reading.co2 == 65535):
+        reading = reading._replace(co2=-1)
+    logger.info('='*50)
+    for key, value in zip(SENSOR_KEYS, reading):
+        logger.info(f'{key}: {value}')
+    logger.info('='*50)
+    sensor_slot.publish(timestamp, reading)
+
+
+def upload_values():
+    ''' Values of UPLOAD_KEYS, window mean when UPLOAD_AGGREGATE else the last sample
+    '''
+    snapshot = sensor_slot.latest()
+    values = {key: snapshot.value(key) for key in UPLOAD_KEYS}
+    window_start, summaries = sensor_aggregator.snapshot()
+    for key, summary in summaries.items():
+        if(not summary.count):
+            continue
+        logger.info(f'{key} window: n={summary.count} mean={summary.mean:.2f} min={summary.min} '
+                    f'max={summary.max} std={summary.std:.2f} p50={summary.quantiles[0]:.2f} '
+                    f'p90={summary.quantiles[1]:.2f}')
+        if(UPLOAD_AGGREGATE):
+            values[key] = round(summary.mean, 2)
+    return values
+
+
+def upload_record():
+    ''' Queued upload of the current window
+    '''
+    return {'values': upload_values(), 'gps_lon': gps_lon, 'gps_lat': gps_lat}
+
+
+def lass_message(record):
+    ''' date and time come from the record timestamp, a replayed upload is the same row on LASS
+    '''
+    values = record.data['values']
+    pairs = datetime.utcfromtimestamp(record.timestamp).strftime("%Y-%m-%d %H:%M:%S").split(' ')
+    msg = f"|s_g8={values['CO2']}|s_t0={values['TEMP']}|app={APP_ID}|date={pairs[0]}|s_d0={values['PM2.5_AE']}|s_h0={values['HUMI']}|device_id={DEVIDE_ID}|s_gg={values['TVOC']}|ver_app={MAPS_PI_VERSION}|time={pairs[1]}"
+    if(record.data['gps_lon'] != '-' and record.data['gps_lat'] != '-'):
+        msg = f"|gps_lon={record.data['gps_lon']}|gps_lat={record.data['gps_lat']}" + msg
+    return msg
+
+
+def NBIoT_publish_to_lass(mqtt_manager, records):
+    messages = []
+    for record in records:
+        msg = lass_message(record) + '|MQ'
+        logger.info(f'publish message: {msg}')
+        messages.append((TOPIC, msg))
+    return mqtt_manager.publish_many(messages, QOS)
 
 
 def oled_task():
     global nbiot_csq
-    global sensor_data
 
     oled = SSD1306()
     while True:
         try:
+            snapshot = sensor_slot.latest()
+            if(snapshot is None):
+                sleep(0.3)
+                continue
+            reading = snapshot.reading
             internet_icon = '-'
             if(connectionState == ConnectionState.WIFI):
                 internet_icon = 'W'
                 nbiot_csq = '-'
             elif(connectionState == ConnectionState.NBIOT):
                 internet_icon = 'N'
-            oled.display(DEVIDE_ID, sensor_data['TEMP'], sensor_data['HUMI'], sensor_data['PM2.5_AE'], sensor_data['CO2'],
-                         sensor_data['TVOC'], internet_icon, MAPS_PI_VERSION, nbiot_csq)
+            oled.display(DEVIDE_ID, reading.temp, reading.humi, reading.pm2_5_ae, reading.co2,
+                         reading.tvoc, internet_icon, MAPS_PI_VERSION, nbiot_csq)
             sleep(0.3)
         except Exception as e:
             logger.error(e, exc_info=True)
 
 
-def wifi_upload_to_lass():
-    global sensor_data
+def wifi_upload_to_lass(records):
+    messages = []
+    for record in records:
+        msg = lass_message(record)
+        logger.info(f'upload message: {msg}')
+        messages.append(msg)
+    results = https_uplink.upload_many(messages)
+    if(not all(results)):
+        # confirm the link now rather than at the next probe interval
+        wifi_prober.kick()
+    return results
 
-    pairs = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S").split(' ')
-    msg = f"|s_g8={sensor_data['CO2']}|s_t0={sensor_data['TEMP']}|app={APP_ID}|date={pairs[0]}|s_d0={sensor_data['PM2.5_AE']}|s_h0={sensor_data['HUMI']}|device_id={DEVIDE_ID}|s_gg={sensor_data['TVOC']}|ver_app={MAPS_PI_VERSION}|time={pairs[1]}"
-    gps_data = f"|gps_lon={gps_lon}|gps_lat={gps_lat}"
-    if(gps_lon != '-' and gps_lat != '-'):
-        msg = gps_data + msg
-    logger.info(f'upload message: {msg}')
 
-    get_api = f'{LASS_REST_URL}?topic={APP_ID}&device_id={DEVIDE_ID}&key=NoKey&msg={msg}'
-    try:
-        result = requests.get(get_api)
-        logger.info(f'HTTPS Get Result: {result}')
-        if(result.status_code == 200):
-            return True
-    except Exception as e:
-        logger.error(e, exc_info=True)
-    return False
+def upload_to_lass(records):
+    ''' Upload records through the uplink selector, called from the upload worker.
+        WiFi goes first, NB-IoT takes the batch too when WiFi is slow or failing.
+    '''
+    results = uplink_selector.upload(records)
+    logger.info(f'upload_to_lass result: {sum(results)}/{len(records)}')
+    return results
+
+
+def queue_upload_task():
+    if(sensor_slot.latest() is None):
+        return
+    # never blocks, the upload worker keeps the record until an uplink takes it
+    upload_worker.submit(UploadRecord(int(time()), upload_record()))
+    # start the next upload window
+    sensor_aggregator.snapshot(reset=True)
+
+
+def nbiot_in_use():
+    ''' NB-IoT is the uplink, or the hedge of a degraded WiFi
+    '''
+    return (connectionState == ConnectionState.NBIOT or
+            uplink_selector.degraded(uplink_selector.paths[0]))
+
+
+def check_task():
+    check_connection(m_sim7000e_tcp)
+    check_gps_csq(m_sim7000e_tcp)
+
+
+def on_wifi_state(online):
+    # WiFi changes take effect before the next check_connection
+    global connectionState
+
+    if(online):
+        connectionState = ConnectionState.WIFI
+        upload_worker.wake()
+    elif(connectionState == ConnectionState.WIFI):
+        connectionState = ConnectionState.NAN
+    logger.info(f'connectionState: {connectionState}')
 
 
 def check_connection(sim7000e_tcp):
     global connectionState
     global nbiot_detected
 
-    if(not os.system('ping www.google.com -q -c 1  > /dev/null')):
+    if(wifi_prober.is_online()):
         connectionState = ConnectionState.WIFI
-    elif(nbiot_detected and sim7000e_tcp.network_chkAttach()):
+    elif(nbiot_detected and locked_call(sim7000e_tcp, sim7000e_tcp.network_chkAttach)):
         connectionState = ConnectionState.NBIOT
     else:
         connectionState = ConnectionState.NAN
     logger.info(f'connectionState: {connectionState}')
+    logger.debug(f'upload queue: {upload_queue.stats()}')
+    logger.debug(f'upload worker: {upload_worker.stats()}')
+    logger.debug(f'HTTPS uplink: {https_uplink.stats()}')
+    logger.debug(f'WiFi prober: {wifi_prober.stats()}')
+    logger.debug(f'tasks: {task_scheduler.stats()}')
+    logger.debug(f'circuits: {breaker_stats()}')
+    logger.debug(f'uplinks: {uplink_selector.stats()}')
+
+
+def locked_call(sim7000e_tcp, func):
+    # the MQTT connection manager thread shares the module
+    with sim7000e_tcp.lock:
+        return func()
 
 
 def check_gps_csq(sim7000e_tcp):
@@ -185,10 +313,14 @@ def check_gps_csq(sim7000e_tcp):
 
     if(not nbiot_detected):
         return
-    if(sim7000e_tcp.network_chkAttach()):
-        nbiot_csq = sim7000e_tcp.network_getCsq()
-    gps_info = sim7000e_tcp.get_gps_info()
+    with sim7000e_tcp.lock:
+        if(sim7000e_tcp.network_chkAttach()):
+            nbiot_csq = sim7000e_tcp.network_getCsq()
+        gps_info = sim7000e_tcp.get_gps_info()
     logger.debug(gps_info)
+    logger.debug(f'modem state cache (hits, misses): {sim7000e_tcp.state_cache.stats()}')
+    logger.debug(f'MQTT session: {m_mqtt_manager.stats()}')
+    logger.debug(f'modem retries: {sim7000e_tcp.retry.stats()}')
     gps_info_list = gps_info.split(',')
     fix_status = gps_info_list[1]
     if(fix_status == '1'):
@@ -204,6 +336,8 @@ if __name__ == '__main__':
 
     logger.info(f'UPLOAD_INTERVAL: {UPLOAD_INTERVAL}')
     logger.info(f'GET_SENSOR_DATA_INTERVAL: {GET_SENSOR_DATA_INTERVAL}')
+    logger.info(f'HISTORY_RETENTION: {HISTORY_RETENTION}')
+    logger.info(f'UPLOAD_AGGREGATE: {UPLOAD_AGGREGATE}')
     logger.info(f'CHECK_WIFI_INTERVAL: {CHECK_WIFI_INTERVAL}')
     logger.info(f'DEVIDE_ID: {DEVIDE_ID}')
     logger.info(f'MAPS_PI_VERSION: {MAPS_PI_VERSION}')
@@ -221,16 +355,20 @@ if __name__ == '__main__':
     # wait MAPS Boot up
     sleep(5)
 
-    m_adapter = MAPS6Adapter(m_serial)  # UART bridge
-    m_mega2560 = Mega2560(m_serial)  # Sensor, RTC, polling error count
+    m_demux = MapsDemux(m_serial)  # Only reader of ttyAMA0
+    m_adapter = MAPS6Adapter(m_demux)  # UART bridge
+    m_mega2560 = Mega2560(m_demux)  # Sensor, RTC, polling error count
 
     m_sim7000e_tcp = None
     m_mqtt = None
+    m_mqtt_manager = None
 
     try:
-        m_sim7000e_tcp = SIM7000E_TPC(m_adapter)  # SIM7000E TCP Command
+        m_sim7000e_tcp = SIM7000E_TPC(m_adapter, hex_mode=False)  # SIM7000E TCP Command
         m_mqtt = MQTT(m_sim7000e_tcp, BROKER, MQTT_PORT, USERNAME,
                       PASSWORD, KEEPALIVE, MQTT_ID, CLEAR_SESSION)
+        # keeps the session open between uploads while NB-IoT is in use, PINGREQ and reconnects
+        m_mqtt_manager = MQTTConnectionManager(m_mqtt, active=nbiot_in_use)
         nbiot_detected = True
     except Exception as e:
         error = str(e)
@@ -239,9 +377,29 @@ if __name__ == '__main__':
 
     m_mega2560.set_sensor_all_polling()
 
-    publish_timer = perf_counter() + UPLOAD_INTERVAL
-    get_sensor_timer = 0
-    check_wifi_timer = 0
+    uplink_paths = [UplinkPath('wifi', wifi_upload_to_lass, wifi_prober.is_online)]
+    if(nbiot_detected):
+        # the session is only kept while NB-IoT is in use, see nbiot_in_use()
+        uplink_paths.append(UplinkPath(
+            'nbiot', lambda records: NBIoT_publish_to_lass(m_mqtt_manager, records),
+            m_mqtt_manager.connected))
+    uplink_selector = UplinkSelector(uplink_paths, UPLOAD_HEDGE_AFTER)
+    # records that fail to upload, or overflow the memory queue, wait in upload_queue
+    upload_queue = UploadStore(UPLOAD_QUEUE_DIR, max_bytes=UPLOAD_QUEUE_MAX_BYTES)
+    upload_worker = UploadWorker(upload_to_lass, upload_queue, UPLOAD_WORKER_CAPACITY, POLICY_SPILL,
+                                 UPLOAD_BATCH, REUPLOAD_INTERVAL)
+
+    # Get All Sensor Data
+    m_sampler = SensorSampler(
+        m_mega2560, sensor_history, GET_SENSOR_DATA_INTERVAL)
+    m_sampler.add_listener(on_sensor_sample)
+    m_sampler.add_listener(sensor_aggregator.add)
+    m_sampler.start()
+    wifi_prober.add_listener(on_wifi_state)
+    wifi_prober.start()
+    if(nbiot_detected):
+        m_mqtt_manager.start()
+    upload_worker.start()
 
     oled_task_t = threading.Thread(target=oled_task, name="oled_task_t")
     oled_task_t.setDaemon(True)
@@ -253,47 +411,8 @@ if __name__ == '__main__':
     oled_task_t.start()
     save_sd_task_t.start()
 
-    while(True):
-        try:
-            if(perf_counter() > publish_timer):
-                publish_timer = perf_counter() + UPLOAD_INTERVAL
-                result = None
-                if(connectionState == ConnectionState.WIFI):  # using WiFi
-                    result = wifi_upload_to_lass()
-                    if(nbiot_detected):
-                        if(m_mqtt.connected()):
-                            m_mqtt.disconnect()
-                elif(connectionState == ConnectionState.NBIOT):  # using NBIoT
-                    if(not m_mqtt.connected()):
-                        logger.info(
-                            f'm_mqtt disconnect result: {m_mqtt.disconnect()}')
-                        logger.info(
-                            f'm_mqtt connect result: {m_mqtt.connect()}')
-                    result = NBIoT_publish_to_lass(m_mqtt)
-                else:
-                    logger.info(
-                        'There is no valid network, please check if you can connect to WiFi or NB-IoT')
-                if(not result):
-                    publish_timer = perf_counter() + REUPLOAD_INTERVAL
-                    logger.info('Upload failed, try again in 10 seconds.')
-                logger.info(f'upload_to_lass result: {result}')
-
-            # Get All Sensor Data
-            if(perf_counter() > get_sensor_timer):
-                get_sensor_timer = perf_counter() + GET_SENSOR_DATA_INTERVAL
-                sensor_data = m_mega2560.get_sensor_all()
-                if(sensor_data['CO2'] == 65535):
-                    sensor_data['CO2'] = -1
-                logger.info('='*50)
-                for data in sensor_data:
-                    logger.info(f'{data}: {sensor_data[data]}')
-                logger.info('='*50)
-
-            # Check WiFi valid
-            if(perf_counter() > check_wifi_timer):
-                check_wifi_timer = perf_counter() + CHECK_WIFI_INTERVAL
-                check_connection(m_sim7000e_tcp)
-                check_gps_csq(m_sim7000e_tcp)
-        except Exception as e:
-            logger.error(e, exc_info=True)
-        sleep(0.01)
+    # the sensor sampler, prober and MQTT manager run in their own threads,
+    # an uplink stuck in a modem wait only delays its own task
+    task_scheduler.add('queue_upload', queue_upload_task, UPLOAD_INTERVAL, delay_s=UPLOAD_INTERVAL)
+    task_scheduler.add('check_connection', check_task, CHECK_WIFI_INTERVAL, EXECUTOR_THREAD)
+    task_scheduler.run()
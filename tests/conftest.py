@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# conftest.py
+
+import pytest
+import serial
+
+from benchmarks.mega2560_sim import Mega2560Simulator
+from benchmarks.sim7000e_sim import SIM7000ESimulator
+from libs.MEGA2560.demux import MapsDemux
+from libs.SIM7000E.sim_access.adapter import MAPS6Adapter
+from libs.SIM7000E.sim_access.sim7000E_TCP import SIM7000E_TPC
+
+
+@pytest.fixture
+def modem():
+    ''' (SIM7000ESimulator, SIM7000E_TPC) behind the simulated Mega2560 bridge
+    '''
+    module = SIM7000ESimulator()
+    sim = Mega2560Simulator(uart=module).start()
+    port = serial.Serial(sim.port_name, baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    try:
+        yield module, SIM7000E_TPC(MAPS6Adapter(demux), hex_mode=False)
+    finally:
+        demux.close()
+        port.close()
+        sim.stop()
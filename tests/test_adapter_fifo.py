@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_adapter_fifo.py
+
+from libs.SIM7000E.sim_access.adapter import ByteFIFO
+
+
+def test_lines_are_read_in_order():
+    fifo = ByteFIFO()
+    fifo.put(b'\r\n+CIPRXGET: 1\r')
+    assert fifo.readline() == b'\r\n'
+    assert not fifo.has_line()
+    fifo.put(b'\nOK\r\n')
+    assert fifo.readline() == b'+CIPRXGET: 1\r\n'
+    assert fifo.readline() == b'OK\r\n'
+    assert len(fifo) == 0
+
+
+def test_get_and_peek_return_bytes():
+    fifo = ByteFIFO()
+    fifo.put(b'> ')
+    assert fifo.peek(2) == b'> '
+    assert isinstance(fifo.get(2), bytes)
+    assert fifo.readline() == b''
+
+
+def test_overflow_drops_oldest_bytes():
+    fifo = ByteFIFO(capacity=8)
+    fifo.put(b'0123')
+    fifo.put(b'456789')
+    assert fifo.overflow_count == 2
+    assert fifo.getvalue() == b'23456789'
+    fifo.put(b'abcdefghijk')
+    assert fifo.overflow_count == 2 + 11
+    assert fifo.getvalue() == b'defghijk'
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_maps_demux.py
+
+import os
+import time
+
+import pytest
+import serial
+
+from libs.MEGA2560.demux import MapsDemux, MAPS_ECHO_UART_ACTIVE_RX_CMD, FRAME_TIMEOUT
+
+ECHO_CMD = 0xC1  # echoes as AA <cmd> <status> <~status>
+
+
+@pytest.fixture
+def pty_demux():
+    master, slave = os.openpty()
+    port = serial.Serial(os.ttyname(slave), baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    yield master, demux
+    demux.close()
+    port.close()
+    os.close(master)
+    os.close(slave)
+
+
+def test_frames_are_routed(pty_demux):
+    master, demux = pty_demux
+    frames = demux.subscribe([ECHO_CMD])
+    os.write(master, bytes((0xAA, ECHO_CMD, 0x01, 0xFE)))
+    frame = frames.get(timeout=1)
+    assert (frame.cmd, frame.body) == (ECHO_CMD, b'\x01\xfe')
+
+
+def test_stuck_partial_frame_is_dropped(pty_demux):
+    master, demux = pty_demux
+    frames = demux.subscribe([ECHO_CMD])
+    # header of an active RX frame whose length never arrives
+    os.write(master, bytes((0xAA, MAPS_ECHO_UART_ACTIVE_RX_CMD, 0x01)))
+    time.sleep(FRAME_TIMEOUT + 0.3)
+    assert demux.error_count >= 1
+    os.write(master, bytes((0xAA, ECHO_CMD, 0x01, 0xFE)))
+    assert frames.get(timeout=1).cmd == ECHO_CMD
+
+
+def test_close_ends_idle_wait():
+    master, slave = os.openpty()
+    port = serial.Serial(os.ttyname(slave), baudrate=115200, timeout=0.05)
+    demux = MapsDemux(port)
+    # the idle reader blocks without a timeout
+    time.sleep(0.2)
+    start = time.monotonic()
+    demux.close()
+    assert time.monotonic() - start < 0.5
+    port.close()
+    os.close(master)
+    os.close(slave)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_mqtt_codec.py
+
+import pytest
+
+from libs.SIM7000E.mqtt import codec
+
+TOPIC = 'MAPS/MAPS6/B827EB5EE4A1'
+MESSAGE = '|s_g8=612|s_t0=25.31|app=MAPS6|date=2026-10-18|s_d0=7|s_h0=61.2|device_id=B827EB5EE4A1|s_gg=130|time=12:00:00|MQ'
+
+
+@pytest.mark.parametrize('length', [0, 1, 127, 128, 16383, 16384, 2097151, 2097152, 268435455])
+def test_remaining_length_round_trip(length):
+    encoded = codec.encode_remaining_length(length)
+    assert len(encoded) == 1 + (length > 127) + (length > 16383) + (length > 2097151)
+    assert codec.decode_remaining_length(b'\x30' + encoded) == (length, 1 + len(encoded))
+
+
+@pytest.mark.parametrize('length', [-1, 268435456])
+def test_remaining_length_out_of_range(length):
+    with pytest.raises(ValueError):
+        codec.encode_remaining_length(length)
+
+
+@pytest.mark.parametrize('topic, payload, qos, retain, dup', [
+    (TOPIC, MESSAGE, 1, False, False),
+    # the former hex string builder lost the leading zero of characters below 0x10
+    ('sensor/\t溫度', 'PM2.5 = 7 µg/m³\n', 1, True, True),
+    ('a/b', b'\x00\x01\xff' * 10000, 0, False, False),
+])
+def test_publish_round_trip_byte_by_byte(topic, payload, qos, retain, dup):
+    packet_id = 0x1234 if qos else None
+    packet = codec.publish(topic, payload, qos, retain, packet_id, dup)
+    reader = codec.PacketReader()
+    # one byte at a time, like a socket cut anywhere
+    for idx in range(len(packet)):
+        assert reader.read() is None
+        reader.feed(packet[idx:idx + 1])
+    message = codec.decode_publish(reader.read())
+    payload = payload.encode('utf-8') if isinstance(payload, str) else payload
+    assert message == (topic, payload, qos, retain, dup, packet_id)
+    assert len(reader) == 0
+
+
+def test_publish_bytes():
+    assert codec.publish('a/b', 'hi', 1, False, 0x1234) == b'\x32\x09\x00\x03a/b\x12\x34hi'
+
+
+def test_connect_flags():
+    connect = codec.parse(codec.connect('B827EBDD70BA', 'maps', 'pass', 270))[0]
+    assert connect.type == codec.CONNECT
+    # protocol level 4, user name + password + clean session
+    assert connect.body[6:8] == b'\x04\xC2'
+
+
+def test_decode_acks():
+    assert codec.decode_connack(codec.parse(b'\x20\x02\x01\x05')[0]) == (True, 5)
+    assert codec.decode_suback(codec.parse(b'\x90\x03\x00\x07\x01')[0]) == (7, [1])
+    assert codec.decode_packet_id(codec.parse(codec.puback(0xBEEF))[0]) == 0xBEEF
+
+
+def test_parse():
+    assert codec.parse(codec.subscribe(1, 'a', 1))[0] == (codec.SUBSCRIBE, 2, b'\x00\x01\x00\x01a\x01')
+    assert codec.parse(b'\xD0\x00') == (codec.Packet(codec.PINGRESP, 0, b''), 2)
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_mqtt_session.py
+
+from libs.SIM7000E.mqtt import codec
+from libs.SIM7000E.mqtt.mqtt import MQTT
+
+
+def test_pingresp_survives_a_publish(modem):
+    _, tcp = modem
+    mqtt = MQTT(tcp, 'broker.example', 1883, keepAlive_s=60)
+    assert mqtt.connect()
+    # MQTTConnectionManager sends PINGREQ and reads PINGRESP on a later poll()
+    assert mqtt.sendPingReq()
+    assert mqtt.publish('MAPS/MAPS6/TEST', '|s_g8=612|MQ', 1)
+    assert mqtt.publish_many([('MAPS/MAPS6/TEST', '|s_g8=613|MQ')], 1) == [True]
+    assert [packet.type for packet in mqtt.poll()] == [codec.PINGRESP]
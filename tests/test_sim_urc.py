@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_sim_urc.py
+
+import time
+
+
+def test_closed_is_dispatched_without_a_command(modem):
+    module, tcp = modem
+    tcp.connect('broker.example', 1883)
+    assert tcp.connected()
+    commands = module.command_count
+    module.drop_socket()
+    deadline = time.monotonic() + 2
+    while(tcp.connected() and time.monotonic() < deadline):
+        time.sleep(0.05)
+    # served from the state cache the CLOSED handler updated
+    assert not tcp.connected()
+    assert module.command_count == commands
+
+
+def test_data_urc_wakes_waiter(modem):
+    module, tcp = modem
+    tcp.connect('broker.example', 1883)
+    tcp.data_available_flag = False
+    module.push_socket_data(b'hello')
+    start = time.monotonic()
+    assert tcp.wait_available(5000) == 5
+    assert time.monotonic() - start < 1
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_uplink_selector.py
+
+import threading
+import time
+
+import pytest
+
+from libs.uplink.selector import UplinkSelector, UplinkPath
+from libs.uplink.worker import UploadRecord
+
+HEDGE_AFTER = 0.1  # second per record
+
+
+class FakePath(object):
+    def __init__(self, latency=0, ok=True):
+        self.latency = latency
+        self.ok = ok
+        self.calls = 0
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def __call__(self, records):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if(not self.ok):
+            return [False] * len(records)
+        with self.lock:
+            self.delivered.extend(record.timestamp for record in records)
+        return [True] * len(records)
+
+
+def batch(count, first=0):
+    return [UploadRecord(first + idx, {}) for idx in range(count)]
+
+
+@pytest.fixture
+def selectors():
+    created = []
+
+    def make(paths, **kwargs):
+        selector = UplinkSelector(paths, HEDGE_AFTER, **kwargs)
+        created.append(selector)
+        return selector
+    yield make
+    for selector in created:
+        selector.close()
+
+
+def test_latency_is_per_record():
+    path = UplinkPath('wifi', FakePath())
+    path.record(16, 16, 1.6)
+    assert path.latency == pytest.approx(0.1)
+    path.record(1, 1, 0.1)
+    assert path.latency == pytest.approx(0.1)
+
+
+def test_large_batch_on_healthy_primary_is_not_hedged(selectors):
+    # 0.05 s per record is below HEDGE_AFTER, 0.4 s for the batch is not
+    wifi, nbiot = FakePath(0.4), FakePath()
+    selector = selectors([UplinkPath('wifi', wifi), UplinkPath('nbiot', nbiot)])
+    assert selector.upload(batch(8)) == [True] * 8
+    assert nbiot.calls == 0 and selector.hedges == 0
+    assert not selector.degraded(selector.paths[0])
+
+
+def test_stalled_primary_is_hedged_after_deadline_of_batch(selectors):
+    wifi, nbiot = FakePath(2.0), FakePath()
+    selector = selectors([UplinkPath('wifi', wifi), UplinkPath('nbiot', nbiot)])
+    start = time.monotonic()
+    assert selector.upload(batch(4)) == [True] * 4
+    elapsed = time.monotonic() - start
+    assert HEDGE_AFTER * 4 <= elapsed < HEDGE_AFTER * 4 + 0.5
+    assert selector.hedges == 1 and selector.hedge_wins == 4
+    assert nbiot.delivered == [0, 1, 2, 3]
+
+
+def test_failed_primary_fails_over(selectors):
+    wifi, nbiot = FakePath(ok=False), FakePath()
+    selector = selectors([UplinkPath('wifi', wifi), UplinkPath('nbiot', nbiot)])
+    assert selector.upload(batch(3)) == [True] * 3
+    assert selector.failovers == 1
+
+
+def test_unavailable_path_is_not_tried(selectors):
+    # NB-IoT without an MQTT session, e.g. the manager is inactive on WiFi
+    session = threading.Event()
+    wifi, nbiot = FakePath(ok=False), FakePath()
+    selector = selectors([UplinkPath('wifi', wifi), UplinkPath('nbiot', nbiot, session.is_set)])
+    assert selector.upload(batch(2)) == [False, False]
+    assert nbiot.calls == 0
+    session.set()
+    assert selector.upload(batch(2)) == [True, True]
+    assert nbiot.calls == 1
+
+
+def test_delivered_records_are_not_sent_again(selectors):
+    wifi = FakePath()
+    selector = selectors([UplinkPath('wifi', wifi)])
+    assert selector.upload(batch(3)) == [True] * 3
+    assert selector.upload(batch(4)) == [True] * 4
+    assert wifi.delivered == [0, 1, 2, 3]
+    assert selector.deduped == 3
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_upload_store.py
+
+import os
+
+import pytest
+
+from libs.uplink.store import UploadStore, CURSOR_FILE, SEGMENT_PREFIX
+
+RECORD = {'values': {'CO2': 612, 'TEMP': 25.31, 'PM2.5_AE': 7, 'HUMI': 61.2, 'TVOC': 130},
+          'gps_lon': '121.5654', 'gps_lat': '25.0330'}
+BASE = 1760000000
+PERIOD = 300
+
+
+def open_store(directory):
+    return UploadStore(str(directory), segment_bytes=4096, max_bytes=8192, sync=False)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = open_store(tmp_path)
+    for ts in range(100):
+        assert store.put(BASE + ts * PERIOD, RECORD)
+    yield store
+    store.close()
+
+
+def test_eviction_keeps_store_near_max_bytes(store):
+    stats = store.stats()
+    assert stats['bytes'] <= 8192 and stats['evicted'] > 0
+    assert stats['pending'] + stats['evicted'] == 100
+    # the oldest records are the ones evicted
+    assert [r.seq for r in store.peek(5)] == list(range(stats['evicted'], stats['evicted'] + 5))
+
+
+def test_put_refuses_duplicates_in_window(store):
+    assert not store.put(BASE + 99 * PERIOD, RECORD)
+    # a replayed older reading, not only the last one
+    assert not store.put(BASE + 90 * PERIOD, RECORD)
+    assert store.stats()['duplicates'] == 2
+
+
+def test_dedupe_window_is_bounded(tmp_path):
+    store = UploadStore(str(tmp_path), sync=False, dedupe_window=4)
+    for ts in range(10):
+        assert store.put(ts, RECORD)
+    assert not store.put(9, RECORD)
+    assert store.put(0, RECORD)
+    store.close()
+
+
+def test_torn_tail_is_cut_on_open(store, tmp_path):
+    batch = store.peek(5)
+    store.commit(batch[-1].position)
+    pending = len(store)
+    store.close()
+    # power cut in the middle of an append
+    active = max(name for name in os.listdir(tmp_path) if name.startswith(SEGMENT_PREFIX))
+    with open(os.path.join(tmp_path, active), 'ab') as f:
+        f.write(b'0badc0de {"seq":100,"ts":')
+
+    store = open_store(tmp_path)
+    assert store.corrupt == 1
+    assert len(store) == pending
+    assert store.peek(1)[0].seq == batch[-1].seq + 1
+    # the dedupe window is rebuilt from disk
+    assert not store.put(BASE + 98 * PERIOD, RECORD)
+    assert store.put(BASE + 100 * PERIOD, RECORD)
+    assert store.peek(1000)[-1].seq == 100
+    store.close()
+
+
+def test_commit_survives_reopen(store, tmp_path):
+    records = store.peek(1000)
+    store.commit(records[-1].position)
+    assert len(store) == 0 and store.peek(10) == []
+    # an older position does not move the cursor back
+    store.commit(records[0].position)
+    assert len(store) == 0
+    store.close()
+
+    store = open_store(tmp_path)
+    assert len(store) == 0 and store.stats()['segments'] == 1
+    store.close()
+
+
+def test_stale_cursor_replays_records(store, tmp_path):
+    records = store.peek(10)
+    store.commit(records[4].position)
+    cursor = os.path.join(tmp_path, CURSOR_FILE)
+    with open(cursor, 'rb') as f:
+        saved = f.read()
+    store.commit(records[-1].position)
+    store.close()
+    # the cursor update was lost, records are uploaded again, never skipped
+    with open(cursor, 'wb') as f:
+        f.write(saved)
+
+    store = open_store(tmp_path)
+    assert store.peek(1)[0].seq == records[5].seq
+    store.close()